@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for binding the breakpoints the debugger sends at attach time.
+Registers 3000 modules the way attach_process does, then finds the module for
+each of 200 breakpoints, once with the module registry and once with the scan
+of a list of modules it replaced, and reports the time for all of them.
+
+    python breakpoint_binding.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'debuggee'))
+import visualstudio_py_debugger as debugger
+
+MODULE_COUNT = 3000
+BREAKPOINT_COUNT = 200
+
+
+def module_filename(i):
+    return os.path.abspath(os.path.join('site-packages', 'package%d' % (i // 30), 'module%d.py' % i))
+
+
+def scan_modules(modules, filename):
+    """how a breakpoint found its module before the registry"""
+    for modFilename, module in modules:
+        if module.filename.lower() == os.path.abspath(filename).lower():
+            return modFilename, module
+
+
+def measure(find, filenames):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for filename in filenames:
+            assert find(filename) is not None
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    registry = debugger.ModuleRegistry()
+    modules = []
+    for i in range(MODULE_COUNT):
+        filename = module_filename(i)
+        registry.add(filename, {})
+        modules.append((filename, debugger.Module(filename)))
+
+    step = MODULE_COUNT // BREAKPOINT_COUNT
+    filenames = [module_filename(i) for i in range(step - 1, MODULE_COUNT, step)]
+    for label, find in [('list scan', lambda filename: scan_modules(modules, filename)), ('registry', registry.find)]:
+        print('%d breakpoints, %d modules %-10s %10.2f ms' % (
+            len(filenames), MODULE_COUNT, label, measure(find, filenames) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
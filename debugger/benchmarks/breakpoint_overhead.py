@@ -0,0 +1,69 @@
+"""
+Measures how much a break point which is never hit slows down the function
+it's in, with the default trace engine and with --code-patch-breakpoints.
+
+    python breakpoint_overhead.py [path to python for the debuggee]
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+from debuggee_client import DebuggeeClient
+
+TARGET = '''\
+import sys, time
+
+def hot(n):
+    total = 0
+    for i in range(n):
+        total += i
+        if total < 0:
+            total = 0       # BREAK
+    return total
+
+start = time.time()
+for _ in range(20):
+    hot(50000)
+sys.__stdout__.write('ELAPSED %f\\n' % (time.time() - start))
+sys.__stdout__.flush()
+'''
+BREAK_LINE = TARGET.split('\n').index('            total = 0       # BREAK') + 1
+
+
+def run(python, target, launcher_args=(), break_points=True):
+    client = DebuggeeClient(target, python, launcher_args)
+    client.wait_for('LOAD')
+    if break_points:
+        client.set_breakpoint(1, BREAK_LINE, target)
+    client.resume_all()
+    output = client.run_to_exit()
+    for line in output.splitlines():
+        if line.startswith('ELAPSED '):
+            return float(line.split()[1])
+    raise Exception('debuggee did not report its time:\n' + output)
+
+
+def main():
+    python = sys.argv[1] if len(sys.argv) > 1 else sys.executable
+    temp_dir = tempfile.mkdtemp()
+    try:
+        target = os.path.join(temp_dir, 'bp_target.py')
+        f = open(target, 'w')
+        f.write(TARGET)
+        f.close()
+
+        runs = [
+            ('no break points', (), False),
+            ('default engine', (), True),
+            ('code patching', ('--code-patch-breakpoints', ), True),
+        ]
+        for name, launcher_args, break_points in runs:
+            best = min(run(python, target, launcher_args, break_points) for _ in range(3))
+            print('%-20s %8.3fs' % (name, best))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
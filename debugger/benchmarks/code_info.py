@@ -0,0 +1,78 @@
+"""
+Micro-benchmark for what the debuggee works out about a code object on the
+trace hot path and when it sends frames: whether to debug it, its filename
+and its last line.  Runs each over the code objects of a 30 frame call stack,
+once worked out every time the way the debuggee used to and once looked up
+in the code object's CodeInfo, and reports the time per code object.
+
+    python code_info.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'debuggee'))
+import visualstudio_py_debugger as debugger
+
+REPEAT = 20000
+
+
+def should_debug_code(code):
+    """the checks should_debug_code made on every call"""
+    if not debugger.DEBUG_STDLIB and code.co_filename.startswith(sys.prefix):
+        return False
+    for dont_debug_file in debugger.DONT_DEBUG:
+        if debugger.is_same_py_file(code.co_filename, dont_debug_file):
+            return False
+    return True
+
+
+def frame_location(code):
+    """what get_frame_list worked out for every frame it sent"""
+    return os.path.abspath(code.co_filename), debugger.get_code_last_line(code)
+
+
+def cached_frame_location(code):
+    info = debugger.get_code_info(code)
+    return info.filename, info.last_line
+
+
+def recurse(depth):
+    if depth == 0:
+        frames = []
+        frame = sys._getframe()
+        while frame is not None:
+            frames.append(frame.f_code)
+            frame = frame.f_back
+        return frames
+    return recurse(depth - 1)
+
+
+def measure(func, codes):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for _ in range(REPEAT):
+            for code in codes:
+                func(code)
+        elapsed = (time.time() - start) / (REPEAT * len(codes))
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    # a few more files not to debug, like the REPL adds
+    debugger.DONT_DEBUG.extend(['/src/repl.py', '/src/launcher.py'])
+    codes = recurse(30)
+    checks = [
+        ('should_debug_code', should_debug_code, debugger.should_debug_code),
+        ('frame location', frame_location, cached_frame_location),
+    ]
+    for name, uncached, cached in checks:
+        for label, func in [('uncached', uncached), ('cached', cached)]:
+            print('%-18s %-10s %8.3f us' % (name, label, measure(func, codes) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
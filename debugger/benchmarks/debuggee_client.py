@@ -0,0 +1,93 @@
+"""
+Minimal stand in for the debugger frontend used by the benchmarks.  Launches a
+script under visualstudio_py_launcher.py and speaks just enough of the wire
+protocol to set break points and keep the debuggee running.
+
+Works with both Python 2 and Python 3 so the benchmarks can drive debuggees
+running on either.
+"""
+import os
+import socket
+import struct
+import subprocess
+import sys
+
+DEBUGGEE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'debuggee')
+LAUNCHER = os.path.join(DEBUGGEE_DIR, 'visualstudio_py_launcher.py')
+DEBUG_ID = '00000000-0000-0000-0000-000000000000'
+
+
+def write_string(text):
+    data = text.encode('utf-8')
+    return struct.pack('!I', len(data)) + data
+
+
+class DebuggeeClient(object):
+    def __init__(self, script, python=sys.executable, launcher_args=()):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        port = self.listener.getsockname()[1]
+
+        args = [python, LAUNCHER, os.path.dirname(os.path.abspath(script)), str(port), DEBUG_ID]
+        args.extend(launcher_args)
+        args.append(script)
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE)
+
+        self.listener.settimeout(60)
+        self.conn, _ = self.listener.accept()
+        self.conn.settimeout(None)
+        self.buffer = b''
+
+    def _recv_exactly(self, count):
+        while len(self.buffer) < count:
+            data = self.conn.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+        res, self.buffer = self.buffer[:count], self.buffer[count:]
+        return res
+
+    def read_message(self):
+        """returns (4 character command, payload) for the next message"""
+        length, = struct.unpack('!I', self._recv_exactly(4))
+        data = self._recv_exactly(length)
+        return data[:4].decode('ascii'), data[4:]
+
+    def send(self, *parts):
+        self.conn.sendall(b''.join(parts))
+
+    def set_breakpoint(self, brkpt_id, line_no, filename, condition='', break_when_changed=False,
+                       hit_count_kind=0, hit_count=0, log_message='', log_rate_limit=0,
+                       snapshot_count=0, snapshot_max_bytes=0):
+        self.send(b'brkp', struct.pack('!II', brkpt_id, line_no), write_string(filename),
+                  write_string(condition), struct.pack('!III', int(break_when_changed), hit_count_kind, hit_count),
+                  write_string(log_message), struct.pack('!III', log_rate_limit, snapshot_count, snapshot_max_bytes))
+
+    def resume_all(self):
+        self.send(b'resa')
+
+    def detach(self):
+        self.send(b'detc')
+
+    def wait_for(self, command, on_message=None):
+        """processes messages until command is received, returns its payload"""
+        while True:
+            cmd, data = self.read_message()
+            if on_message is not None:
+                on_message(cmd, data)
+            if cmd == command:
+                return data
+
+    def run_to_exit(self, on_message=None):
+        """keeps the debuggee running until it exits, returns its stdout"""
+        try:
+            while True:
+                self.wait_for(None, on_message)
+        except (EOFError, socket.error):
+            pass
+        output = self.process.stdout.read()
+        self.process.wait()
+        self.conn.close()
+        self.listener.close()
+        return output.decode('utf-8', 'replace')
@@ -0,0 +1,163 @@
+"""
+Micro-benchmark for how fast the debugger front end decodes the messages the
+debuggee sends.  Records THRF and CHLD message bodies from 1 KB to 10 MB with
+the debuggee's encoder, then decodes them with MessageDecoder and with the old
+parsing which sliced off each field it read, and reports MB per second.
+
+The front end runs on Python 2, and so does this.
+
+    python decode_messages.py
+"""
+import os
+import struct
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'debuggee'))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'plugins', 'debugger'))
+import visualstudio_py_debugger as debugger
+from message_decoder import MessageDecoder
+
+SIZES = [1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+# the slicing parser takes minutes on anything bigger
+SLICING_MAX_SIZE = 1024 * 1024
+CHLD_HEADER = struct.Struct('!IIIIIII')
+
+
+def record_thrf(size):
+    """a frame list of about size bytes"""
+    frame_vars = [(u'local_%d' % i, u'int') for i in range(10)]
+    frame = debugger._ByteBuffer()
+    debugger.write_frame(frame, (10, 20, 15, u'func', u'/src/module.py', 2, frame_vars, 1, None, None), frame_vars, False)
+    count = max(1, size // frame.size)
+
+    msg = debugger._ByteBuffer()
+    msg.write_long(1)
+    debugger.write_string(msg, u'MainThread')
+    msg.write_uint(count)
+    msg.write_uint(count)
+    for i in range(count):
+        msg.send(frame.buffer)
+    return msg.getvalue()
+
+
+def record_chld(size):
+    """a page of the children of a list of about size bytes"""
+    child = debugger._ByteBuffer()
+    debugger.write_string(child, u'[1000]')
+    debugger.write_object(child, list, u"[1000, 'some text']", u'', u'list', 2, False, 1000)
+    count = max(1, size // child.size)
+
+    msg = debugger._ByteBuffer()
+    for value in (1, count, 0, 1, 0, 0, count):
+        msg.write_uint(value)
+    for i in range(count):
+        msg.send(child.buffer)
+    return msg.getvalue()
+
+
+def decode_thrf(data):
+    reader = MessageDecoder(data)
+    reader.read_long()
+    reader.read_string()
+    reader.read_uint()
+    frames = reader.read_frames(values=False)
+    assert reader.at_end()
+    return frames
+
+
+def decode_chld(data):
+    reader = MessageDecoder(data)
+    count = reader.unpack(CHLD_HEADER)[-1]
+    children = []
+    for i in range(count):
+        name = reader.read_string()
+        children.append((name, reader.read_object()))
+    assert reader.at_end()
+    return children
+
+
+# the parsing MessageDecoder replaced
+def slice_string(bytes):
+    code = bytes[0]
+    if code == 'N':
+        return '', bytes[1:]
+    size, = struct.unpack('!I', bytes[1:5])
+    string = bytes[5:5+size]
+    if code == 'U':
+        string = string.decode('utf8')
+    return string, bytes[5+size:]
+
+
+def slice_object(bytes):
+    varrepr, bytes = slice_string(bytes)
+    varhex, bytes = slice_string(bytes)
+    vartype, bytes = slice_string(bytes)
+    varflags, varhandle = struct.unpack('!II', bytes[:8])
+    return (varrepr, varhex, vartype, varflags, varhandle), bytes[8:]
+
+
+def slice_thrf(bytes):
+    tname, bytes = slice_string(bytes[8:])
+    fcount, = struct.unpack('!I', bytes[4:8])
+    bytes = bytes[8:]
+    frames = []
+    for f_i in range(fcount):
+        flineno, lineno, curlineno = struct.unpack('!III', bytes[:12])
+        framename, bytes = slice_string(bytes[12:])
+        filename, bytes = slice_string(bytes)
+        argcount, vcount = struct.unpack('!II', bytes[:8])
+        bytes = bytes[8:]
+        vars = []
+        for v_i in range(vcount):
+            varname, bytes = slice_string(bytes)
+            vartype, bytes = slice_string(bytes)
+            vars.append((varname, vartype))
+        frames.append((flineno, lineno, curlineno, framename, filename, argcount, vars))
+    assert len(bytes) == 0
+    return frames
+
+
+def slice_chld(bytes):
+    count, = struct.unpack('!I', bytes[24:28])
+    bytes = bytes[28:]
+    children = []
+    for child in range(count):
+        name, bytes = slice_string(bytes)
+        obj, bytes = slice_object(bytes)
+        children.append((name, obj))
+    assert len(bytes) == 0
+    return children
+
+
+def measure(decode, data):
+    best = None
+    repeat = max(1, (1024 * 1024) // len(data))
+    for _ in range(3):
+        start = time.time()
+        for _ in range(repeat):
+            decode(data)
+        elapsed = (time.time() - start) / repeat
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(data) / best / (1024 * 1024)
+
+
+def main():
+    messages = [
+        ('THRF', record_thrf, decode_thrf, slice_thrf),
+        ('CHLD', record_chld, decode_chld, slice_chld),
+    ]
+    for name, record, decode, slice_decode in messages:
+        for size in SIZES:
+            data = record(size)
+            label = '%s %8d bytes' % (name, len(data))
+            print('%-24s %-10s %10.1f MB/s' % (label, 'decoder', measure(decode, data)))
+            if len(data) <= SLICING_MAX_SIZE:
+                assert decode(data) == slice_decode(data)
+                print('%-24s %-10s %10.1f MB/s' % (label, 'slicing', measure(slice_decode, data)))
+
+
+if __name__ == '__main__':
+    main()
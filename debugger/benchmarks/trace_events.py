@@ -0,0 +1,98 @@
+"""
+Micro-benchmark for the debuggee's trace functions.  Runs a workload under
+sys.settrace in process, once with Thread.trace_generic handling every event
+and once with the trace function specialized for the thread's state, and
+reports how many trace events each one handles per second.
+
+    python trace_events.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'debuggee'))
+import visualstudio_py_debugger as debugger
+
+
+def leaf(x):
+    return x + 1
+
+def workload(n):
+    total = 0
+    for i in range(n):
+        total = leaf(total)
+        if total < 0:
+            total = 0       # break point, never hit
+    return total
+
+BREAK_LINE = workload.__code__.co_firstlineno + 5
+ITERATIONS = 200000
+
+
+def count_events(trace_func):
+    """counts the events the interpreter delivers to trace_func for the workload"""
+    counts = [0]
+    def wrap(func):
+        def counter(frame, event, arg):
+            counts[0] += 1
+            res = func(frame, event, arg)
+            if res is None:
+                return None
+            return wrap(res)
+        return counter
+
+    sys.settrace(wrap(trace_func))
+    try:
+        workload(ITERATIONS)
+    finally:
+        sys.settrace(None)
+    return counts[0]
+
+
+def time_workload(trace_func):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        sys.settrace(trace_func)
+        try:
+            workload(ITERATIONS)
+        finally:
+            sys.settrace(None)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def measure(name, cur_thread):
+    generic = cur_thread.trace_generic
+    cur_thread.update_trace_func()
+    specialized = cur_thread.trace_func
+
+    for label, trace_func in (('generic', generic), ('specialized', specialized)):
+        # the specialized functions hand off to trace_func when they're not it
+        cur_thread.trace_func = trace_func
+        events = count_events(trace_func)
+        elapsed = time_workload(trace_func)
+        print('%-32s %-12s %9d events %8.3fs %12.0f events/s' % (name, label, events, elapsed, events / elapsed))
+
+
+def main():
+    debugger.DETACHED = False
+    cur_thread = debugger.Thread()
+    debugger.THREADS[cur_thread.id] = cur_thread
+
+    measure('running, no break points', cur_thread)
+
+    debugger.add_break_point(workload.__code__.co_filename, False, None, BREAK_LINE, 1)
+    measure('break point in workload', cur_thread)
+
+    # step over a call to the workload from a frame which isn't traced
+    debugger.remove_break_point(workload.__code__.co_filename, BREAK_LINE, 1)
+    cur_thread.stepping = debugger.STEPPING_OVER
+    measure('stepping over the workload', cur_thread)
+    cur_thread.stepping = debugger.STEPPING_NONE
+
+
+if __name__ == '__main__':
+    main()
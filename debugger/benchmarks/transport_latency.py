@@ -0,0 +1,106 @@
+"""
+Micro-benchmark for the round trip time of the transports the debuggee can
+connect back over, TCP on 127.0.0.1 and a Unix domain socket.  A child
+process connects the way the debuggee does and echoes every command back as
+a message, reading and writing with the debuggee's own reader and encoder.
+Reports the round trip time for small commands and the throughput for big
+ones.
+
+    python transport_latency.py
+"""
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'debuggee'))
+import visualstudio_py_debugger as debugger
+import visualstudio_py_repl
+
+# (payload size, round trips)
+PAYLOADS = [(16, 20000), (64 * 1024, 2000)]
+
+
+def echo(address):
+    """the debuggee end, echoes each length prefixed command back"""
+    conn = visualstudio_py_repl.connect_socket(address)
+    reader = debugger._SocketReader(conn)
+    wrapper = debugger._NetstringWrapper(conn)
+    while True:
+        try:
+            size = debugger.read_uint(reader)
+        except EOFError:
+            break
+        payload = reader.read(size)
+        with wrapper as out:
+            out.send(payload)
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def measure(conn, size, count):
+    command = struct.pack('!I', size) + b'x' * size
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for _ in range(count):
+            conn.sendall(command)
+            length, = struct.unpack('!I', recv_exactly(conn, 4))
+            recv_exactly(conn, length)
+        elapsed = (time.time() - start) / count
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(name, listener, address):
+    listener.listen(1)
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(address)])
+    conn, _ = listener.accept()
+    try:
+        for size, count in PAYLOADS:
+            elapsed = measure(conn, size, count)
+            print('%-6s %8d bytes %10.1f us per round trip %10.1f MB/s' % (
+                name, size, elapsed * 1e6, 2 * size / elapsed / (1024 * 1024)))
+    finally:
+        conn.close()
+        listener.close()
+        child.wait()
+
+
+def main():
+    tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tcp.bind(('127.0.0.1', 0))
+    run('tcp', tcp, tcp.getsockname()[1])
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print('no Unix domain sockets on this platform')
+        return
+    socket_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(socket_dir, 'debugger.sock')
+        unix = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix.bind(path)
+        run('unix', unix, path)
+    finally:
+        shutil.rmtree(socket_dir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        address = sys.argv[1]
+        echo(int(address) if address.isdigit() else address)
+    else:
+        main()
@@ -0,0 +1,143 @@
+"""
+Micro-benchmark for how fast the debuggee encodes and sends messages.  Sends
+THRF, OUTP and CHLD messages of realistic sizes over a local socket, once with
+the debuggee's encoder and once with a stand in for the old one which packed
+every integer on its own, joined the pieces and sent the length and the body
+separately.  The debuggee's encoder runs once with string interning off, so
+that it is only the encoder that differs, and once with it on.  They take
+turns over several rounds so that noise on the machine hits them alike, and
+it reports the median and best messages per second each one manages.
+
+    python wire_encoder.py
+"""
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'debuggee'))
+import visualstudio_py_debugger as debugger
+
+
+class ListNetstringWrapper(object):
+    """the encoder before it wrote into a reusable buffer"""
+    # it didn't intern strings either
+    interned = None
+
+    def __init__(self):
+        self._data = []
+
+    def send(self, data):
+        self._data.append(data)
+
+    def write_uint(self, value):
+        self._data.append(struct.pack('!I', value))
+
+    def write_long(self, value):
+        self._data.append(struct.pack('!Q', value))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None and self._data:
+            data, self._data = b''.join(self._data), []
+            debugger.conn.send(struct.pack('!I', len(data)))
+            debugger.conn.send(data)
+        return False
+
+
+class UninternedNetstringWrapper(debugger._NetstringWrapper):
+    """the debuggee's encoder with string interning off"""
+    interned = None
+
+    def __enter__(self):
+        self.send(struct.pack('!I', 0))
+        return self
+
+
+def drain(sock):
+    while sock.recv(1024 * 1024):
+        pass
+
+
+def recurse(depth, func):
+    if depth == 0:
+        return func(sys._getframe())
+    return recurse(depth - 1, func)
+
+
+def thrf_message(cur_thread, chain):
+    def send():
+        # a full frame list every time, not the changes since the last one
+        cur_thread.frames_sent = None
+        cur_thread.send_frame_list(chain, 'MainThread')
+    return send
+
+
+def outp_message(line):
+    def send():
+        with debugger._SendLockCtx, debugger._NetstringConn as conn:
+            conn.send(debugger.OUTP)
+            conn.write_long(1)
+            debugger.write_string(conn, line)
+    return send
+
+
+def chld_message(children):
+    page = children.get_page(0, 100)
+    def send():
+        debugger.report_children(1, children, 0, page)
+    return send
+
+
+ROUNDS = 9
+
+
+def time_round(send, count):
+    start = time.time()
+    for _ in range(count):
+        send()
+    return count / (time.time() - start)
+
+
+def measure(send, count, encoders):
+    rates = dict((label, []) for label, encoder in encoders)
+    for _ in range(ROUNDS):
+        for label, encoder in encoders:
+            debugger._NetstringConn = encoder
+            rates[label].append(time_round(send, count))
+    for label, encoder in encoders:
+        label_rates = sorted(rates[label])
+        yield label, label_rates[len(label_rates) // 2], label_rates[-1]
+
+
+def main():
+    debugger.conn, reader = socket.socketpair()
+    drainer = threading.Thread(target = drain, args = (reader, ))
+    drainer.daemon = True
+    drainer.start()
+
+    cur_thread = debugger.Thread()
+    chain = recurse(30, cur_thread.get_frame_chain)
+    data = dict(('key%d' % i, [i, str(i) * 10]) for i in range(100))
+    messages = [
+        ('THRF, %d frames' % len(chain), thrf_message(cur_thread, chain), 1000),
+        ('OUTP, 80 characters', outp_message(u'x' * 79 + u'\n'), 50000),
+        ('CHLD, 100 children', chld_message(debugger.ChildList(data)), 1000),
+    ]
+
+    encoders = [
+        ('list join', ListNetstringWrapper()),
+        ('buffered', UninternedNetstringWrapper()),
+        ('interned', debugger._NetstringConn),
+    ]
+    for name, send, count in messages:
+        for label, median, best in measure(send, count, encoders):
+            print('%-20s %-10s %10.0f messages/s median %10.0f best' % (name, label, median, best))
+
+
+if __name__ == '__main__':
+    main()
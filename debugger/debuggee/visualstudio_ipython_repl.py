@@ -278,7 +278,7 @@ def __visualstudio_debugger_init():
     sys.path.append(''' + repr(path.dirname(__file__)) + ''')
     import visualstudio_py_debugger
     new_thread = visualstudio_py_debugger.new_thread()
-    sys.settrace(new_thread.trace_func)
+    new_thread.start_tracing()
     visualstudio_py_debugger.intercept_threads(True)
 
 __visualstudio_debugger_init()
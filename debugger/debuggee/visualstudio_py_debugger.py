@@ -21,16 +21,27 @@ except ImportError:
     import _thread as thread
 import socket
 import struct
+import codecs
 import weakref
 import traceback
 import types
 import bisect
+import gc
+import time
+try:
+    import zlib
+except ImportError:
+    zlib = None
 try:
     import visualstudio_py_repl
 except ImportError:
     # in the attach scenario, visualstudio_py_repl should already be defined
     visualstudio_py_repl
+import os
 from os import path
+import ast
+import fnmatch
+import re
 
 try:
     xrange
@@ -54,7 +65,6 @@ def thread_creator(func, args, kwargs = {}):
 _start_new_thread = thread.start_new_thread
 THREADS = {}
 THREADS_LOCK = thread.allocate_lock()
-MODULES = []
 
 BREAK_ON_SYSTEMEXIT_ZERO = False
 DEBUG_STDLIB = False
@@ -71,6 +81,55 @@ BREAKPOINTS = {}
 DJANGO_BREAKPOINTS = {}
 
 BREAK_WHEN_CHANGED_DUMMY = object()
+
+# break point hit count kinds
+HIT_COUNT_NONE = 0
+HIT_COUNT_EQUAL = 1         # break on the Nth hit
+HIT_COUNT_AT_LEAST = 2      # break on the Nth hit and every one after it
+HIT_COUNT_MULTIPLE = 3      # break on every Nth hit
+
+# conditions which take longer than this (in seconds) to evaluate on average get
+# disabled, as do ones which raise MAX_CONDITION_ERRORS times in a row
+CONDITION_TIME_BUDGET = 0.1
+MAX_CONDITION_ERRORS = 3
+
+# log points send at most this many messages a second each unless they ask for
+# their own limit, the ones over the limit get counted and reported as dropped
+LOG_POINT_RATE_LIMIT = 100
+# log point and snapshot output is sent in batches this often (in seconds), or
+# as soon as LOG_POINT_BATCH_SIZE messages are waiting
+LOG_POINT_FLUSH_INTERVAL = 0.1
+LOG_POINT_BATCH_SIZE = 200
+# the optional local log file gets rotated when it grows past this size
+LOG_POINT_FILE = None
+LOG_POINT_FILE_MAX_BYTES = 1024 * 1024
+LOG_POINT_FILE_BACKUPS = 3
+
+# snapshots get cut down to fit in this many bytes unless they ask for their
+# own limit, and the reprs in them to this many characters
+SNAPSHOT_MAX_BYTES = 64 * 1024
+SNAPSHOT_REPR_LIMIT = 256
+
+# values get shown with at most this many characters, containers with at most
+# REPR_MAX_ITEMS items and REPR_MAX_DEPTH levels of nesting.  Once formatting
+# the values for one stop or request from the debugger has taken 
+# REPR_TIME_BUDGET seconds the rest just show their type.
+REPR_MAX_LENGTH = 512
+REPR_MAX_ITEMS = 100
+REPR_MAX_DEPTH = 3
+REPR_TIME_BUDGET = 1.0
+
+# NumPy arrays with up to this many elements get their min, max, mean and NaN
+# count shown, and slices of arrays get sent in blocks of at most
+# ARRAY_SLICE_MAX_BYTES (but always at least one row)
+ARRAY_STATS_MAX_SIZE = 1000 * 1000
+ARRAY_SLICE_MAX_BYTES = 1024 * 1024
+
+# frame lists have the innermost FRAME_PAGE_SIZE frames of a thread, the
+# debugger asks for the rest a page at a time (frms)
+FRAME_PAGE_SIZE = 50
+
+timer = getattr(time, 'perf_counter', time.time)
 # lock for calling .send on the socket
 send_lock = thread.allocate_lock()
 
@@ -99,17 +158,90 @@ class _SendLockContextManager(object):
 _SendLockCtx = _SendLockContextManager()
 
 
-class _NetstringWrapper(object):
+# precompiled structs for the integers in messages
+_UINT = struct.Struct('!I')
+_LONG = struct.Struct('!Q')
+
+_UINT2 = struct.Struct('!II')
+_UINT3 = struct.Struct('!III')
+_INT = struct.Struct('!i')
+
+class _ByteBuffer(object):
+    """encodes a message into a bytearray which gets reused for the next one
+       after clear()"""
+    # no interning for messages which aren't sent right away, see
+    # write_interned_string
+    interned = None
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # sending bytes is most of what we do, skip a python level call for it
+        self.send = self.buffer.extend
+
+    @property
+    def size(self):
+        return len(self.buffer)
+
+    def write_uint(self, value):
+        self.send(_UINT.pack(value))
+
+    def write_long(self, value):
+        self.send(_LONG.pack(value))
+
+    def clear(self):
+        del self.buffer[:]
+
+    def getvalue(self):
+        return bytes(self.buffer)
+
+class _NetstringWrapper(_ByteBuffer):
+    """sends what gets written to it inside a with block as one length
+       prefixed message with a single sendall"""
+    # ids of the strings the debugger has been sent to intern, one table for
+    # the connection every wrapper writes to.  Cleared when we attach.
+    interned = {}
+
     def __init__(self, conn=None):
-        self._data = []
+        _ByteBuffer.__init__(self)
         self._conn = conn
-
-    def send(self, data):
-        # Accumulate the data to send
-        self._data.append(data)
+        # messages with bodies of at least this many bytes get sent compressed,
+        # None until the debugger asks for it (cmpr)
+        self.compress_threshold = None
+        self.compress_level = 1
+        # what compressing has saved and cost so far
+        self.compressed_messages = 0
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+
+    def enable_compression(self, threshold, level):
+        self.compress_level = level
+        self.compress_threshold = threshold
+
+    def compression_ratio(self):
+        if not self.compressed_bytes:
+            return 1.0
+        return self.uncompressed_bytes / float(self.compressed_bytes)
+
+    def compress(self):
+        """the message wrapped in a ZLIB message, or None if compressing
+           doesn't make it any smaller"""
+        size = len(self.buffer) - 4
+        start = timer()
+        data = zlib.compress(memoryview(self.buffer)[4:].tobytes(), self.compress_level)
+        self.compress_time += timer() - start
+        self.compressed_messages += 1
+        self.uncompressed_bytes += size
+        if len(data) + 4 >= size:
+            self.compressed_bytes += size
+            return None
+        self.compressed_bytes += len(data) + 4
+        return _UINT.pack(len(data) + 4) + ZLIB + data
 
     def __enter__(self):
-        # Buffer all sends through this object
+        # leave room for the length
+        self.send(_UINT.pack(0))
+        self.interned_count = len(self.interned)
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
@@ -118,14 +250,82 @@ class _NetstringWrapper(object):
             _c = self._conn
         else:
             _c = conn
-        if exc_type is None and self._data:
-            data, self._data = ''.join(self._data), []
-            _c.send(struct.pack('!I', len(data)))
-            _c.send(data)
+        sent = False
+        try:
+            if exc_type is None and len(self.buffer) > 4:
+                message = None
+                threshold = self.compress_threshold
+                if threshold is not None and len(self.buffer) - 4 >= threshold:
+                    message = self.compress()
+                if message is None:
+                    _UINT.pack_into(self.buffer, 0, len(self.buffer) - 4)
+                    message = self.buffer
+                _c.sendall(message)
+                sent = True
+        finally:
+            self.clear()
+            if not sent and len(self.interned) > self.interned_count:
+                # the debugger never saw the strings this message interned
+                for string, index in list(self.interned.items()):
+                    if index >= self.interned_count:
+                        del self.interned[string]
         return False
 
 _NetstringConn = _NetstringWrapper()
 
+class _SocketReader(object):
+    """reads what the debugger sends in as big a chunk as the socket has ready,
+       and hands it out a field at a time.  Fields get unpacked and strings
+       decoded straight out of the buffer."""
+    def __init__(self, sock, size = 64 * 1024):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # what we've received but not read yet
+        self.start = 0
+        self.end = 0
+
+    def _consume(self, count):
+        """waits for count more bytes, returns where they start"""
+        if self.end - self.start < count:
+            self._fill(count)
+        start = self.start
+        self.start += count
+        return start
+
+    def _fill(self, count):
+        pending = self.end - self.start
+        if not pending:
+            self.start = self.end = 0
+        if self.start + count > len(self.buffer):
+            # move what we have of the field to the front, of a bigger buffer
+            # if it doesn't fit
+            data = self.buffer[self.start:self.end]
+            if count > len(self.buffer):
+                self.buffer = bytearray(max(count, 2 * len(self.buffer)))
+                self.view = memoryview(self.buffer)
+            self.buffer[:pending] = data
+            self.start, self.end = 0, pending
+
+        while self.end - self.start < count:
+            received = self.sock.recv_into(self.view[self.end:])
+            if not received:
+                raise EOFError()
+            self.end += received
+
+    def unpack(self, fmt):
+        """reads one fmt sized field"""
+        return fmt.unpack_from(self.buffer, self._consume(fmt.size))[0]
+
+    def read(self, count):
+        """reads count bytes, the view is only good until the next read"""
+        start = self._consume(count)
+        return self.view[start:start + count]
+
+    def buffered(self):
+        """how many bytes we've received but not read yet"""
+        return self.end - self.start
+
 class _Getch(object):
     """Gets a single character from standard input.  Does not echo to the
 screen."""
@@ -193,6 +393,9 @@ CONN = cmd('CONN')
 ASBR = cmd('ASBR')
 SETL = cmd('SETL')
 THRF = cmd('THRF')
+THRD = cmd('THRD')
+THRL = cmd('THRL')
+FRMS = cmd('FRMS')
 DETC = cmd('DETC')
 NEWT = cmd('NEWT')
 EXTT = cmd('EXTT')
@@ -203,15 +406,33 @@ STPD = cmd('STPD')
 BRKS = cmd('BRKS')
 BRKF = cmd('BRKF')
 BRKH = cmd('BRKH')
+BRKD = cmd('BRKD')
+LOGP = cmd('LOGP')
+SNAP = cmd('SNAP')
+FRMV = cmd('FRMV')
+VALC = cmd('VALC')
+ARRS = cmd('ARRS')
 LOAD = cmd('LOAD')
 EXCE = cmd('EXCE')
 EXCR = cmd('EXCR')
 CHLD = cmd('CHLD')
 OUTP = cmd('OUTP')
-REQH = cmd('REQH')
+ZLIB = cmd('ZLIB')
+CAPS = cmd('CAPS')
 UNICODE_PREFIX = cmd('U')
 ASCII_PREFIX = cmd('A')
 NONE_PREFIX = cmd('N')
+# a string to add to the debugger's interning table, and the id of one in it
+INTERN_PREFIX = cmd('D')
+INTERNED_PREFIX = cmd('I')
+
+# strings past this many get sent in full every time
+INTERNED_STRINGS_MAX = 64 * 1024
+
+# what the debuggee can do beyond the basic protocol, sent in CAPS when the
+# debugger asks for it (caps), so CONN stays as debuggers without it expect
+CAPABILITY_ZLIB = 1
+CAPABILITY_JUST_MY_CODE = 2
 
 def get_thread_from_id(id):
     THREADS_LOCK.acquire()
@@ -240,6 +461,70 @@ def lookup_local(frame, name):
     while bits and obj is not None and type(obj) is types.ModuleType:
         obj = getattr(obj, bits.pop(0), None)
     return obj
+
+# the try statements of each source file we've looked at, by filename, as the
+# file's mtime and what find_exception_handlers found
+EXCEPTION_HANDLERS = {}
+
+def get_exception_handlers(filename):
+    """the exception handlers in a source file, found again only when the file
+       changes.  None if there's no source for it."""
+    try:
+        mtime = os.stat(filename).st_mtime
+    except (OSError, TypeError, ValueError):
+        return None
+    cached = EXCEPTION_HANDLERS.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        f = open(filename, 'rb')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+        handlers = find_exception_handlers(ast.parse(source, filename))
+    except Exception:
+        handlers = None
+    EXCEPTION_HANDLERS[filename] = (mtime, handlers)
+    return handlers
+
+def find_exception_handlers(tree):
+    """the lines each try statement's body covers and what its except clauses
+       catch, as (first line, end line, expressions).  A bare except, or one
+       whose expression isn't a dotted name, catches '*'."""
+    handlers = []
+    # only statements can have try statements in them, leave the expressions be
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        for field in ('body', 'orelse', 'finalbody', 'handlers', 'cases'):
+            children = getattr(node, field, None)
+            if isinstance(children, list):
+                pending.extend(children)
+
+        except_clauses = getattr(node, 'handlers', None)
+        if except_clauses and hasattr(node, 'lineno'):
+            expressions = set()
+            for clause in except_clauses:
+                caught = clause.type
+                if isinstance(caught, ast.Tuple):
+                    caught = caught.elts
+                else:
+                    caught = [caught]
+                for expr in caught:
+                    expressions.add(get_dotted_name(expr) or '*')
+            handlers.append((node.lineno, except_clauses[0].lineno, expressions))
+    return handlers
+
+def get_dotted_name(expr):
+    if isinstance(expr, ast.Name):
+        return expr.id
+    if isinstance(expr, ast.Attribute):
+        value = get_dotted_name(expr.value)
+        if value is not None:
+            return value + '.' + expr.attr
+    return None
         
 # These constants come from Visual Studio - enum_EXCEPTION_STATE
 BREAK_MODE_NEVER = 0
@@ -255,26 +540,73 @@ class ExceptionBreakInfo(object):
         '<frozen importlib._bootstrap>': ((None, None, '*'),)
     }
 
+    # the decision caches start over once they get this big
+    CACHE_MAX = 10000
+
     def __init__(self):
         self.default_mode = BREAK_MODE_UNHANDLED
         self.break_on = { }
         self.handler_cache = dict(self.BUILT_IN_HANDLERS)
-        self.handler_lock = thread.allocate_lock()
+        # the mode for each exception type, and whether an exception type
+        # raised at a code offset gets handled in that frame.  Code objects 
+        # which only differ in their filename compare equal, so that's keyed
+        # by id(code) and the entry keeps the code alive.
+        self.mode_cache = {}
+        self.handled_cache = {}
         self.AddException('exceptions.IndexError', BREAK_MODE_NEVER)
         self.AddException('exceptions.KeyError', BREAK_MODE_NEVER)
         self.AddException('exceptions.AttributeError', BREAK_MODE_NEVER)
         self.AddException('exceptions.StopIteration', BREAK_MODE_NEVER)
         self.AddException('exceptions.GeneratorExit', BREAK_MODE_NEVER)
+        self.UpdateBreakOnRaise()
 
     def Clear(self):
         self.default_mode = BREAK_MODE_UNHANDLED
         self.break_on.clear()
         self.handler_cache = dict(self.BUILT_IN_HANDLERS)
+        self.handled_cache = {}
+        self.UpdateBreakOnRaise()
+
+    def SetHandlers(self, filename, handlers):
+        self.handler_cache[filename] = handlers
+        self.handled_cache = {}
+
+    def UpdateBreakOnRaise(self):
+        """tracks whether any exception breaks where it's raised, in which case
+           every frame needs to report its exceptions.  Called once the modes
+           have changed."""
+        self.mode_cache = {}
+        self.break_on_raise = bool(self.default_mode & BREAK_MODE_ALWAYS)
+        for mode in self.break_on.values():
+            if mode & BREAK_MODE_ALWAYS:
+                self.break_on_raise = True
+
+    def GetMode(self, ex_type):
+        """the mode of the nearest class in the exception type's MRO which has
+           one, so subclasses get the mode of the exceptions they derive from"""
+        mode = self.mode_cache.get(ex_type)
+        if mode is not None:
+            return mode
+
+        mode = self.default_mode
+        for cls in getattr(ex_type, '__mro__', (ex_type, )):
+            class_mode = self.break_on.get(cls.__module__ + '.' + cls.__name__)
+            if class_mode is not None:
+                mode = class_mode
+                break
+
+        if len(self.mode_cache) >= self.CACHE_MAX:
+            self.mode_cache = {}
+        self.mode_cache[ex_type] = mode
+        return mode
 
     def ShouldBreak(self, thread, ex_type, ex_value, trace):
+        mode = self.GetMode(ex_type)
+        if not mode & (BREAK_MODE_ALWAYS | BREAK_MODE_UNHANDLED):
+            # exceptions used for control flow, StopIteration, KeyError...
+            return BREAK_TYPE_NONE
+
         probe_stack()
-        name = ex_type.__module__ + '.' + ex_type.__name__
-        mode = self.break_on.get(name, self.default_mode)
         break_type = BREAK_TYPE_NONE
         if mode & BREAK_MODE_ALWAYS:
             if self.IsHandled(thread, ex_type, ex_value, trace):
@@ -299,48 +631,65 @@ class ExceptionBreakInfo(object):
             return False
 
         if trace.tb_next is not None:
-            # don't break if this isn't the top of the traceback
-            return True
+            # don't break if this isn't the top of the traceback, unless the frames
+            # above us ran untraced and so never got to report the exception
+            if not TRACE_ONLY_BREAKPOINT_CODE or trace.tb_next.tb_frame.f_trace is not None:
+                return True
             
         cur_frame = trace.tb_frame
         
-        while should_send_frame(cur_frame) and cur_frame.f_code.co_filename is not None:
-            if not is_same_py_file(cur_frame.f_code.co_filename, __file__):
-                handlers = self.handler_cache.get(cur_frame.f_code.co_filename)
-            
-                if handlers is None:
-                    # req handlers for this file from the debug engine
-                    self.handler_lock.acquire()
-                
-                    with _SendLockCtx, _NetstringConn as conn:
-                        conn.send(REQH)
-                        write_string(conn,cur_frame.f_code.co_filename)
+        while cur_frame is not None:
+            code = cur_frame.f_code
+            key = (ex_type, id(code), cur_frame.f_lasti)
+            entry = self.handled_cache.get(key)
+            if entry is not None:
+                handled = entry[1]
+            else:
+                # frames only get cached once they've passed this check for
+                # the end of the stack
+                if not should_send_frame(cur_frame) or code.co_filename is None:
+                    break
+                handled = self.IsHandledInFrame(cur_frame, ex_type)
+                if len(self.handled_cache) >= self.CACHE_MAX:
+                    self.handled_cache = {}
+                self.handled_cache[key] = code, handled
+            if handled:
+                return True
 
-                    # wait for the handler data to be received
-                    self.handler_lock.acquire()
-                    self.handler_lock.release()
+            cur_frame = cur_frame.f_back
 
-                    handlers = self.handler_cache.get(cur_frame.f_code.co_filename)
+        return False
 
-                if handlers is None:
-                    # no code available, so assume unhandled
-                    return False
+    def IsHandledInFrame(self, frame, ex_type):
+        """whether the frame handles the exception where it is now.  This
+           gets cached by the code and the offset in it, so the names in the
+           except clauses only get looked up the first time."""
+        if is_same_py_file(frame.f_code.co_filename, __file__):
+            return False
 
-                line = cur_frame.f_lineno
-                for line_start, line_end, expressions in handlers:
-                    if line_start is None or line_start <= line < line_end:
-                        if '*' in expressions:
-                            return True
+        # handlers the debugger sent us (sehi) win over what we find
+        handlers = self.handler_cache.get(frame.f_code.co_filename)
+        if handlers is None:
+            handlers = get_exception_handlers(frame.f_code.co_filename)
 
-                        for text in expressions:
-                            try:
-                                res = lookup_local(cur_frame, text)
-                                if res is not None and issubclass(ex_type, res):
-                                    return True
-                            except:
-                                pass
+        if handlers is None:
+            # no source to look at, so we can't tell whether this frame
+            # handles it.  Maybe one further out does.
+            return False
 
-            cur_frame = cur_frame.f_back
+        line = frame.f_lineno
+        for line_start, line_end, expressions in handlers:
+            if line_start is None or line_start <= line < line_end:
+                if '*' in expressions:
+                    return True
+
+                for text in expressions:
+                    try:
+                        res = lookup_local(frame, text)
+                        if res is not None and issubclass(ex_type, res):
+                            return True
+                    except:
+                        pass
 
         return False
     
@@ -365,10 +714,19 @@ def probe_stack(depth = 10):
  
 DONT_DEBUG = [__file__]
 def should_debug_code(code):
-    if not DEBUG_STDLIB and code.co_filename.startswith(sys.prefix):
+    info = CODE_INFO.get(id(code)) or get_code_info(code)
+    # DONT_DEBUG only ever gets added to, so its length says whether the 
+    # verdict we have is still good
+    dont_debug_count = len(DONT_DEBUG)
+    if info.dont_debug_count != dont_debug_count:
+        info.debug = not info.excluded and should_debug_file(code.co_filename)
+        info.dont_debug_count = dont_debug_count
+    return info.debug
+
+def should_debug_file(filename):
+    if not DEBUG_STDLIB and filename.startswith(sys.prefix):
         return False
 
-    filename = code.co_filename
     for dont_debug_file in DONT_DEBUG:
         if is_same_py_file(filename, dont_debug_file):
             return False
@@ -379,37 +737,6 @@ attach_lock = thread.allocate()
 attach_sent_break = False
 
 
-def filename_is_same(filename1, filename2):
-    if path.isabs(filename1) and path.isabs(filename2):
-        return path.normcase(filename1) == path.normcase(filename2)
-    return path.normcase(path.basename(filename1)) == path.normcase(path.basename(filename2))
-
-
-def update_all_thread_stacks(blocking_thread):
-    THREADS_LOCK.acquire()
-    all_threads = list(THREADS.values())
-    THREADS_LOCK.release()
-    
-    for cur_thread in all_threads:
-        if cur_thread is blocking_thread:
-            continue
-            
-        cur_thread._block_starting_lock.acquire()
-        if not cur_thread._is_blocked:
-            # release the lock, we're going to run user code to evaluate the frames
-            cur_thread._block_starting_lock.release()        
-                            
-            frames = cur_thread.get_frame_list()
-    
-            # re-acquire the lock and make sure we're still not blocked.  If so send
-            # the frame list.
-            cur_thread._block_starting_lock.acquire()
-            if not cur_thread._is_blocked:
-                cur_thread.send_frame_list(frames)
-    
-        cur_thread._block_starting_lock.release()
-
-
 class DjangoBreakpointInfo(object):
     def __init__(self, filename):
         self._line_locations = None
@@ -500,6 +827,8 @@ class Thread(object):
         self.cur_frame = None
         self.stepping = STEPPING_NONE
         self.unblock_work = None
+        # work the debugger asked for while the thread was doing unblock_work
+        self.queued_work = []
         self._block_lock = thread.allocate_lock()
         self._block_lock.acquire()
         self._block_starting_lock = thread.allocate_lock()
@@ -507,13 +836,23 @@ class Thread(object):
         self._is_working = False
         self.stopped_on_line = None
         self.detach = False
-        self.trace_func = self.trace_func # replace self.trace_func w/ a bound method so we don't need to re-create these regularly
+        self.trace_generic = self.trace_generic # replace self.trace_generic w/ a bound method so we don't need to re-create these regularly
+        self.trace_func = self.trace_generic
         self.prev_trace_func = None
         self.trace_func_stack = []
         self.reported_process_loaded = False
         self.django_stepping = None
+        self.bounded_repr = BoundedRepr()
+        self.full_repr = None
+        self.handles = ObjectHandles()
+        # the frame list we last sent and the thread's frame count at the time,
+        # the next one is sent as the changes to it
+        self.frames_sent = None
+        # the frames we show while we're stopped, frame ids index into it
+        self.frame_table = None
         if sys.platform == 'cli':
             self.frames = []
+        self.make_trace_funcs()
     
     if sys.platform == 'cli':
         # workaround an IronPython bug where we're sometimes missing the back frames
@@ -525,6 +864,9 @@ class Thread(object):
         def pop_frame(self):
             self.frames.pop()
             self.cur_frame = self.frames[-1]
+
+        def sync_frame(self, frame):
+            pass
     else:
         def push_frame(self, frame):
             self.cur_frame = frame
@@ -532,8 +874,98 @@ class Thread(object):
         def pop_frame(self):
             self.cur_frame = self.cur_frame.f_back
 
+        def sync_frame(self, frame):
+            # frames which started running without line tracing can have it 
+            # enabled later on, in which case we never saw their call event
+            self.cur_frame = frame
+
+
+    def make_trace_funcs(self):
+        """builds the trace functions specialized for the states threads spend 
+           most of their time in.  They handle the events which need no work in
+           a few bytecodes and pass everything else on to trace_generic.
+
+           The debugger thread can't call sys.settrace for us, so when it changes
+           our state it just updates self.trace_func, and each specialized 
+           function starts by checking that it's still the one in use."""
+        cur_thread = self
+        trace_generic = self.trace_generic
+        has_breakpoints = BREAKPOINT_INDEX.has_breakpoints
+        breakpoints = BREAKPOINTS
+
+        def trace_running(frame, event, arg):
+            # no break points, not stepping
+            if cur_thread.trace_func is not trace_running:
+                return cur_thread.switch_trace_func(frame, event, arg)
+            if event == 'call':
+                if frame.f_code.co_name != '<module>':
+                    return None
+            elif event == 'line':
+                return trace_running
+            return trace_generic(frame, event, arg)
+
+        def trace_breakpoints(frame, event, arg):
+            # break points are set, not stepping
+            if cur_thread.trace_func is not trace_breakpoints:
+                return cur_thread.switch_trace_func(frame, event, arg)
+            if event == 'line':
+                if frame.f_lineno not in breakpoints:
+                    return trace_breakpoints
+            elif event == 'call':
+                code = frame.f_code
+                if code.co_name != '<module>' and not has_breakpoints(code):
+                    return None
+            return trace_generic(frame, event, arg)
+
+        def trace_stepping_over(frame, event, arg):
+            # stepping over or out, nothing we call can complete the step so
+            # only code which can hit a break point needs tracing
+            if cur_thread.trace_func is not trace_stepping_over:
+                return cur_thread.switch_trace_func(frame, event, arg)
+            if event == 'call':
+                code = frame.f_code
+                if code.co_name != '<module>' and not has_breakpoints(code):
+                    return None
+            return trace_generic(frame, event, arg)
+
+        self.trace_running = trace_running
+        self.trace_breakpoints = trace_breakpoints
+        self.trace_stepping_over = trace_stepping_over
+
+    def update_trace_func(self):
+        """picks the trace function for the thread's current state.  Stepping 
+           into and pending breaks need to see every event so they, and anything
+           unusual, use trace_generic."""
+        if (DETACHED or
+            not TRACE_ONLY_BREAKPOINT_CODE or 
+            BREAK_ON.break_on_raise or
+            DJANGO_DEBUG or
+            DJANGO_BREAKPOINTS or
+            self.prev_trace_func is not None):
+            self.trace_func = self.trace_generic
+            return
 
-    def trace_func(self, frame, event, arg):
+        stepping = self.stepping
+        if stepping == STEPPING_NONE:
+            if BREAKPOINTS:
+                self.trace_func = self.trace_breakpoints
+            else:
+                self.trace_func = self.trace_running
+        elif stepping == STEPPING_OVER or stepping == STEPPING_OUT:
+            self.trace_func = self.trace_stepping_over
+        else:
+            self.trace_func = self.trace_generic
+
+    def switch_trace_func(self, frame, event, arg):
+        """called from a specialized trace function which isn't the thread's 
+           trace function anymore"""
+        trace_func = self.trace_func
+        if event == 'call':
+            # call events come from the thread's global trace function
+            sys.settrace(trace_func)
+        return trace_func(frame, event, arg)
+
+    def trace_generic(self, frame, event, arg):
         try:
             if self.stepping == STEPPING_BREAK and should_debug_code(frame.f_code):
                 if self.cur_frame is None:
@@ -565,7 +997,6 @@ class Thread(object):
                     should_break, bkpt_id = active_bps.should_break(start, end)
                     if should_break:
                         probe_stack()
-                        update_all_thread_stacks(self)
                         self.block(lambda: (report_breakpoint_hit(bkpt_id, self.id), mark_all_threads_for_break()))
                 if not should_break and self.django_stepping:
                     self.django_stepping = None
@@ -574,17 +1005,23 @@ class Thread(object):
 
         if frame.f_code.co_name == '<module>' and frame.f_code.co_filename != '<string>':
             probe_stack()
-            code, module = new_module(frame)
-            if not DETACHED:
+            code, module, is_new = new_module(frame)
+            if not DETACHED and is_new:
                 report_module_load(module)
 
                 # see if this module causes new break points to be bound
-                bound = set()
-                global PENDING_BREAKPOINTS
-                for pending_bp in PENDING_BREAKPOINTS:
-                    if check_break_point(code.co_filename, module, pending_bp.brkpt_id, pending_bp.lineNo, pending_bp.filename, pending_bp.condition, pending_bp.break_when_changed):
-                        bound.add(pending_bp)
-                PENDING_BREAKPOINTS -= bound
+                if PENDING_BREAKPOINTS:
+                    for pending_bp in PENDING_BREAKPOINTS.take(module, MODULES.has_unique_basename(module.filename)):
+                        pending_bp.bind(code.co_filename)
+
+        if self.prev_trace_func is None and is_excluded_code(frame.f_code):
+            # just my code, nothing stops in here or needs counting for a step 
+            # so the frame runs w/o line tracing whatever we're doing.  Code it
+            # calls back into still gets call events.
+            self.pop_frame()
+            if self.trace_func is not self.trace_generic:
+                sys.settrace(self.trace_func)
+            return None
 
         stepping = self.stepping
         if stepping is not STEPPING_NONE:
@@ -612,10 +1049,25 @@ class Thread(object):
             self.trace_func_stack.append(old_trace_func)
             self.prev_trace_func = None  # clear first incase old_trace_func stack overflows
             self.prev_trace_func = old_trace_func(frame, 'call', arg)
+        elif (self.stepping == STEPPING_NONE and 
+              TRACE_ONLY_BREAKPOINT_CODE and 
+              not BREAK_ON.break_on_raise and
+              not TRACE_ENGINE.should_line_trace(frame.f_code)):
+            # nothing can stop in this frame, let it run w/o line tracing.  We'll
+            # re-enable tracing on it if the user starts stepping or sets a 
+            # break point in it while it's still running.
+            self.pop_frame()
+            if self.trace_func is not self.trace_generic:
+                # our state changed while we weren't blocked, switch over to
+                # the specialized trace function
+                sys.settrace(self.trace_func)
+            return None
 
         return self.trace_func
         
     def handle_line(self, frame, arg):
+        self.sync_frame(frame)
+
         if not DETACHED:
             stepping = self.stepping
 
@@ -636,28 +1088,7 @@ class Thread(object):
                     self.block_maybe_attach()
 
             if BREAKPOINTS and blocked_for_stepping is False:
-                bp = BREAKPOINTS.get(frame.f_lineno)
-                if bp is not None:
-                    for (filename, bp_id), (condition, bound) in bp.items():
-                        if filename == frame.f_code.co_filename or (not bound and filename_is_same(filename, frame.f_code.co_filename)):   
-                            if condition:                            
-                                try:
-                                    res = eval(condition.condition, frame.f_globals, frame.f_locals)
-                                    if condition.break_when_changed:
-                                        block = condition.last_value != res
-                                        condition.last_value = res
-                                    else:
-                                        block = res
-                                except:
-                                    block = True
-                            else:
-                                block = True
-
-                            if block:
-                                probe_stack()
-                                update_all_thread_stacks(self)
-                                self.block(lambda: (report_breakpoint_hit(bp_id, self.id), mark_all_threads_for_break()))
-                            break
+                self.check_break_points(frame)
 
         # forward call to previous trace function, if any, updating trace function appropriately
         old_trace_func = self.prev_trace_func
@@ -667,9 +1098,30 @@ class Thread(object):
 
         return self.trace_func
     
+    def check_break_points(self, frame):
+        bp = BREAKPOINTS.get(frame.f_lineno)
+        if bp is not None:
+            code = frame.f_code
+            for (filename, bp_id), (condition, bound) in bp.items():
+                if filename == code.co_filename or (not bound and get_code_info(code).is_same_file(filename)):   
+                    if condition is not None and condition.keep_running:
+                        if condition.should_break(frame, bp_id):
+                            if condition.log_point is not None:
+                                condition.log_point.log(frame, bp_id, self.id)
+                            if condition.snapshot_point is not None:
+                                condition.snapshot_point.capture(self, bp_id)
+                    elif condition is None or condition.should_break(frame, bp_id):
+                        probe_stack()
+                        self.block(lambda: (report_breakpoint_hit(bp_id, self.id), mark_all_threads_for_break()))
+                    break
+
     def handle_return(self, frame, arg):
+        self.sync_frame(frame)
         self.pop_frame()
 
+        if frame.f_code.co_name == '<module>':
+            TRACE_ENGINE.module_executed(frame.f_code)
+
         if not DETACHED:
             stepping = self.stepping
             if stepping is not STEPPING_NONE:
@@ -682,12 +1134,10 @@ class Thread(object):
                         # restore back the module frame for the step out of a module
                         self.push_frame(ModuleExitFrame(frame))
                         self.stepping = STEPPING_NONE
-                        update_all_thread_stacks(self)
                         self.block(lambda: report_step_finished(self.id))
                         self.pop_frame()
                     else:
                         self.stepping = STEPPING_NONE
-                        update_all_thread_stacks(self)
                         self.block(lambda: report_step_finished(self.id))
 
         # forward call to previous trace function, if any
@@ -700,13 +1150,14 @@ class Thread(object):
             self.prev_trace_func = self.trace_func_stack.pop()
         
     def handle_exception(self, frame, arg):
+        self.sync_frame(frame)
+
         if self.stepping == STEPPING_ATTACH_BREAK:
             self.block_maybe_attach()
 
         if not DETACHED and should_debug_code(frame.f_code):
             break_type = BREAK_ON.ShouldBreak(self, *arg)
             if break_type:
-                update_all_thread_stacks(self)
                 self.block(lambda: report_exception(frame, arg, self.id, break_type))
 
         # forward call to previous trace function, if any, updating the current trace function
@@ -750,41 +1201,42 @@ class Thread(object):
                     if stepping == STEPPING_ATTACH_BREAK:
                         self.reported_process_loaded = True
                     return report_process_loaded(self.id)
-        update_all_thread_stacks(self)
-        self.block(block_cond)
+        self.block(block_cond, will_block_now)
     
     def async_break(self):
-        def async_break_send():
-            with _SendLockCtx, _NetstringConn as conn:
-                sent_break_complete = False
-                global SEND_BREAK_COMPLETE
-                if SEND_BREAK_COMPLETE:
-                    # multiple threads could be sending this...
-                    SEND_BREAK_COMPLETE = False
-                    sent_break_complete = True
-                    conn.send(ASBR)
-                    conn.send(struct.pack('!Q', self.id))
+        global SEND_BREAK_COMPLETE
+        with _SendLockCtx:
+            # multiple threads could be sending this...
+            sent_break_complete = SEND_BREAK_COMPLETE
+            SEND_BREAK_COMPLETE = False
 
+        def async_break_send():
             if sent_break_complete:
-                # if we have threads which have not broken yet capture their frame list and 
-                # send it now.  If they block we'll send an updated (and possibly more accurate - if
-                # there are any thread locals) list of frames.
-                update_all_thread_stacks(self)
+                with _SendLockCtx, _NetstringConn as conn:
+                    conn.send(ASBR)
+                    conn.write_long(self.id)
 
         self.stepping = STEPPING_NONE
-        self.block(async_break_send)
+        # the rest of the threads just stop, the debugger asks for the frames
+        # of the ones it shows
+        self.block(async_break_send, sent_break_complete)
 
-    def block(self, block_lambda):
+    def block(self, block_lambda, send_frames = True):
         """blocks the current thread until the debugger resumes it"""
         assert not self._is_blocked
+        # anything logged before we stopped should show up first
+        BREAK_POINT_OUTPUT.flush()
+        self.bounded_repr.reset()
         #assert self.id == thread.get_ident(), 'wrong thread identity' + str(self.id) + ' ' + str(thread.get_ident())    # we should only ever block ourselves
         
-        # send thread frames before we block
-        self.enum_thread_frames_locally()
-        
         self.stopped_on_line = self.cur_frame.f_lineno
-        # need to synchronize w/ sending the reason we're blocking
+        # need to synchronize w/ sending the reason we're blocking, and w/ the
+        # debugger capturing our frames while we're running
         self._block_starting_lock.acquire()
+        self.frame_table = self.get_frame_chain()
+        if send_frames:
+            # send thread frames before we block
+            self.enum_thread_frames_locally()
         self._is_blocked = True
         block_lambda()
         self._block_starting_lock.release()
@@ -794,16 +1246,54 @@ class Thread(object):
             if self.unblock_work is None:
                 break
 
-            # the debugger wants us to do something, do it, and then block again
-            self._is_working = True
-            self.unblock_work()
-            self.unblock_work = None
-            self._is_working = False
+            # the debugger wants us to do something, do it and anything it asked
+            # for while we were busy, and then block again
+            work = self.unblock_work
+            while work is not None:
+                work()
+                self._block_starting_lock.acquire()
+                if self.queued_work:
+                    work = self.queued_work.pop(0)
+                else:
+                    work = self.unblock_work = None
+                    self._is_working = False
+                self._block_starting_lock.release()
                 
         self._block_starting_lock.acquire()
         assert self._is_blocked
         self._is_blocked = False
+        if self._is_working:
+            # the debugger asked for something just as we got resumed, it's
+            # too late for it, and schedule_work released the lock again
+            self._block_lock.acquire()
+            self._is_working = False
+            self.unblock_work = None
+            del self.queued_work[:]
+        self.frame_table = None
         self._block_starting_lock.release()
+        self.full_repr = None
+        self.handles.clear()
+
+        self.update_trace_func()
+        TRACE_ENGINE.thread_resumed(self)
+
+    def start_tracing(self):
+        """starts delivering trace events for the current thread to us"""
+        self.update_trace_func()
+        TRACE_ENGINE.start_thread(self)
+
+    def trace_frame_chain(self, frame, should_trace = None):
+        """enables line tracing on frame and its callers which are running 
+           without a local trace function"""
+        if sys.platform == 'cli':
+            return
+
+        while frame is not None:
+            if (frame.f_trace is None and 
+                (should_trace is None or should_trace(frame.f_code)) and
+                not is_excluded_code(frame.f_code)):
+                frame.f_trace = self.trace_func
+            frame = frame.f_back
 
     def unblock(self):
         """unblocks the current thread allowing it to continue to run"""
@@ -813,41 +1303,41 @@ class Thread(object):
         self._block_lock.release()
 
     def schedule_work(self, work):
-        self.unblock_work = work
-        self.unblock()
+        """runs work on the blocked thread, after any work it's doing.  The
+           caller holds _block_starting_lock."""
+        if self._is_working:
+            self.queued_work.append(work)
+        else:
+            self._is_working = True
+            self.unblock_work = work
+            self.unblock()
 
     def run_on_thread(self, text, cur_frame, execution_id, frame_kind):
         self._block_starting_lock.acquire()
         
         if not self._is_blocked:
             report_execution_error('<expression cannot be evaluated at this time>', execution_id)
-        elif not self._is_working:
-            self.schedule_work(lambda : self.run_locally(text, cur_frame, execution_id, frame_kind))
         else:
-            report_execution_error('<error: previous evaluation has not completed>', execution_id)
+            self.schedule_work(lambda : self.run_locally(text, cur_frame, execution_id, frame_kind))
         
         self._block_starting_lock.release()
 
     def run_on_thread_no_report(self, text, cur_frame, frame_kind):
         self._block_starting_lock.acquire()
         
-        if not self._is_blocked:
-            pass
-        elif not self._is_working:
+        if self._is_blocked:
             self.schedule_work(lambda : self.run_locally_no_report(text, cur_frame, frame_kind))
-        else:
-            pass
         
         self._block_starting_lock.release()
 
-    def enum_child_on_thread(self, text, cur_frame, execution_id, child_is_enumerate, frame_kind):
+    def enum_child_on_thread(self, handle, execution_id, offset, count):
         self._block_starting_lock.acquire()
-        if not self._is_working and self._is_blocked:
-            self.schedule_work(lambda : self.enum_child_locally(text, cur_frame, execution_id, child_is_enumerate, frame_kind))
+        if self._is_blocked:
+            self.schedule_work(lambda : self.enum_child_locally(handle, execution_id, offset, count))
             self._block_starting_lock.release()
         else:
             self._block_starting_lock.release()
-            report_children(execution_id, [], [], False, False)
+            report_children(execution_id, None, offset, [])
 
     def get_locals(self, cur_frame, frame_kind):
         if frame_kind == FRAME_KIND_DJANGO:
@@ -883,7 +1373,8 @@ class Thread(object):
             code = self.compile(text, cur_frame)
             res = eval(code, cur_frame.f_globals, self.get_locals(cur_frame, frame_kind))
             self.locals_to_fast(cur_frame)
-            report_execution_result(execution_id, res)
+            self.bounded_repr.reset()
+            report_execution_result(execution_id, res, self.bounded_repr, self.handles)
         except:
             report_execution_exception(execution_id, sys.exc_info())
 
@@ -893,127 +1384,107 @@ class Thread(object):
         self.locals_to_fast(cur_frame)
         sys.displayhook(res)
 
-    def enum_child_locally(self, text, cur_frame, execution_id, child_is_enumerate, frame_kind):
-        def get_attributes(res):
-            items = []
-            for name in dir(res):
-                if not (name.startswith('__') and name.endswith('__')):
-                    try:
-                        item = getattr(res, name)
-                        if not hasattr(item, '__call__'):
-                            items.append( (name, item) )
-                    except:
-                        # skip this item if we can't display it...
-                        pass
-            return items
-
-        try:
-            if child_is_enumerate:
-                # remove index from eval, then get the index back.
-                index_size = 0
-                enumerate_index = 0
-                for c in reversed(text):
-                    index_size += 1
-                    if c.isdigit():
-                        enumerate_index = enumerate_index * 10 + (ord(c) - ord('0'))
-                    elif c == '[':
-                        text = text[:-index_size]
-                        break
-            
-            code = compile(text, cur_frame.f_code.co_name, 'eval')
-            res = eval(code, cur_frame.f_globals, self.get_locals(cur_frame, frame_kind))
-            
-            if child_is_enumerate:
-                for index, value in enumerate(res):
-                    if enumerate_index == index:
-                        res = value
-                        break
-                else:
-                    # value changed?
-                    report_children(execution_id, [], [], False, False)
-                    return
-            
-            indices_are_index = False
-            indices_are_enumerate = False
-            maybe_enumerate = False
+    def value_chunk_on_thread(self, text, cur_frame, request_id, offset, length):
+        self._block_starting_lock.acquire()
+        if self._is_blocked:
+            self.schedule_work(lambda : self.send_value_chunk(text, cur_frame, request_id, offset, length))
+            self._block_starting_lock.release()
+        else:
+            self._block_starting_lock.release()
+            report_value_chunk(request_id, 0, offset, '')
+
+    def send_value_chunk(self, text, cur_frame, request_id, offset, length):
+        """sends part of the full repr of a value whose repr we cut short.  The
+           full repr is kept until we resume so the rest can be read w/o
+           formatting it again."""
+        key = text, cur_frame
+        if self.full_repr is None or self.full_repr[0] != key:
             try:
-                if isinstance(res, types.GeneratorType):
-                    # go to the except block
-                    raise Exception('generator')
-                elif isinstance(res, dict) or (hasattr(res, 'items') and hasattr(res, 'has_key')):
-                    # dictionary-like object
-                    enum = res.items()
-                else:
-                    # indexable object
-                    enum = enumerate(res)
-                    maybe_enumerate = True
+                code = self.compile(text, cur_frame)
+                res = eval(code, cur_frame.f_globals, self.get_locals(cur_frame, FRAME_KIND_PYTHON))
+                full_repr = safe_repr(res)
+            except:
+                full_repr = '<error evaluating %s: %s>' % (text, sys.exc_info()[1])
+            self.full_repr = key, full_repr
+        full_repr = self.full_repr[1]
+        report_value_chunk(request_id, len(full_repr), offset, full_repr[offset:offset + length])
 
-                indices = []
-                for index, item in enum:
-                    try:
-                        if len(indices) > 10000:
-                            # report at most 10000 items.
-                            indices.append( ('[...]', 'Evaluation halted because sequence included too many items...') )
-                            break
-                        
-                        indices.append( ('[' + repr(index) + ']', item) )
-                        if maybe_enumerate and not indices_are_enumerate:
-                            # check if we can index back into this object, or if we have to use
-                            # enumerate to get values out of it.
-                            try:
-                                fetched = res[index]
-                                if fetched is not item:
-                                    indices_are_enumerate = True
-                            except:
-                                indices_are_enumerate = True
-                                
-                    except:
-                        # ignore bad objects for now...
-                        pass
+    def array_slice_on_thread(self, text, cur_frame, request_id, start, end):
+        self._block_starting_lock.acquire()
+        if self._is_blocked:
+            self.schedule_work(lambda : self.send_array_slice(text, cur_frame, request_id, start, end))
+            self._block_starting_lock.release()
+        else:
+            self._block_starting_lock.release()
+            report_array_slice(request_id, start, None, 'the thread is running')
 
-                indices_are_index = True
-            except:
-                # non-indexable object
-                indices = []
+    def send_array_slice(self, text, cur_frame, request_id, start, end):
+        """sends rows start to end of an array as one block of raw data"""
+        try:
+            code = self.compile(text, cur_frame)
+            res = eval(code, cur_frame.f_globals, self.get_locals(cur_frame, FRAME_KIND_PYTHON))
+            block = get_array_slice(res, start, end)
+        except:
+            report_array_slice(request_id, start, None, '%s: %s' % (sys.exc_info()[0].__name__, sys.exc_info()[1]))
+            return
+        report_array_slice(request_id, start, block)
 
-            report_children(execution_id, get_attributes(res), indices, indices_are_index, indices_are_enumerate)
+    def enum_child_locally(self, handle, execution_id, offset, count):
+        self.bounded_repr.reset()
+        try:
+            children = self.handles.get_children(handle)
+            if children is None:
+                # the handle is from before we last resumed
+                report_children(execution_id, None, offset, [])
+                return
+            page = children.get_page(offset, count, self.bounded_repr)
         except:
-            report_children(execution_id, [], [], False, False)
+            report_children(execution_id, None, offset, [])
+            return
+        report_children(execution_id, children, offset, page, self.bounded_repr, self.handles)
+
+    def get_frame_locals(self, cur_frame):
+        """returns the django source of the frame (or None), the locals of the
+           frame and the names of the variables we show for it"""
+        source_obj = None
+        frame_locals = cur_frame.f_locals
+        if DJANGO_DEBUG:
+            source_obj = get_django_frame_source(cur_frame)
+            if source_obj is not None:
+                frame_locals = self.get_locals(cur_frame, FRAME_KIND_DJANGO)
 
-    def get_frame_list(self):
-        frames = []
-        cur_frame = self.cur_frame
-        
+        if source_obj is not None:
+            var_names = frame_locals
+        elif frame_locals is cur_frame.f_globals:
+            var_names = cur_frame.f_globals
+        else:
+            var_names = cur_frame.f_code.co_varnames
+        return source_obj, frame_locals, var_names
+
+    def get_frame_chain(self, cur_frame = None):
+        """returns the frames we show for the thread, innermost first, starting
+           at cur_frame if we're not stopped"""
+        if cur_frame is None:
+            cur_frame = self.cur_frame
+        chain = []
         while should_send_frame(cur_frame):
-            # calculate the ending line number
-            lineno = cur_frame.f_code.co_firstlineno
-            try:
-                linetable = cur_frame.f_code.co_lnotab
-            except:
-                try:
-                    lineno = cur_frame.f_code.Span.End.Line
-                except:
-                    lineno = -1
-            else:
-                for line_incr in linetable[1::2]:
-                    if sys.version >= '3':
-                        lineno += line_incr
-                    else:
-                        lineno += ord(line_incr)
+            chain.append(cur_frame)
+            cur_frame = cur_frame.f_back
+        return chain
 
-            source_obj = None
-            frame_locals = cur_frame.f_locals
-            if DJANGO_DEBUG:
-                source_obj = get_django_frame_source(cur_frame)
-                if source_obj is not None:
-                    frame_locals = self.get_locals(cur_frame, FRAME_KIND_DJANGO)
+    def get_frame_list(self, bounded_repr = None, values = True, chain = None):
+        """returns the info for the frames in chain, by default all of the
+           thread's frames.  W/o values only the names and type names of the
+           variables are included, and the debugger asks for the values of the
+           frames it shows."""
+        frames = []
+        if chain is None:
+            chain = self.get_frame_chain()
+        
+        for cur_frame in chain:
+            code_info = get_code_info(cur_frame.f_code)
 
-            if source_obj is not None:
-                var_names = frame_locals
-            elif frame_locals is cur_frame.f_globals:
-                var_names = cur_frame.f_globals
-            else:
-                var_names = cur_frame.f_code.co_varnames
+            source_obj, frame_locals, var_names = self.get_frame_locals(cur_frame)
                         
             vars = []
             for var_name in var_names:
@@ -1021,15 +1492,10 @@ class Thread(object):
                     obj = frame_locals[var_name]
                 except:
                     obj = '<undefined>'
-                try:
-                    if sys.version[0] == '2' and type(obj) is types.InstanceType:
-                        type_name = "instance (" + obj.__class__.__name__ + ")"
-                    else:
-                        type_name = type(obj).__name__
-                except:
-                    type_name = 'unknown'
-                    
-                vars.append((var_name, type(obj), safe_repr(obj), safe_hex_repr(obj), type_name, get_object_len(obj)))
+                if values:
+                    vars.append(get_variable_info(var_name, obj, bounded_repr or self.bounded_repr))
+                else:
+                    vars.append((var_name, get_type_name(obj)))
                 
         
             frame_info = None
@@ -1054,17 +1520,17 @@ class Thread(object):
                         0,
                         vars,
                         FRAME_KIND_DJANGO,
-                        get_code_filename(cur_frame.f_code),
+                        code_info.filename,
                         cur_frame.f_lineno
                     )
 
             if frame_info is None:
                 frame_info = (
                     cur_frame.f_code.co_firstlineno,
-                    lineno, 
+                    code_info.last_line, 
                     cur_frame.f_lineno, 
                     cur_frame.f_code.co_name,
-                    get_code_filename(cur_frame.f_code),
+                    code_info.filename,
                     cur_frame.f_code.co_argcount,
                     vars,
                     FRAME_KIND_PYTHON,
@@ -1073,113 +1539,1612 @@ class Thread(object):
                 )
 
             frames.append(frame_info)
-        
-            cur_frame = cur_frame.f_back
                         
         return frames
 
-    def send_frame_list(self, frames, thread_name = None):
+    def send_frame_list(self, chain, thread_name = None):
+        """sends the first page of the frames in chain.  After the first time we
+           send the changes since the frames we last sent, the frames which got
+           pushed and the lines and variables of the rest which changed."""
+        total = len(chain)
+        frames_sent = self.frames_sent
+        count = FRAME_PAGE_SIZE
+        if frames_sent is not None:
+            # end the page where the last one ended so stepping in and out of
+            # deep recursion only sends the frames which were pushed, until
+            # the page grows or shrinks by half a page and we start over
+            old_frames, old_total = frames_sent
+            anchored = total - (old_total - len(old_frames))
+            if FRAME_PAGE_SIZE // 2 <= anchored <= max(len(old_frames), FRAME_PAGE_SIZE) + FRAME_PAGE_SIZE // 2:
+                count = anchored
+        frames = self.get_frame_list(values = False, chain = chain[:count])
+        self.frames_sent = frames, total
+        if frames_sent is not None:
+            self.send_frame_delta(frames_sent, frames, total, thread_name)
+            return
+
         with _SendLockCtx, _NetstringConn as conn:
             conn.send(THRF)
-            conn.send(struct.pack('!Q',self.id))
-            write_string(conn,thread_name)
+            conn.write_long(self.id)
+            write_interned_string(conn,thread_name)
+            conn.write_uint(total)
         
             # send the frame count
-            conn.send(struct.pack('!I', len(frames)))
-            for firstlineno, lineno, curlineno, name, filename, argcount, variables, frameKind, sourceFile, sourceLine in frames:
-                # send each frame    
-                conn.send(struct.pack('!I', firstlineno))
-                conn.send(struct.pack('!I', lineno))
-                conn.send(struct.pack('!I', curlineno))
-        
-                write_string(conn,name)
-                write_string(conn,filename)
-                conn.send(struct.pack('!I', argcount))
-                
-                #conn.send(struct.pack('!I', frameKind))
-                #if frameKind == FRAME_KIND_DJANGO:
-                #    write_string(conn,sourceFile)
-                #    conn.send(struct.pack('!I', sourceLine))
-                
-                conn.send(struct.pack('!I', len(variables)))
-                for name, type_obj, safe_repr_obj, hex_repr_obj, type_name, obj_len in variables:
+            conn.write_uint(len(frames))
+            for frame_info in frames:
+                write_frame(conn, frame_info, frame_info[6], False)
+
+    def send_frame_delta(self, frames_sent, frames, total, thread_name):
+        old_frames, old_total = frames_sent
+        kept_start, kept, changes = get_frame_delta(old_frames, old_total, frames, total)
+        pushed = len(frames) - kept
+        with _SendLockCtx, _NetstringConn as conn:
+            conn.send(THRD)
+            conn.write_long(self.id)
+            write_interned_string(conn,thread_name)
+            conn.write_uint(len(old_frames))
+            conn.write_uint(total)
+            conn.write_uint(kept_start)
+            conn.write_uint(kept)
+
+            conn.write_uint(pushed)
+            for frame_info in frames[:pushed]:
+                write_frame(conn, frame_info, frame_info[6], False)
+
+            conn.write_uint(len(changes))
+            for index, curlineno, var_count, changed_vars in changes:
+                conn.write_uint(index)
+                conn.write_uint(curlineno)
+                conn.write_uint(var_count)
+                conn.write_uint(len(changed_vars))
+                for position, (name, type_name) in changed_vars:
+                    conn.write_uint(position)
                     write_string(conn,name)
-                    
-                    write_object(conn,type_obj, safe_repr_obj, hex_repr_obj, type_name, obj_len)
+                    write_interned_string(conn,type_name)
+
+    def send_frames_on_thread(self, full = False):
+        """sends the thread's frames, in full or as the changes since we last
+           sent them.  A stopped thread sends them itself, the frames of a
+           running one get captured from sys._current_frames()."""
+        self._block_starting_lock.acquire()
+        if full:
+            self.frames_sent = None
+        if self._is_blocked:
+            self.schedule_work(self.enum_thread_frames_locally)
+        else:
+            # holding the lock keeps the thread from stopping and sending its
+            # frames while we send these
+            self.send_frame_list(self.get_frame_chain(get_running_frame(self.id)), get_thread_names().get(self.id))
+        self._block_starting_lock.release()
 
     def enum_thread_frames_locally(self):
-        global threading
-        if threading is None:
-            import threading
-        self.send_frame_list(self.get_frame_list(), getattr(threading.currentThread(), 'name', 'Python Thread'))
+        self.send_frame_list(self.frame_table, get_current_thread_name())
+
+    def frame_page_on_thread(self, start, count):
+        self._block_starting_lock.acquire()
+        if self._is_blocked:
+            self.schedule_work(lambda : self.send_frame_page(start, count))
+        # otherwise the thread is running again, and its frames have changed
+        self._block_starting_lock.release()
+
+    def send_frame_page(self, start, count):
+        """sends the frames after the ones the debugger has"""
+        frames = self.get_frame_list(values = False, chain = self.frame_table[start:start + count])
+        if self.frames_sent is not None and len(self.frames_sent[0]) == start:
+            # the next frame list is sent as the changes to all of these
+            self.frames_sent = self.frames_sent[0] + frames, self.frames_sent[1]
+        report_frame_page(self.id, start, len(self.frame_table), frames)
+
+    def frame_variables_on_thread(self, frame_id, cur_frame):
+        self._block_starting_lock.acquire()
+        if self._is_blocked:
+            self.schedule_work(lambda : self.send_frame_variables(frame_id, cur_frame))
+        # otherwise the thread is running again, and the debugger will ask for
+        # the new frames' variables once it stops
+        self._block_starting_lock.release()
+
+    def send_frame_variables(self, frame_id, cur_frame):
+        source_obj, frame_locals, var_names = self.get_frame_locals(cur_frame)
+        self.bounded_repr.reset()
+        vars = []
+        for var_name in var_names:
+            try:
+                obj = frame_locals[var_name]
+            except:
+                obj = '<undefined>'
+            vars.append(get_variable_info(var_name, obj, self.bounded_repr, self.handles))
+        report_frame_variables(self.id, frame_id, vars)
 
 
+def get_type_name(obj):
+    try:
+        if sys.version[0] == '2' and type(obj) is types.InstanceType:
+            return "instance (" + obj.__class__.__name__ + ")"
+        return type(obj).__name__
+    except:
+        return 'unknown'
+
+def get_frame_key(frame_info):
+    """the parts of a frame's info which stay the same while it runs"""
+    return frame_info[:2] + frame_info[3:6] + frame_info[7:8]
+
+def get_frame_delta(old_frames, old_total, new_frames, new_total):
+    """compares two pages of the innermost frames of a thread which had
+       old_total and new_total frames.  Returns where the frames at the bottom
+       of the new page start in the old page and how many of them are the same
+       there, and (index, current line, variable count, changed variables) for
+       those whose line or variables changed.  Changed variables are (position,
+       (name, type name)) and include the ones past the end of the old
+       variables."""
+    # frames line up by how far they are from the outermost frame, and the
+    # kept frames have to include the outermost one in the new page
+    bottom = new_total - len(new_frames)
+    kept = 0
+    if old_total - len(old_frames) <= bottom:
+        while kept < len(new_frames) and bottom + kept < old_total:
+            old_info = old_frames[old_total - 1 - bottom - kept]
+            if get_frame_key(old_info) != get_frame_key(new_frames[-1 - kept]):
+                break
+            kept += 1
+    kept_start = 0
+    if kept:
+        kept_start = old_total - bottom - kept
+
+    changes = []
+    for index in xrange(len(new_frames) - kept, len(new_frames)):
+        old_info = old_frames[kept_start + index - (len(new_frames) - kept)]
+        new_info = new_frames[index]
+        old_vars = old_info[6]
+        new_vars = new_info[6]
+        changed_vars = [(position, var) for position, var in enumerate(new_vars) if position >= len(old_vars) or old_vars[position] != var]
+        if changed_vars or old_info[2] != new_info[2] or len(old_vars) != len(new_vars):
+            changes.append((index, new_info[2], len(new_vars), changed_vars))
+    return kept_start, kept, changes
+
+def get_variable_info(var_name, obj, bounded_repr, handles = None):
+    obj_repr, truncated = bounded_repr(obj)
+    handle = 0
+    if handles is not None:
+        handle = handles.get_handle(obj)
+    return var_name, type(obj), obj_repr, safe_hex_repr(obj), get_type_name(obj), get_object_len(obj), truncated, handle
+
+def write_frame(conn, frame_info, variables, values = True):
+    firstlineno, lineno, curlineno, name, filename, argcount, _, frameKind, sourceFile, sourceLine = frame_info
+    conn.send(_UINT3.pack(firstlineno, lineno, curlineno))
+
+    write_interned_string(conn,name)
+    write_interned_string(conn,filename)
+    conn.write_uint(argcount)
+    
+    #conn.write_uint(frameKind)
+    #if frameKind == FRAME_KIND_DJANGO:
+    #    write_string(conn,sourceFile)
+    #    conn.write_uint(sourceLine)
+    
+    conn.write_uint(len(variables))
+    if not values:
+        for name, type_name in variables:
+            write_string(conn,name)
+            write_interned_string(conn,type_name)
+        return
+
+    for name, type_obj, safe_repr_obj, hex_repr_obj, type_name, obj_len, truncated, handle in variables:
+        write_string(conn,name)
+        
+        write_object(conn,type_obj, safe_repr_obj, hex_repr_obj, type_name, obj_len, truncated, handle)
 
 threading = None
 
+def get_current_thread_name():
+    global threading
+    if threading is None:
+        import threading
+    return getattr(threading.currentThread(), 'name', 'Python Thread')
+
+def get_thread_names():
+    """returns the names of the threads threading knows about by thread id"""
+    global threading
+    if threading is None:
+        import threading
+    names = {}
+    for thread_obj in threading.enumerate():
+        ident = getattr(thread_obj, 'ident', None)
+        if ident is not None:
+            names[ident] = getattr(thread_obj, 'name', 'Python Thread')
+    return names
+
+def get_running_frame(tid):
+    """returns the frame a running thread is in, skipping any of ours, or None
+       if we can't tell"""
+    try:
+        frame = sys._current_frames().get(tid)
+    except AttributeError:
+        # IronPython w/o -X:Frames
+        return None
+    while frame is not None and frame.f_globals is globals():
+        frame = frame.f_back
+    return frame
+
 class Module(object):
     """tracks information about a loaded module"""
 
     CurrentLoadIndex = 0
 
     
-    def __init__(self, filename):
+    def __init__(self, filename, module_globals = None):
         # TODO: Module.CurrentLoadIndex thread safety
         self.module_id = Module.CurrentLoadIndex
         Module.CurrentLoadIndex += 1
         self.filename = filename
+        self.name = module_globals is not None and module_globals.get('__name__') or None
+        self.module_ref = get_module_ref(self.name, module_globals)
+
+    def is_loaded(self):
+        """whether the module object this load created is still the one in
+           sys.modules.  Code which didn't run as a module in sys.modules, 
+           exec'd code and the like, never counts as loaded."""
+        module = self.module_ref is not None and self.module_ref() or None
+        return module is not None and sys.modules.get(self.name) is module
+
+    def runs_in(self, module_globals):
+        module = self.module_ref is not None and self.module_ref() or None
+        return module is not None and getattr(module, '__dict__', None) is module_globals
+
+def get_module_ref(name, module_globals):
+    module = sys.modules.get(name)
+    if module is None or getattr(module, '__dict__', None) is not module_globals:
+        return None
+    try:
+        return weakref.ref(module)
+    except TypeError:
+        # modules can't be weakly referenced on 2.x, we keep the latest load of
+        # each file alive instead
+        return lambda: module
+
+def normalize_module_path(filename):
+    """the absolute path a module is known by, in the platform's case and with
+       compiled files standing in for their source"""
+    if filename.endswith('.pyc') or filename.endswith('.pyo'):
+        filename = filename[:-1]
+    return path.normcase(path.abspath(filename))
+
+def get_basename_key(filename):
+    return path.normcase(path.basename(filename))
+
+class ModuleRegistry(object):
+    """the latest load of each module by its normalized path, and the paths by
+       file name.  Iterating gives (code filename, Module) pairs."""
+
+    def __init__(self):
+        self.by_path = {}
+        self.by_basename = {}
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def __iter__(self):
+        return iter(list(self.by_path.values()))
+
+    def add(self, code_filename, module_globals):
+        """registers the module the code in code_filename runs in, returns the
+           Module and whether it's newly loaded.  Running the code again in the
+           module while it's loaded, say for a reload, isn't a new load.  Once
+           the module's gone from sys.modules it's unloaded, and running the
+           code again loads it anew."""
+        key = normalize_module_path(code_filename)
+        entry = self.by_path.get(key)
+        if entry is not None and entry[1].is_loaded() and entry[1].runs_in(module_globals):
+            return entry[1], False
+
+        module = Module(path.abspath(code_filename), module_globals)
+        self.by_path[key] = code_filename, module
+        self.by_basename.setdefault(get_basename_key(key), set()).add(key)
+        return module, True
+
+    def find(self, filename):
+        """the (code filename, Module) a break point's file is in, or None.
+           A relative filename finds the one module with that file name."""
+        entry = self.by_path.get(normalize_module_path(filename))
+        if entry is None and not path.isabs(filename):
+            keys = self.by_basename.get(get_basename_key(filename))
+            if keys is not None and len(keys) == 1:
+                for key in keys:
+                    entry = self.by_path[key]
+        return entry
+
+    def has_unique_basename(self, filename):
+        """whether filename is the only module we've seen with its file name,
+           so break points set by file name alone can bind to it"""
+        keys = self.by_basename.get(get_basename_key(filename))
+        return keys is not None and len(keys) == 1
+
+MODULES = ModuleRegistry()
 
 
 class ConditionInfo(object):
-    def __init__(self, condition, break_when_changed):
+    """the condition and hit count of a break point.  The condition is compiled
+       once, and gets disabled if it keeps raising or is too expensive to
+       evaluate, hit counts are checked w/o going through eval.  Break points
+       with a log message are log points which log instead of stopping, and
+       ones which take snapshots capture the stack instead of stopping."""
+
+    def __init__(self, condition, break_when_changed, hit_count_kind = HIT_COUNT_NONE, hit_count = 0, log_message = '', log_rate_limit = 0, snapshot_count = 0, snapshot_max_bytes = 0):
         self.condition = condition
         self.break_when_changed = break_when_changed
         self.last_value = BREAK_WHEN_CHANGED_DUMMY
+        self.hit_count_kind = hit_count_kind
+        self.hit_count = hit_count
+        self.hits = 0
+        self.errors = 0
+        self.eval_count = 0
+        self.eval_time = 0.0
+        self.disabled = False
+        self.code = None
+        self.compile_error = None
+        if condition:
+            try:
+                self.code = compile(condition, '<breakpoint condition>', 'eval')
+            except:
+                # report it each time we'd evaluate it like eval used to
+                self.compile_error = sys.exc_info()[1]
+        if log_message:
+            self.log_point = LogPoint(log_message, log_rate_limit)
+        else:
+            self.log_point = None
+        if snapshot_count:
+            self.snapshot_point = SnapshotPoint(snapshot_count, snapshot_max_bytes)
+        else:
+            self.snapshot_point = None
+        self.keep_running = self.log_point is not None or self.snapshot_point is not None
 
-def get_code(func):
-    return getattr(func, 'func_code', None) or getattr(func, '__code__', None)
-
+    def should_break(self, frame, bp_id):
+        if self.disabled:
+            return False
 
-class DebuggerExitException(Exception): pass
+        if self.condition:
+            start = timer()
+            try:
+                if self.code is None:
+                    raise self.compile_error
+                res = eval(self.code, frame.f_globals, frame.f_locals)
+            except:
+                self.errors += 1
+                if self.errors >= MAX_CONDITION_ERRORS:
+                    exc_type, exc_value = sys.exc_info()[:2]
+                    self.disable(bp_id, 'condition raised %s: %s' % (exc_type.__name__, exc_value))
+                    return False
+                # break so the user can see the condition is failing
+                return True
+
+            self.errors = 0
+            self.eval_count += 1
+            self.eval_time += timer() - start
+            if self.eval_time > CONDITION_TIME_BUDGET * self.eval_count:
+                self.disable(bp_id, 'condition took %.3fs to evaluate on average' % (self.eval_time / self.eval_count))
+
+            if self.break_when_changed:
+                changed = self.last_value != res
+                self.last_value = res
+                if not changed:
+                    return False
+            elif not res:
+                return False
 
-def add_break_point(modFilename, break_when_changed, condition, lineNo, brkpt_id, bound = True):
-    cur_bp = BREAKPOINTS.get(lineNo)
-    if cur_bp is None:
-        cur_bp = BREAKPOINTS[lineNo] = dict()
-    
-    cond_info = None
-    if condition:
-        cond_info = ConditionInfo(condition, break_when_changed)
-    
-    cur_bp[(modFilename, brkpt_id)] = cond_info, bound
+        if self.hit_count_kind == HIT_COUNT_NONE or self.hit_count <= 0:
+            return True
 
-def check_break_point(modFilename, module, brkpt_id, lineNo, filename, condition, break_when_changed):
-    if module.filename.lower() == path.abspath(filename).lower():
-        add_break_point(modFilename, break_when_changed, condition, lineNo, brkpt_id)
-        report_breakpoint_bound(brkpt_id)
+        self.hits += 1
+        if self.hit_count_kind == HIT_COUNT_EQUAL:
+            return self.hits == self.hit_count
+        elif self.hit_count_kind == HIT_COUNT_AT_LEAST:
+            return self.hits >= self.hit_count
+        elif self.hit_count_kind == HIT_COUNT_MULTIPLE:
+            return self.hits % self.hit_count == 0
         return True
-    return False
 
+    def disable(self, bp_id, reason):
+        self.disabled = True
+        report_breakpoint_condition_disabled(bp_id, reason)
 
-class PendingBreakPoint(object):
-    def __init__(self, brkpt_id, lineNo, filename, condition, break_when_changed):
-        self.brkpt_id = brkpt_id
-        self.lineNo = lineNo
-        self.filename = filename
-        self.condition = condition
-        self.break_when_changed = break_when_changed
+def make_condition_info(condition, break_when_changed, hit_count_kind, hit_count, log_message = '', log_rate_limit = 0, snapshot_count = 0, snapshot_max_bytes = 0):
+    if condition or hit_count_kind != HIT_COUNT_NONE or log_message or snapshot_count:
+        return ConditionInfo(condition, break_when_changed, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes)
+    return None
 
-PENDING_BREAKPOINTS = set()
+# the keywords tracepoint messages can use alongside {expression}s
+LOG_POINT_KEYWORDS = ('$FUNCTION', '$CALLER', '$LINE', '$TID', '$CALLSTACK')
+
+def parse_log_message(message):
+    """splits a log point's message into literal text, keywords and {expression}s
+       which get compiled up front.  {{ and }} are literal braces."""
+    parts = []
+    text = []
+    def add_text():
+        if text:
+            parts.append((None, ''.join(text)))
+            del text[:]
+
+    i = 0
+    while i < len(message):
+        c = message[i]
+        if c in '{}' and message[i + 1:i + 2] == c:
+            text.append(c)
+            i += 2
+        elif c == '{' and message.find('}', i) != -1:
+            end = message.find('}', i)
+            expr = message[i + 1:end].strip()
+            add_text()
+            try:
+                parts.append((compile(expr, '<log point>', 'eval'), expr))
+            except:
+                parts.append((None, '<error compiling %s: %s>' % (expr, sys.exc_info()[1])))
+            i = end + 1
+        else:
+            for keyword in LOG_POINT_KEYWORDS:
+                if message.startswith(keyword, i):
+                    add_text()
+                    parts.append((keyword, keyword))
+                    i += len(keyword)
+                    break
+            else:
+                text.append(c)
+                i += 1
+    add_text()
+    return parts
 
-def mark_all_threads_for_break():
-    THREADS_LOCK.acquire()
-    for thread in THREADS.values():
-        thread.stepping = STEPPING_BREAK
-    THREADS_LOCK.release()
+def safe_str(obj):
+    try:
+        if isinstance(obj, (str, unicode)):
+            return obj
+        return str(obj)
+    except:
+        return safe_repr(obj)
+
+def format_call_stack(frame):
+    res = []
+    while should_send_frame(frame) and should_debug_code(frame.f_code):
+        res.append('%s (%s:%d)' % (frame.f_code.co_name, frame.f_code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    return '\n'.join(res)
+
+
+class LogPoint(object):
+    """formats a log point's message from the frame it gets hit in.  Each log
+       point gets rate_limit messages a second, any past that are dropped and
+       counted, and the count gets logged once the second is up."""
+
+    def __init__(self, message, rate_limit = 0):
+        self.message = message
+        self.rate_limit = rate_limit or LOG_POINT_RATE_LIMIT
+        self.parts = parse_log_message(message)
+        self.window_start = 0.0
+        self.window_count = 0
+        self.dropped = 0
+        self.dropped_by = None
+
+    def log(self, frame, bp_id, tid):
+        now = timer()
+        if now - self.window_start >= 1.0:
+            self.report_dropped()
+            self.window_start = now
+            self.window_count = 0
+
+        if self.window_count >= self.rate_limit:
+            if not self.dropped:
+                BREAK_POINT_OUTPUT.dropping(self)
+            self.dropped += 1
+            self.dropped_by = bp_id, tid
+            return
+        self.window_count += 1
+        BREAK_POINT_OUTPUT.add(bp_id, tid, self.format(frame, tid))
+
+    def report_dropped(self):
+        dropped = self.dropped
+        if dropped:
+            self.dropped = 0
+            bp_id, tid = self.dropped_by
+            BREAK_POINT_OUTPUT.add(bp_id, tid, '<%d messages dropped by the rate limit>' % dropped)
+
+    def format(self, frame, tid):
+        res = []
+        for kind, value in self.parts:
+            if kind is None:
+                res.append(value)
+            elif kind == '$FUNCTION':
+                res.append(frame.f_code.co_name)
+            elif kind == '$CALLER':
+                caller = frame.f_back
+                res.append(caller is not None and caller.f_code.co_name or '')
+            elif kind == '$LINE':
+                res.append(str(frame.f_lineno))
+            elif kind == '$TID':
+                res.append(str(tid))
+            elif kind == '$CALLSTACK':
+                res.append(format_call_stack(frame))
+            else:
+                try:
+                    res.append(safe_str(eval(kind, frame.f_globals, frame.f_locals)))
+                except:
+                    exc_type, exc_value = sys.exc_info()[:2]
+                    res.append('<error evaluating %s: %s: %s>' % (value, exc_type.__name__, exc_value))
+        try:
+            return ''.join(res)
+        except UnicodeError:
+            # mixing undecodable byte strings and unicode on 2.x
+            return ''.join([safe_repr(part) for part in res])
+
+
+class SnapshotPoint(object):
+    """captures the stack and locals of the thread which hits it and lets it
+       keep running.  Only the first max_captures hits get captured, and each
+       capture gets cut down to fit in max_bytes."""
+
+    def __init__(self, max_captures, max_bytes = 0):
+        self.max_captures = max_captures
+        self.max_bytes = max_bytes or SNAPSHOT_MAX_BYTES
+        self.captures = 0
+
+    def capture(self, cur_thread, bp_id):
+        if self.captures >= self.max_captures:
+            return
+        self.captures += 1
+
+        frames = cur_thread.get_frame_list(BoundedRepr(max_length = SNAPSHOT_REPR_LIMIT))
+        snapshot = encode_snapshot(bp_id, cur_thread.id, self.captures, get_current_thread_name(), frames, self.max_bytes)
+        BREAK_POINT_OUTPUT.add_snapshot(snapshot)
+
+def encode_snapshot(bp_id, tid, capture, thread_name, frames, max_bytes):
+    """encodes a SNAP message body.  Frames which don't fit in max_bytes get
+       sent w/o their variables, and the stack is cut off once even that
+       doesn't fit."""
+    header = _ByteBuffer()
+    header.write_uint(bp_id)
+    header.write_long(tid)
+    header.write_uint(capture)
+    write_string(header, thread_name)
+
+    body = _ByteBuffer()
+    frame = _ByteBuffer()
+    frame_count = 0
+    truncated = False
+    for frame_info in frames:
+        frame.clear()
+        write_frame(frame, frame_info, frame_info[6])
+        if header.size + body.size + frame.size + 8 > max_bytes:
+            truncated = True
+            frame.clear()
+            write_frame(frame, frame_info, ())
+            if header.size + body.size + frame.size + 8 > max_bytes:
+                break
+        body.send(frame.buffer)
+        frame_count += 1
 
-class DebuggerLoop(object):    
+    header.write_uint(truncated and 1 or 0)
+    header.write_uint(frame_count)
+    return header.getvalue() + body.getvalue()
+
+
+class LogPointFile(object):
+    """local copy of the log point output, rotated through LOG_POINT_FILE_BACKUPS
+       backups once it reaches LOG_POINT_FILE_MAX_BYTES"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.size = 0
+
+    def write(self, messages):
+        if self.file is None:
+            self.file = open(self.filename, 'ab')
+            self.file.seek(0, 2)
+            self.size = self.file.tell()
+
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        for bp_id, tid, text in messages:
+            line = ('%s [%d] [%d] ' % (stamp, bp_id, tid)) + text + '\n'
+            if isinstance(line, unicode):
+                line = line.encode('utf8')
+            self.file.write(line)
+            self.size += len(line)
+        self.file.flush()
+
+        if self.size >= LOG_POINT_FILE_MAX_BYTES:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(LOG_POINT_FILE_BACKUPS - 1, 0, -1):
+            src = '%s.%d' % (self.filename, i)
+            if path.exists(src):
+                dest = '%s.%d' % (self.filename, i + 1)
+                if path.exists(dest):
+                    os.remove(dest)
+                os.rename(src, dest)
+        dest = self.filename + '.1'
+        if path.exists(dest):
+            os.remove(dest)
+        os.rename(self.filename, dest)
+
+
+class BreakPointOutput(object):
+    """queues up log point output and snapshots and sends them to the debugger
+       in batches from a thread of its own, so log points and snapshot points
+       never wait on the socket"""
+
+    def __init__(self):
+        self.lock = thread.allocate_lock()
+        self.flush_lock = thread.allocate_lock()
+        self.pending = []
+        self.dropping_log_points = []
+        self.flushing = False
+        self.file = None
+
+    def add(self, bp_id, tid, text):
+        self.lock.acquire()
+        try:
+            self.pending.append((bp_id, tid, text))
+            start_flushing = not self.flushing
+            self.flushing = True
+            full = len(self.pending) >= LOG_POINT_BATCH_SIZE
+        finally:
+            self.lock.release()
+
+        if start_flushing:
+            _start_new_thread(self.flush_loop, ())
+        if full:
+            self.flush()
+
+    def add_snapshot(self, snapshot):
+        self.add(None, None, snapshot)
+
+    def dropping(self, log_point):
+        """log_point has started dropping messages, we'll report how many once
+           its second is up even if it never gets hit again"""
+        self.lock.acquire()
+        self.dropping_log_points.append(log_point)
+        self.lock.release()
+
+    def flush_loop(self):
+        while not DETACHED:
+            time.sleep(LOG_POINT_FLUSH_INTERVAL)
+            self.flush()
+        self.lock.acquire()
+        self.flushing = False
+        self.lock.release()
+
+    def flush(self, report_all_dropped = False):
+        """sends everything which has been logged so far, called before anything
+           else gets reported to keep the output in order"""
+        if self.dropping_log_points:
+            self.lock.acquire()
+            now = timer()
+            log_points = [log_point for log_point in self.dropping_log_points 
+                          if report_all_dropped or now - log_point.window_start >= 1.0]
+            for log_point in log_points:
+                self.dropping_log_points.remove(log_point)
+            self.lock.release()
+            for log_point in log_points:
+                log_point.report_dropped()
+
+        if not self.pending:
+            return
+        # keeps batches from getting sent out of order
+        self.flush_lock.acquire()
+        try:
+            self.lock.acquire()
+            messages, self.pending = self.pending, []
+            self.lock.release()
+            if not messages:
+                return
+
+            if LOG_POINT_FILE is not None:
+                if self.file is None:
+                    self.file = LogPointFile(LOG_POINT_FILE)
+                try:
+                    self.file.write([message for message in messages if message[0] is not None])
+                except:
+                    # the debugger still gets the output
+                    pass
+            if not DETACHED:
+                log_messages = []
+                for message in messages:
+                    if message[0] is not None:
+                        log_messages.append(message)
+                        continue
+                    if log_messages:
+                        report_log_point_output(log_messages)
+                        log_messages = []
+                    report_snapshot(message[2])
+                if log_messages:
+                    report_log_point_output(log_messages)
+        finally:
+            self.flush_lock.release()
+
+BREAK_POINT_OUTPUT = BreakPointOutput()
+
+def get_code(func):
+    return getattr(func, 'func_code', None) or getattr(func, '__code__', None)
+
+def get_code_last_line(code):
+    lineno = code.co_firstlineno
+    if hasattr(code, 'co_lines'):
+        # co_lnotab is deprecated as of 3.12
+        for start, end, line in code.co_lines():
+            if line is not None and line > lineno:
+                lineno = line
+        return lineno
+
+    try:
+        linetable = code.co_lnotab
+    except:
+        try:
+            lineno = code.Span.End.Line
+        except:
+            lineno = -1
+    else:
+        for line_incr in linetable[1::2]:
+            if sys.version >= '3':
+                lineno += line_incr
+            else:
+                lineno += ord(line_incr)
+    return lineno
+
+
+class CodeInfo(object):
+    """what we work out about a code object from the code object alone, plus
+       the verdicts should_debug_code and BreakpointIndex come to for it along 
+       with the state they came to them with."""
+
+    __slots__ = ['code', 'filename', 'normcased', 'basename', 'first_line', 
+                 'last_line', 'excluded', 'debug', 'dont_debug_count', 
+                 'has_breakpoints', 'breakpoints_version']
+
+    def __init__(self, code):
+        # keeps the code alive so its id stays its own while we have this
+        self.code = code
+        filename = code.co_filename
+        self.filename = path.abspath(filename)
+        self.normcased = path.isabs(filename) and path.normcase(filename) or None
+        self.basename = path.normcase(path.basename(filename))
+        self.first_line = code.co_firstlineno
+        self.last_line = get_code_last_line(code)
+        # CODE_INFO gets cleared when the filter changes
+        self.excluded = CODE_FILTER.excludes(self.filename)
+        self.debug = True
+        self.dont_debug_count = -1
+        self.has_breakpoints = False
+        self.breakpoints_version = -1
+
+    def is_same_file(self, filename):
+        """whether a break point's filename is the code's, just by the file 
+           name unless both are absolute"""
+        if self.normcased is not None and path.isabs(filename):
+            return path.normcase(filename) == self.normcased
+        return path.normcase(path.basename(filename)) == self.basename
+
+# code objects for exec'd strings are created over and over, so bound the 
+# number of code objects we remember
+MAX_CODE_INFO = 10000
+# id(code) -> CodeInfo.  Code objects compare equal when they only differ in
+# their filename, so they can't be keys themselves.
+CODE_INFO = {}
+
+def get_code_info(code):
+    info = CODE_INFO.get(id(code))
+    if info is None:
+        if len(CODE_INFO) >= MAX_CODE_INFO:
+            CODE_INFO.clear()
+        info = CODE_INFO[id(code)] = CodeInfo(code)
+    return info
+
+def is_excluded_code(code):
+    return (CODE_INFO.get(id(code)) or get_code_info(code)).excluded
+
+
+class CodeFilter(object):
+    """just my code, the files the user doesn't want to step through or break
+       in.  A file is excluded when it matches one of the exclude globs and
+       none of the include globs, so includes can carve a library back out of
+       an excluded tree.  Globs match the whole absolute filename, * and ? 
+       match across directories.
+
+       Both lists get compiled into one regular expression where the includes
+       come first, so a single match tells which list won."""
+
+    def __init__(self):
+        self.matcher = None     # None when nothing is excluded
+
+    def set_globs(self, include, exclude):
+        if not exclude:
+            self.matcher = None
+            return
+
+        parts = []
+        for group, globs in (('include', include), ('exclude', exclude)):
+            if globs:
+                parts.append('(?P<%s>%s)' % (group, '|'.join(
+                    '(?:%s)' % fnmatch.translate(path.normcase(glob)) for glob in globs)))
+        self.matcher = re.compile('|'.join(parts))
+
+    def excludes(self, filename):
+        matcher = self.matcher
+        if matcher is None:
+            return False
+        match = matcher.match(path.normcase(filename))
+        return match is not None and match.lastgroup == 'exclude'
+
+CODE_FILTER = CodeFilter()
+
+def set_code_filter(include, exclude):
+    """replaces the just my code globs, code which is already running keeps
+       the tracing it has until it's called again"""
+    CODE_FILTER.set_globs(include, exclude)
+    # every verdict we have came from the old globs
+    CODE_INFO.clear()
+    TRACE_ENGINE.filter_changed()
+
+
+class BreakpointIndex(object):
+    """tracks which lines of each file have break points so the call event can 
+       cheaply decide whether a code object needs line tracing at all.
+
+       Break points are indexed by their normalized base file name which gives 
+       us a superset of the files handle_line can match against, both for bound 
+       break points (exact filename) and unbound ones (CodeInfo.is_same_file).  The
+       answer for each code object is kept in its CodeInfo until the break 
+       points change."""
+
+    def __init__(self):
+        self.lines = {}         # normcased basename -> sorted list of break point lines
+        self.version = 0        # bumped whenever lines changes
+
+    def _key(self, filename):
+        return path.normcase(path.basename(filename))
+
+    def add(self, filename, lineNo):
+        key = self._key(filename)
+        lines = self.lines.get(key)
+        if lines is None:
+            lines = self.lines[key] = []
+        bisect.insort(lines, lineNo)
+        self.version += 1
+
+    def remove(self, filename, lineNo):
+        key = self._key(filename)
+        lines = self.lines.get(key)
+        if lines is not None:
+            index = bisect.bisect_left(lines, lineNo)
+            if index < len(lines) and lines[index] == lineNo:
+                del lines[index]
+                if not lines:
+                    del self.lines[key]
+                self.version += 1
+
+    def clear(self):
+        self.lines.clear()
+        self.version += 1
+
+    def has_breakpoints(self, code):
+        if not self.lines:
+            return False
+
+        info = CODE_INFO.get(id(code)) or get_code_info(code)
+        if info.breakpoints_version != self.version:
+            info.has_breakpoints = self.find_breakpoints(info)
+            info.breakpoints_version = self.version
+        return info.has_breakpoints
+
+    def find_breakpoints(self, info):
+        lines = self.lines.get(info.basename)
+        if lines is None:
+            return False
+
+        index = bisect.bisect_left(lines, info.first_line)
+        return index < len(lines) and lines[index] <= info.last_line
+
+BREAKPOINT_INDEX = BreakpointIndex()
+
+# when set code objects w/o break points run without line tracing unless we're stepping
+TRACE_ONLY_BREAKPOINT_CODE = sys.platform != 'cli'
+
+def trace_running_frames(should_trace = None):
+    """enables line tracing for frames which are currently running untraced on
+       any of our threads, optionally limited to code objects matching should_trace"""
+    if not TRACE_ONLY_BREAKPOINT_CODE:
+        return
+
+    THREADS_LOCK.acquire()
+    all_threads = dict(THREADS)
+    THREADS_LOCK.release()
+
+    for tid, frame in sys._current_frames().items():
+        cur_thread = all_threads.get(tid)
+        if cur_thread is not None:
+            cur_thread.trace_frame_chain(frame, should_trace)
+
+
+class SettraceEngine(object):
+    """drives the debugger from sys.settrace, each thread's trace_func receives
+       every event for the frames it traces"""
+
+    in_use = False
+
+    def start_thread(self, cur_thread):
+        SettraceEngine.in_use = True
+        sys.settrace(cur_thread.trace_func)
+
+    def stop_thread(self, cur_thread):
+        sys.settrace(None)
+
+    def breakpoint_added(self, filename, lineNo):
+        BREAKPOINT_INDEX.add(filename, lineNo)
+
+        # frames which are already running this code need to start line tracing
+        trace_running_frames(BREAKPOINT_INDEX.has_breakpoints)
+
+    def breakpoint_removed(self, filename, lineNo):
+        BREAKPOINT_INDEX.remove(filename, lineNo)
+
+    def breakpoints_cleared(self):
+        BREAKPOINT_INDEX.clear()
+
+    def module_executed(self, code):
+        pass
+
+    def filter_changed(self):
+        pass
+
+    def breakpoint_commands_done(self):
+        """called on the debugger loop after a run of break point commands, 
+           before it runs any other command or waits for more"""
+        pass
+
+    def should_line_trace(self, code):
+        """called when code starts running and no one is stepping"""
+        return BREAKPOINT_INDEX.has_breakpoints(code)
+
+    def break_requested(self):
+        # threads running untraced code need a line event to notice the break
+        trace_running_frames()
+
+    def thread_resumed(self, cur_thread):
+        # our state may have changed while we were blocked
+        sys.settrace(cur_thread.trace_func)
+        if cur_thread.stepping != STEPPING_NONE:
+            # we may be stepping out into callers which are running untraced
+            cur_thread.trace_frame_chain(cur_thread.cur_frame)
+
+    def detach(self):
+        pass
+
+
+class MonitoringEngine(object):
+    """drives the debugger from sys.monitoring (PEP 669, Python 3.12+).
+
+       While no thread is stepping we only ask for PY_START and RAISE events 
+       globally plus LINE events on code objects which contain break points, and
+       we disable each location once we know nothing there can stop.  While any
+       thread is stepping or breaking we receive all events.  Either way events 
+       are translated into the same calls to Thread.trace_func that sys.settrace
+       would make so the rest of the debugger doesn't care which engine runs."""
+
+    def __init__(self):
+        self.monitoring = monitoring = sys.monitoring
+        self.tool_id = monitoring.DEBUGGER_ID
+        events = monitoring.events
+        self.idle_events = events.PY_START | events.RAISE
+        self.step_events = (self.idle_events | events.PY_RESUME | events.PY_RETURN | 
+                            events.PY_YIELD | events.PY_UNWIND | events.LINE)
+        self.callbacks = {
+            events.PY_START : self.on_call,
+            events.PY_RESUME : self.on_call,
+            events.LINE : self.on_line,
+            events.PY_RETURN : self.on_return,
+            events.PY_YIELD : self.on_return,
+            events.PY_UNWIND : self.on_unwind,
+            events.RAISE : self.on_raise,
+        }
+        self.stepping = False
+        self.stepping_lock = thread.allocate_lock()
+        self.in_use = False
+
+    def start(self):
+        """claims the debugger tool id, raises ValueError if someone else has it"""
+        monitoring = self.monitoring
+        monitoring.use_tool_id(self.tool_id, 'visualstudio_py_debugger')
+        for event, callback in self.callbacks.items():
+            monitoring.register_callback(self.tool_id, event, callback)
+        monitoring.set_events(self.tool_id, self.idle_events)
+
+    def start_thread(self, cur_thread):
+        self.in_use = True
+        if cur_thread.stepping != STEPPING_NONE:
+            self.set_stepping(True)
+
+    def stop_thread(self, cur_thread):
+        pass
+
+    def breakpoint_removed(self, filename, lineNo):
+        BREAKPOINT_INDEX.remove(filename, lineNo)
+
+    def breakpoints_cleared(self):
+        BREAKPOINT_INDEX.clear()
+
+    def module_executed(self, code):
+        pass
+
+    def filter_changed(self):
+        # code we've stopped hearing about may not be excluded anymore
+        self.monitoring.restart_events()
+
+    def breakpoint_commands_done(self):
+        pass
+
+    def breakpoint_added(self, filename, lineNo):
+        BREAKPOINT_INDEX.add(filename, lineNo)
+
+        # re-enable the PY_START and LINE locations we've disabled, code with
+        # break points will then get LINE events turned on when it's next called
+        self.monitoring.restart_events()
+
+        # frames which are already running won't see PY_START again
+        for frame in sys._current_frames().values():
+            while frame is not None:
+                if BREAKPOINT_INDEX.has_breakpoints(frame.f_code):
+                    self.monitor_lines(frame.f_code)
+                frame = frame.f_back
+
+    def break_requested(self):
+        self.set_stepping(True)
+
+    def thread_resumed(self, cur_thread):
+        self.stepping_lock.acquire()
+        try:
+            THREADS_LOCK.acquire()
+            stepping = False
+            for other_thread in THREADS.values():
+                if other_thread.stepping != STEPPING_NONE:
+                    stepping = True
+                    break
+            THREADS_LOCK.release()
+
+            self.set_stepping(stepping)
+        finally:
+            self.stepping_lock.release()
+
+    def set_stepping(self, stepping):
+        if stepping != self.stepping:
+            self.stepping = stepping
+            if stepping:
+                self.monitoring.set_events(self.tool_id, self.step_events)
+                self.monitoring.restart_events()
+            else:
+                self.monitoring.set_events(self.tool_id, self.idle_events)
+
+    def monitor_lines(self, code):
+        self.monitoring.set_local_events(self.tool_id, code, self.monitoring.events.LINE)
+
+    def detach(self):
+        monitoring = self.monitoring
+        monitoring.set_events(self.tool_id, 0)
+        for event in self.callbacks:
+            monitoring.register_callback(self.tool_id, event, None)
+        monitoring.free_tool_id(self.tool_id)
+
+    def on_call(self, code, offset):
+        cur_thread = THREADS.get(thread.get_ident())
+        if cur_thread is not None:
+            # excluded code still reports module loads from here
+            cur_thread.trace_generic(sys._getframe(1), 'call', None)
+
+        if is_excluded_code(code):
+            # nothing else happens in excluded code until the filter changes
+            return self.monitoring.DISABLE
+
+        if not self.stepping:
+            if BREAKPOINT_INDEX.has_breakpoints(code):
+                self.monitor_lines(code)
+            if not DJANGO_BREAKPOINTS:
+                # nothing more to learn from this code until break points change
+                return self.monitoring.DISABLE
+
+    def on_line(self, code, line):
+        if is_excluded_code(code):
+            return self.monitoring.DISABLE
+
+        cur_thread = THREADS.get(thread.get_ident())
+        if cur_thread is not None:
+            cur_thread.trace_generic(sys._getframe(1), 'line', None)
+
+        if not self.stepping and (line not in BREAKPOINTS or not BREAKPOINT_INDEX.has_breakpoints(code)):
+            return self.monitoring.DISABLE
+
+    def on_return(self, code, offset, retval):
+        if is_excluded_code(code):
+            return self.monitoring.DISABLE
+
+        cur_thread = THREADS.get(thread.get_ident())
+        if cur_thread is not None:
+            cur_thread.trace_generic(sys._getframe(1), 'return', retval)
+
+    def on_unwind(self, code, offset, exc):
+        cur_thread = THREADS.get(thread.get_ident())
+        if cur_thread is not None and not is_excluded_code(code):
+            cur_thread.trace_generic(sys._getframe(1), 'return', None)
+
+    def on_raise(self, code, offset, exc):
+        cur_thread = THREADS.get(thread.get_ident())
+        if cur_thread is not None and not is_excluded_code(code):
+            cur_thread.trace_generic(sys._getframe(1), 'exception', (type(exc), exc, exc.__traceback__))
+
+
+class CodePatchEngine(SettraceEngine):
+    """breaks by recompiling the functions which contain break points so that 
+       they call code_breakpoint_hit on the break point line, and swapping the
+       new code objects into the live function objects.  Those functions then
+       run without line tracing, the trace function only sees call events (for
+       module loads and stepping into code) until the user starts stepping.
+
+       Break points we can't compile in (module level code, loop headers, 
+       missing source, functions which don't exist yet) fall back to line 
+       tracing, we retry them each time a module in their file finishes 
+       executing."""
+
+    def __init__(self):
+        import ast
+        self.ast = ast
+        self.hook_source = '__import__("sys").modules[%r].code_breakpoint_hit(%%d)' % get_debugger_module_name()
+        self.lines = {}         # filename -> {line: break point count}
+        self.traced = {}        # filename -> lines which fell back to line tracing
+        self.patched = {}       # filename -> {(co_name, co_firstlineno): (original code, patched code)}
+        self.attempted = {}     # id -> line traced code we've tried patching when it was called
+        self.changed = set()    # files the debugger loop has changed break points in since it last patched
+
+    def breakpoint_added(self, filename, lineNo):
+        lines = self.lines.setdefault(filename, {})
+        lines[lineNo] = lines.get(lineNo, 0) + 1
+        self.file_changed(filename)
+
+    def breakpoint_removed(self, filename, lineNo):
+        lines = self.lines.get(filename, {})
+        if lineNo in lines:
+            lines[lineNo] -= 1
+            if not lines[lineNo]:
+                del lines[lineNo]
+            self.file_changed(filename)
+
+    def breakpoints_cleared(self):
+        for filename in list(self.lines):
+            self.lines[filename] = {}
+        self.changed.clear()
+        self.update_files(list(self.lines))
+        BREAKPOINT_INDEX.clear()
+
+    def file_changed(self, filename):
+        if thread.get_ident() == debugger_thread_id:
+            # the debugger sends break points in bursts, patch once it's done
+            self.changed.add(filename)
+        else:
+            # a module is loading, its break points need to work before it runs
+            self.update_files([filename])
+
+    def breakpoint_commands_done(self):
+        if self.changed:
+            changed = list(self.changed)
+            self.changed.clear()
+            self.update_files(changed)
+
+    def module_executed(self, code):
+        # functions defined by the module exist now, see if we can patch them
+        filename = code.co_filename
+        if self.traced.get(filename):
+            self.update_files([filename])
+
+    def should_line_trace(self, code):
+        if not BREAKPOINT_INDEX.has_breakpoints(code):
+            return False
+
+        if self.attempted.get(id(code)) is not code and self.traced.get(code.co_filename):
+            # the function may not have existed when the break point was set,
+            # this call still needs line tracing but the next one can be patched
+            self.attempted[id(code)] = code
+            self.update_files([code.co_filename])
+        return True
+
+    def detach(self):
+        self.breakpoints_cleared()
+
+    def update_files(self, filenames):
+        patched_lines = self.patch_files(dict(
+            (filename, self.lines.get(filename, {})) for filename in filenames
+            if self.lines.get(filename) or self.patched.get(filename)))
+
+        newly_traced = False
+        for filename in filenames:
+            lines = self.lines.get(filename, {})
+            file_patched_lines = patched_lines.get(filename, ())
+            traced = self.traced.setdefault(filename, set())
+            for lineNo in list(traced):
+                if lineNo not in lines or lineNo in file_patched_lines:
+                    traced.remove(lineNo)
+                    BREAKPOINT_INDEX.remove(filename, lineNo)
+
+            for lineNo in lines:
+                if lineNo not in file_patched_lines and lineNo not in traced:
+                    traced.add(lineNo)
+                    BREAKPOINT_INDEX.add(filename, lineNo)
+                    newly_traced = True
+
+        if newly_traced:
+            trace_running_frames(BREAKPOINT_INDEX.has_breakpoints)
+
+    def patch_files(self, files):
+        """recompiles each file with calls to code_breakpoint_hit before the 
+           statements on its lines and swaps the code of the affected live 
+           functions, restoring functions which no longer need patching.  Takes
+           filename -> lines, and returns filename -> the lines which will now
+           call us.  One pass over the heap finds the functions of every file."""
+        if not files:
+            return {}
+
+        compiled = {}
+        for filename, lines in files.items():
+            compiled[filename] = {}, {}
+            if lines:
+                try:
+                    compiled[filename] = self.compile_patched(filename, lines)
+                except:
+                    # no source, source doesn't match, etc...  line trace instead
+                    pass
+
+        swapped = dict((filename, set()) for filename in files)
+        replaced_code = {}
+        for func in gc.get_objects():
+            if type(func) is not types.FunctionType:
+                continue
+            code = func.__code__
+            filename = code.co_filename
+            if filename not in files:
+                continue
+
+            patched = self.patched.setdefault(filename, {})
+            key = code.co_name, code.co_firstlineno
+            original, current = patched.get(key, (code, None))
+            if code is not original and code is not current:
+                # a function we didn't compile, leave it alone
+                continue
+
+            new_code = compiled[filename][0].get(key)
+            if new_code is not None and (new_code.co_varnames != original.co_varnames or
+                                         new_code.co_freevars != original.co_freevars):
+                # the source file has changed since this was compiled
+                new_code = None
+
+            if new_code is None:
+                if code is not original:
+                    func.__code__ = original
+                continue
+
+            try:
+                func.__code__ = new_code
+            except ValueError:
+                continue
+
+            if code is original:
+                replaced_code[id(code)] = code
+            patched[key] = original, new_code
+            swapped[filename].add(key)
+
+        for filename in files:
+            patched = self.patched.setdefault(filename, {})
+            for key in list(patched):
+                if key not in swapped[filename]:
+                    del patched[key]
+
+        if replaced_code:
+            # frames already running the old code won't call us, line trace them
+            trace_running_frames(lambda code: replaced_code.get(id(code)) is code)
+
+        patched_lines = {}
+        for filename in files:
+            file_patched_lines = patched_lines[filename] = set()
+            for lineNo, keys in compiled[filename][1].items():
+                for key in keys:
+                    if key in swapped[filename]:
+                        file_patched_lines.add(lineNo)
+                        break
+        return patched_lines
+
+    def compile_patched(self, filename, lines):
+        """returns the function code objects from compiling filename with the 
+           break point calls inserted, keyed by (co_name, co_firstlineno), and a
+           dictionary of line to the keys of the functions which contain it"""
+        ast = self.ast
+        source_file = filename
+        if source_file.endswith('.pyc') or source_file.endswith('.pyo'):
+            source_file = source_file[:-1]
+        f = open(source_file, 'rb')
+        try:
+            tree = ast.parse(f.read(), filename)
+        finally:
+            f.close()
+
+        line_functions = {}
+        for lineNo in lines:
+            found = self.find_statement(tree.body, lineNo, ())
+            if found is None:
+                continue
+
+            body, index, functions = found
+            hook = ast.parse(self.hook_source % lineNo).body[0]
+            ast.increment_lineno(hook, lineNo - 1)
+            body.insert(index, hook)
+            line_functions[lineNo] = functions
+
+        new_codes = {}
+        if line_functions:
+            pending = [compile(tree, filename, 'exec', 0, True)]
+            while pending:
+                code = pending.pop()
+                new_codes[code.co_name, code.co_firstlineno] = code
+                for const in code.co_consts:
+                    if type(const) is types.CodeType:
+                        pending.append(const)
+
+        return new_codes, line_functions
+
+    def find_statement(self, body, lineNo, functions):
+        """finds the statement list and index of the statement which starts on 
+           lineNo inside of a function, along with the keys of the enclosing 
+           functions"""
+        ast = self.ast
+        for index, stmt in enumerate(body):
+            if stmt.lineno == lineNo:
+                if not functions or isinstance(stmt, (ast.For, ast.While)) or type(stmt).__name__ == 'AsyncFor':
+                    # module/class level code runs once, and loop headers are 
+                    # hit on every iteration, leave those to line tracing
+                    return None
+                return body, index, functions
+
+            if stmt.lineno < lineNo <= max(getattr(node, 'lineno', 0) for node in ast.walk(stmt)):
+                if type(stmt).__name__ in ('FunctionDef', 'AsyncFunctionDef'):
+                    first_line = min([stmt.lineno] + [dec.lineno for dec in stmt.decorator_list])
+                    functions = functions + ((stmt.name, first_line), )
+
+                for name, value in ast.iter_fields(stmt):
+                    if not isinstance(value, list) or not value:
+                        continue
+                    if isinstance(value[0], ast.stmt):
+                        found = self.find_statement(value, lineNo, functions)
+                        if found is not None:
+                            return found
+                    else:
+                        # except handlers, match cases
+                        for child in value:
+                            if isinstance(getattr(child, 'body', None), list):
+                                found = self.find_statement(child.body, lineNo, functions)
+                                if found is not None:
+                                    return found
+                return None
+
+        return None
+
+def get_debugger_module_name():
+    my_globals = globals()
+    for name, module in list(sys.modules.items()):
+        if getattr(module, '__dict__', None) is my_globals:
+            return name
+    return __name__
+
+def code_breakpoint_hit(lineNo):
+    """called from functions which CodePatchEngine compiled a break point into"""
+    frame = sys._getframe(1)
+    if DETACHED or frame.f_trace is not None or is_excluded_code(frame.f_code):
+        # frames with a trace function check their break points in handle_line,
+        # and break points in excluded code don't stop
+        return
+
+    cur_thread = get_thread_from_id(thread.get_ident())
+    if cur_thread is not None:
+        # we're not running from the trace function, so turn tracing off while
+        # the debugger runs like it would be there
+        sys.settrace(None)
+        try:
+            cur_thread.sync_frame(frame)
+            cur_thread.check_break_points(frame)
+        finally:
+            TRACE_ENGINE.start_thread(cur_thread)
+
+
+TRACE_ENGINE = SettraceEngine()
+
+# compile break points into functions instead of line tracing them (settrace only)
+CODE_PATCH_BREAKPOINTS = False
+
+# use sys.monitoring instead of sys.settrace when the interpreter supports it
+USE_SYS_MONITORING = True
+
+def select_trace_engine():
+    """switches over to the code patching engine if requested, or to the 
+       sys.monitoring engine if it's available, as long as no thread has 
+       started tracing with sys.settrace yet"""
+    global TRACE_ENGINE, TRACE_ONLY_BREAKPOINT_CODE
+    if TRACE_ENGINE.in_use:
+        return
+
+    if CODE_PATCH_BREAKPOINTS:
+        TRACE_ENGINE = CodePatchEngine()
+        return
+
+    if not USE_SYS_MONITORING or not hasattr(sys, 'monitoring'):
+        return
+
+    engine = MonitoringEngine()
+    try:
+        engine.start()
+    except ValueError:
+        # another debugger or profiler already owns the tool id
+        return
+
+    TRACE_ENGINE = engine
+    # sys.monitoring only reports the events we ask for, frames are never left
+    # without a trace function
+    TRACE_ONLY_BREAKPOINT_CODE = False
+
+def reset_trace_engine():
+    """goes back to sys.settrace after detaching so a later attach can pick again"""
+    global TRACE_ENGINE, TRACE_ONLY_BREAKPOINT_CODE
+    TRACE_ENGINE.detach()
+    TRACE_ENGINE = SettraceEngine()
+    TRACE_ONLY_BREAKPOINT_CODE = sys.platform != 'cli'
+
+
+class DebuggerExitException(Exception): pass
+
+def add_break_point(modFilename, break_when_changed, condition, lineNo, brkpt_id, bound = True, hit_count_kind = HIT_COUNT_NONE, hit_count = 0, log_message = '', log_rate_limit = 0, snapshot_count = 0, snapshot_max_bytes = 0):
+    cur_bp = BREAKPOINTS.get(lineNo)
+    if cur_bp is None:
+        cur_bp = BREAKPOINTS[lineNo] = dict()
+    
+    cond_info = make_condition_info(condition, break_when_changed, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes)
+    
+    is_new = (modFilename, brkpt_id) not in cur_bp
+    cur_bp[(modFilename, brkpt_id)] = cond_info, bound
+
+    if is_new:
+        TRACE_ENGINE.breakpoint_added(modFilename, lineNo)
+        update_all_trace_funcs()
+
+def remove_break_point(filename, lineNo, brkpt_id):
+    cur_bp = BREAKPOINTS.get(lineNo)
+    if cur_bp is not None and (filename, brkpt_id) in cur_bp:
+        del cur_bp[filename, brkpt_id]
+        if not cur_bp:
+            del BREAKPOINTS[lineNo]
+        TRACE_ENGINE.breakpoint_removed(filename, lineNo)
+        update_all_trace_funcs()
+
+def bind_break_point(modFilename, brkpt_id, lineNo, filename, condition, break_when_changed, hit_count_kind = HIT_COUNT_NONE, hit_count = 0, log_message = '', log_rate_limit = 0, snapshot_count = 0, snapshot_max_bytes = 0):
+    # the bound break point replaces any we were matching by name
+    remove_break_point(filename, lineNo, brkpt_id)
+    add_break_point(modFilename, break_when_changed, condition, lineNo, brkpt_id, True, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes)
+    report_breakpoint_bound(brkpt_id)
+
+
+class PendingBreakPoint(object):
+    def __init__(self, brkpt_id, lineNo, filename, condition, break_when_changed, hit_count_kind = HIT_COUNT_NONE, hit_count = 0, log_message = '', log_rate_limit = 0, snapshot_count = 0, snapshot_max_bytes = 0):
+        self.brkpt_id = brkpt_id
+        self.lineNo = lineNo
+        self.filename = filename
+        self.condition = condition
+        self.break_when_changed = break_when_changed
+        self.hit_count_kind = hit_count_kind
+        self.hit_count = hit_count
+        self.log_message = log_message
+        self.log_rate_limit = log_rate_limit
+        self.snapshot_count = snapshot_count
+        self.snapshot_max_bytes = snapshot_max_bytes
+
+    def bind(self, modFilename):
+        bind_break_point(modFilename, self.brkpt_id, self.lineNo, self.filename, self.condition, self.break_when_changed, self.hit_count_kind, self.hit_count, self.log_message, self.log_rate_limit, self.snapshot_count, self.snapshot_max_bytes)
+
+class PendingBreakPoints(object):
+    """break points waiting for their module to load, by id and by the module
+       they're waiting for.  That's the normalized path of their file, or
+       just its file name when the debugger sent a relative one.  The debugger
+       loop adds and removes them while the threads loading modules take them,
+       so it's all done under a lock."""
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_path = {}
+        self.by_basename = {}
+        self.lock = thread.allocate_lock()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get_index(self, filename):
+        if path.isabs(filename):
+            return self.by_path, normalize_module_path(filename)
+        return self.by_basename, get_basename_key(filename)
+
+    def add(self, pending_bp):
+        self.lock.acquire()
+        try:
+            self._remove(pending_bp.brkpt_id)
+            self.by_id[pending_bp.brkpt_id] = pending_bp
+            index, key = self.get_index(pending_bp.filename)
+            index.setdefault(key, {})[pending_bp.brkpt_id] = pending_bp
+        finally:
+            self.lock.release()
+
+    def get(self, brkpt_id):
+        self.lock.acquire()
+        try:
+            return self.by_id.get(brkpt_id)
+        finally:
+            self.lock.release()
+
+    def remove(self, brkpt_id):
+        self.lock.acquire()
+        try:
+            self._remove(brkpt_id)
+        finally:
+            self.lock.release()
+
+    def _remove(self, brkpt_id):
+        pending_bp = self.by_id.pop(brkpt_id, None)
+        if pending_bp is not None:
+            index, key = self.get_index(pending_bp.filename)
+            waiting = index[key]
+            del waiting[brkpt_id]
+            if not waiting:
+                del index[key]
+
+    def take(self, module, by_basename = True):
+        """removes and returns the break points waiting for the module, and
+           unless by_basename is False the ones waiting for its file name.
+           That's False when other modules have the same file name, like
+           ModuleRegistry.find won't pick one of them."""
+        key = normalize_module_path(module.filename)
+        self.lock.acquire()
+        try:
+            found = list(self.by_path.get(key, {}).values())
+            if by_basename:
+                found.extend(self.by_basename.get(get_basename_key(key), {}).values())
+            for pending_bp in found:
+                self._remove(pending_bp.brkpt_id)
+        finally:
+            self.lock.release()
+        return found
+
+PENDING_BREAKPOINTS = PendingBreakPoints()
+
+def mark_all_threads_for_break():
+    THREADS_LOCK.acquire()
+    for thread in THREADS.values():
+        thread.stepping = STEPPING_BREAK
+        thread.update_trace_func()
+    THREADS_LOCK.release()
+
+    TRACE_ENGINE.break_requested()
+
+def update_all_trace_funcs():
+    """called when global state which the specialized trace functions depend
+       upon changes"""
+    THREADS_LOCK.acquire()
+    all_threads = list(THREADS.values())
+    THREADS_LOCK.release()
+
+    for cur_thread in all_threads:
+        cur_thread.update_trace_func()
+
+class DebuggerLoop(object):    
     def __init__(self, conn):
         self.conn = conn
+        self.reader = _SocketReader(conn)
         self.repl_backend = None
         self.command_table = {
             cmd('stpi') : self.command_step_into,
@@ -1193,6 +3158,13 @@ class DebuggerLoop(object):
             cmd('rest') : self.command_resume_thread,
             cmd('exec') : self.command_execute_code,
             cmd('chld') : self.command_enum_children,
+            cmd('frmv') : self.command_get_frame_variables,
+            cmd('thrf') : self.command_resync_frames,
+            cmd('stck') : self.command_get_thread_frames,
+            cmd('frms') : self.command_get_frame_page,
+            cmd('thrl') : self.command_get_thread_list,
+            cmd('valc') : self.command_get_value_chunk,
+            cmd('arrs') : self.command_get_array_slice,
             cmd('setl') : self.command_set_lineno,
             cmd('detc') : self.command_detach,
             cmd('clst') : self.command_clear_stepping,
@@ -1202,35 +3174,46 @@ class DebuggerLoop(object):
             cmd('bkda') : self.command_add_django_breakpoint,
             cmd('crep') : self.command_connect_repl,
             cmd('drep') : self.command_disconnect_repl,
+            cmd('cmpr') : self.command_set_compression,
+            cmd('jmcf') : self.command_set_code_filter,
+            cmd('caps') : self.command_get_capabilities,
         }
+        # the debugger sends these in bursts, the trace engine gets to apply
+        # a run of them in one go
+        self.breakpoint_commands = set([cmd('brkp'), cmd('brkc'), cmd('brkr')])
 
     def loop(self):
         try:
             while True:
-                inp = conn.recv(4)
+                if not self.reader.buffered():
+                    TRACE_ENGINE.breakpoint_commands_done()
+                inp = self.reader.read(4).tobytes()
+                if inp not in self.breakpoint_commands:
+                    # before anything which could let code run
+                    TRACE_ENGINE.breakpoint_commands_done()
                 cmd = self.command_table.get(inp)
                 if cmd is not None:
                     cmd()
                 else:
-                    if inp:
-                        print ('unknown command', inp)
+                    print ('unknown command', inp)
                     break
         except DebuggerExitException:
             pass
-        except socket.error:
+        except (socket.error, EOFError):
+            # the debugger went away
             pass
         except:
             traceback.print_exc()
             
     def command_step_into(self):
-        tid = read_long(self.conn)
+        tid = read_long(self.reader)
         thread = get_thread_from_id(tid)
         if thread is not None:
             thread.stepping = STEPPING_INTO
             self.command_resume_all()
 
     def command_step_out(self):
-        tid = read_long(self.conn)
+        tid = read_long(self.reader)
         thread = get_thread_from_id(tid)
         if thread is not None:
             thread.stepping = STEPPING_OUT
@@ -1238,7 +3221,7 @@ class DebuggerLoop(object):
     
     def command_step_over(self):
         # set step over
-        tid = read_long(self.conn)
+        tid = read_long(self.reader)
         thread = get_thread_from_id(tid)
         if thread is not None:
             if DJANGO_DEBUG:
@@ -1252,65 +3235,88 @@ class DebuggerLoop(object):
             self.command_resume_all()
 
     def command_set_breakpoint(self):
-        brkpt_id = read_uint(self.conn)
-        lineNo = read_uint(self.conn)
-        filename = read_string(self.conn)
-        condition = read_string(self.conn)
-        break_when_changed = read_uint(self.conn)
+        brkpt_id = read_uint(self.reader)
+        lineNo = read_uint(self.reader)
+        filename = read_string(self.reader)
+        condition = read_string(self.reader)
+        break_when_changed = read_uint(self.reader)
+        hit_count_kind = read_uint(self.reader)
+        hit_count = read_uint(self.reader)
+        log_message = read_string(self.reader)
+        log_rate_limit = read_uint(self.reader)
+        snapshot_count = read_uint(self.reader)
+        snapshot_max_bytes = read_uint(self.reader)
                                 
-        for modFilename, module in MODULES:
-            if check_break_point(modFilename, module, brkpt_id, lineNo, filename, condition, break_when_changed):
-                break
+        entry = MODULES.find(filename)
+        if entry is not None:
+            bind_break_point(entry[0], brkpt_id, lineNo, filename, condition, break_when_changed, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes)
         else:
             # failed to set break point
-            add_break_point(filename, break_when_changed, condition, lineNo, brkpt_id, False)
-            PENDING_BREAKPOINTS.add(PendingBreakPoint(brkpt_id, lineNo, filename, condition, break_when_changed))
+            add_break_point(filename, break_when_changed, condition, lineNo, brkpt_id, False, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes)
+            PENDING_BREAKPOINTS.add(PendingBreakPoint(brkpt_id, lineNo, filename, condition, break_when_changed, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes))
             report_breakpoint_failed(brkpt_id)
 
     def command_set_breakpoint_condition(self):
-        brkpt_id = read_uint(self.conn)
-        condition = read_string(self.conn)
-        break_when_changed = read_uint(self.conn)
+        brkpt_id = read_uint(self.reader)
+        condition = read_string(self.reader)
+        break_when_changed = read_uint(self.reader)
+        hit_count_kind = read_uint(self.reader)
+        hit_count = read_uint(self.reader)
+        log_message = read_string(self.reader)
+        log_rate_limit = read_uint(self.reader)
+        snapshot_count = read_uint(self.reader)
+        snapshot_max_bytes = read_uint(self.reader)
         
         for line, bp_dict in BREAKPOINTS.items():
             for filename, id in bp_dict:
                 if id == brkpt_id:
-                    bp_dict[filename, id] = ConditionInfo(condition, break_when_changed), bp_dict[filename, id][1]
+                    bp_dict[filename, id] = make_condition_info(condition, break_when_changed, hit_count_kind, hit_count, log_message, log_rate_limit, snapshot_count, snapshot_max_bytes), bp_dict[filename, id][1]
                     break
 
+        pending_bp = PENDING_BREAKPOINTS.get(brkpt_id)
+        if pending_bp is not None:
+            pending_bp.condition = condition
+            pending_bp.break_when_changed = break_when_changed
+            pending_bp.hit_count_kind = hit_count_kind
+            pending_bp.hit_count = hit_count
+            pending_bp.log_message = log_message
+            pending_bp.log_rate_limit = log_rate_limit
+            pending_bp.snapshot_count = snapshot_count
+            pending_bp.snapshot_max_bytes = snapshot_max_bytes
+
     def command_remove_breakpoint(self):
-        lineNo = read_uint(self.conn)
-        brkpt_id = read_uint(self.conn)
+        lineNo = read_uint(self.reader)
+        brkpt_id = read_uint(self.reader)
+        PENDING_BREAKPOINTS.remove(brkpt_id)
         cur_bp = BREAKPOINTS.get(lineNo)
         if cur_bp is not None:
             for file, id in cur_bp:
                 if id == brkpt_id:
-                    del cur_bp[file, id]
-                    if not cur_bp:
-                        del BREAKPOINTS[lineNo]
+                    remove_break_point(file, lineNo, id)
                     break
 
     def command_remove_django_breakpoint(self):
-        lineNo = read_uint(self.conn)
-        brkpt_id = read_uint(self.conn)
-        filename = read_string(self.conn)
+        lineNo = read_uint(self.reader)
+        brkpt_id = read_uint(self.reader)
+        filename = read_string(self.reader)
 
         bp_info = DJANGO_BREAKPOINTS.get(filename.lower())
         if bp_info is not None:
             bp_info.remove_breakpoint(lineNo)
 
     def command_add_django_breakpoint(self):
-        brkpt_id = read_uint(self.conn)
-        lineNo = read_uint(self.conn)
-        filename = read_string(self.conn)
+        brkpt_id = read_uint(self.reader)
+        lineNo = read_uint(self.reader)
+        filename = read_string(self.reader)
         bp_info = DJANGO_BREAKPOINTS.get(filename.lower())
         if bp_info is None:
             DJANGO_BREAKPOINTS[filename.lower()] = bp_info = DjangoBreakpointInfo(filename)
+            update_all_trace_funcs()
 
         bp_info.add_breakpoint(lineNo, brkpt_id)
 
     def command_connect_repl(self):
-        port_num = read_uint(self.conn)
+        port_num = read_uint(self.reader)
         _start_new_thread(self.connect_to_repl_backend, (port_num,))
 
     def connect_to_repl_backend(self, port_num):
@@ -1323,6 +3329,22 @@ class DebuggerLoop(object):
         self.repl_backend.disconnect_from_debugger()
         self.repl_backend = None
 
+    def command_set_compression(self):
+        threshold = read_uint(self.reader)
+        level = read_int(self.reader)
+        if zlib is not None:
+            _NetstringConn.enable_compression(threshold, level)
+
+    def command_set_code_filter(self):
+        include = [read_string(self.reader) for i in xrange(read_uint(self.reader))]
+        exclude = [read_string(self.reader) for i in xrange(read_uint(self.reader))]
+        set_code_filter(include, exclude)
+
+    def command_get_capabilities(self):
+        with _SendLockCtx, _NetstringConn as conn:
+            conn.send(CAPS)
+            conn.write_uint(CAPABILITY_JUST_MY_CODE | (CAPABILITY_ZLIB if zlib is not None else 0))
+
     def command_break_all(self):
         global SEND_BREAK_COMPLETE
         SEND_BREAK_COMPLETE = True
@@ -1337,12 +3359,13 @@ class DebuggerLoop(object):
             thread._block_starting_lock.acquire()
             if thread.stepping == STEPPING_BREAK or thread.stepping == STEPPING_ATTACH_BREAK:
                 thread.stepping = STEPPING_NONE
+                thread.update_trace_func()
             if thread._is_blocked:
                 thread.unblock()
             thread._block_starting_lock.release()
     
     def command_resume_thread(self):
-        tid = read_long(self.conn)
+        tid = read_long(self.reader)
         THREADS_LOCK.acquire()
         thread = THREADS[tid]
         THREADS_LOCK.release()
@@ -1355,52 +3378,53 @@ class DebuggerLoop(object):
     
     def command_set_exception_info(self):
         BREAK_ON.Clear()
-        BREAK_ON.default_mode = read_uint(self.conn)
+        BREAK_ON.default_mode = read_uint(self.reader)
 
-        break_on_count = read_uint(self.conn)
+        break_on_count = read_uint(self.reader)
         for i in xrange(break_on_count):
-            mode = read_uint(self.conn)
-            name = read_string(self.conn)
+            mode = read_uint(self.reader)
+            name = read_string(self.reader)
             BREAK_ON.AddException(name, mode)
 
+        BREAK_ON.UpdateBreakOnRaise()
+        update_all_trace_funcs()
+
     def command_set_exception_handler_info(self):
-        try:
-            filename = read_string(self.conn)
+        filename = read_string(self.reader)
 
-            statement_count = read_uint(self.conn)
-            handlers = []
-            for _ in xrange(statement_count):
-                line_start, line_end = read_int(self.conn), read_uint(self.conn)
+        statement_count = read_uint(self.reader)
+        handlers = []
+        for _ in xrange(statement_count):
+            line_start, line_end = read_int(self.reader), read_uint(self.reader)
 
-                if line_start == -1:
-                    line_start = None
+            if line_start == -1:
+                line_start = None
 
-                expressions = set()
-                text = read_string(self.conn).strip()
-                while text != '-':
-                    expressions.add(text)
-                    text = read_string(self.conn)
+            expressions = set()
+            text = read_string(self.reader).strip()
+            while text != '-':
+                expressions.add(text)
+                text = read_string(self.reader)
 
-                if not expressions:
-                    expressions = set('*')
+            if not expressions:
+                expressions = set('*')
 
-                handlers.append((line_start, line_end, expressions))
+            handlers.append((line_start, line_end, expressions))
 
-            BREAK_ON.handler_cache[filename] = handlers
-        finally:
-            BREAK_ON.handler_lock.release()
+        BREAK_ON.SetHandlers(filename, handlers)
 
     def command_clear_stepping(self):
-        tid = read_long(self.conn)
+        tid = read_long(self.reader)
 
         thread = get_thread_from_id(tid)
         if thread is not None:
             thread.stepping = STEPPING_NONE
+            thread.update_trace_func()
 
     def command_set_lineno(self):
-        tid = read_long(self.conn)
-        fid = read_uint(self.conn)
-        lineno = read_uint(self.conn)
+        tid = read_long(self.reader)
+        fid = read_uint(self.reader)
+        lineno = read_uint(self.reader)
         try:
             THREADS_LOCK.acquire()
             THREADS[tid].cur_frame.f_lineno = lineno
@@ -1408,23 +3432,23 @@ class DebuggerLoop(object):
             THREADS_LOCK.release()
             with _SendLockCtx, _NetstringWrapper(self.conn) as conn:
                 conn.send(SETL)
-                conn.send(struct.pack('!I', 1))
-                conn.send(struct.pack('!Q', tid))
-                conn.send(struct.pack('!I', newline))
+                conn.write_uint(1)
+                conn.write_long(tid)
+                conn.write_uint(newline)
         except:
             with _SendLockCtx, _NetstringWrapper(self.conn) as conn:
                 conn.send(SETL)
-                conn.send(struct.pack('!I', 0))
-                conn.send(struct.pack('!Q', tid))
-                conn.send(struct.pack('!I', 0))
+                conn.write_uint(0)
+                conn.write_long(tid)
+                conn.write_uint(0)
 
     def command_execute_code(self):
         # execute given text in specified frame
-        text = read_string(self.conn)
-        tid = read_long(self.conn) # thread id
-        fid = read_uint(self.conn) # frame id
-        eid = read_uint(self.conn) # execution id
-        frame_kind = read_uint(self.conn)
+        text = read_string(self.reader)
+        tid = read_long(self.reader) # thread id
+        fid = read_uint(self.reader) # frame id
+        eid = read_uint(self.reader) # execution id
+        frame_kind = read_uint(self.reader)
 
         thread, cur_frame = self.get_thread_and_frame(tid, fid, frame_kind)
         if thread is not None and cur_frame is not None:
@@ -1437,26 +3461,100 @@ class DebuggerLoop(object):
             thread.run_locally_no_report(text, cur_frame, frame_kind)
 
     def command_enum_children(self):
-        # execute given text in specified frame
-        text = read_string(self.conn)
-        tid = read_long(self.conn) # thread id
-        fid = read_uint(self.conn) # frame id
-        eid = read_uint(self.conn) # execution id
-        frame_kind = read_uint(self.conn) # frame kind
-        child_is_enumerate = read_uint(self.conn)
-                
-        thread, cur_frame = self.get_thread_and_frame(tid, fid, frame_kind)
+        # enumerate a page of the children of an object we sent a handle for
+        tid = read_long(self.reader) # thread id
+        handle = read_uint(self.reader)
+        eid = read_uint(self.reader) # execution id
+        offset = read_uint(self.reader)
+        count = read_uint(self.reader)
+
+        thread = get_thread_from_id(tid)
+        if thread is not None:
+            thread.enum_child_on_thread(handle, eid, offset, count)
+        else:
+            report_children(eid, None, offset, [])
+    
+    def command_resync_frames(self):
+        # the debugger lost track of a thread's frames, send them in full
+        tid = read_long(self.reader) # thread id
+
+        thread = get_thread_from_id(tid)
+        if thread is not None:
+            thread.send_frames_on_thread(True)
+
+    def command_get_thread_frames(self):
+        # stops only send the stack of the thread which stopped, the debugger
+        # asks for the others when it shows them
+        tid = read_long(self.reader) # thread id
+
+        thread = get_thread_from_id(tid)
+        if thread is not None:
+            thread.send_frames_on_thread()
+
+    def command_get_frame_page(self):
+        tid = read_long(self.reader) # thread id
+        start = read_uint(self.reader)
+        count = read_uint(self.reader)
+
+        thread = get_thread_from_id(tid)
+        if thread is not None:
+            thread.frame_page_on_thread(start, count)
+
+    def command_get_thread_list(self):
+        report_thread_list()
+
+    def command_get_frame_variables(self):
+        tid = read_long(self.reader) # thread id
+        fid = read_uint(self.reader) # frame id
+
+        thread, cur_frame = self.get_thread_and_frame(tid, fid, FRAME_KIND_PYTHON)
         if thread is not None and cur_frame is not None:
-            thread.enum_child_on_thread(text, cur_frame, eid, child_is_enumerate, frame_kind)
+            thread.frame_variables_on_thread(fid, cur_frame)
     
+    def command_get_value_chunk(self):
+        text = read_string(self.reader)
+        tid = read_long(self.reader) # thread id
+        fid = read_uint(self.reader) # frame id
+        request_id = read_uint(self.reader)
+        offset = read_uint(self.reader)
+        length = read_uint(self.reader)
+
+        thread, cur_frame = self.get_thread_and_frame(tid, fid, FRAME_KIND_PYTHON)
+        if thread is not None and cur_frame is not None:
+            thread.value_chunk_on_thread(text, cur_frame, request_id, offset, length)
+        else:
+            report_value_chunk(request_id, 0, offset, '')
+
+    def command_get_array_slice(self):
+        text = read_string(self.reader)
+        tid = read_long(self.reader) # thread id
+        fid = read_uint(self.reader) # frame id
+        request_id = read_uint(self.reader)
+        start = read_uint(self.reader)
+        end = read_uint(self.reader)
+
+        thread, cur_frame = self.get_thread_and_frame(tid, fid, FRAME_KIND_PYTHON)
+        if thread is not None and cur_frame is not None:
+            thread.array_slice_on_thread(text, cur_frame, request_id, start, end)
+        else:
+            report_array_slice(request_id, start, None, 'no such frame')
+
     def get_thread_and_frame(self, tid, fid, frame_kind):
         thread = get_thread_from_id(tid)
         cur_frame = None
 
         if thread is not None:
-            cur_frame = thread.cur_frame
-            for i in xrange(fid):
-                cur_frame = cur_frame.f_back
+            frame_table = thread.frame_table
+            if frame_table is not None:
+                if fid < len(frame_table):
+                    cur_frame = frame_table[fid]
+            else:
+                cur_frame = thread.cur_frame
+                for i in xrange(fid):
+                    if cur_frame is None:
+                        # the debugger has a stale frame id
+                        break
+                    cur_frame = cur_frame.f_back
 
         return thread, cur_frame
 
@@ -1487,7 +3585,7 @@ DETACH_CALLBACKS = []
 def new_thread_wrapper(func, *posargs, **kwargs):
     cur_thread = new_thread()
     try:
-        sys.settrace(cur_thread.trace_func)
+        cur_thread.start_tracing()
         func(*posargs, **kwargs)
     finally:
         THREADS_LOCK.acquire()
@@ -1503,43 +3601,58 @@ def write_string(conn,string):
         conn.send(NONE_PREFIX)
     elif isinstance(string, unicode):
         bytes = string.encode('utf8')
-        conn.send(UNICODE_PREFIX)
-        conn.send(struct.pack('!I', len(bytes)))
+        conn.send(UNICODE_PREFIX + _UINT.pack(len(bytes)))
         conn.send(bytes)
     else:
-        conn.send(ASCII_PREFIX)
-        conn.send(struct.pack('!I', len(string)))
+        conn.send(ASCII_PREFIX + _UINT.pack(len(string)))
         conn.send(string)
 
+def write_interned_string(conn, string):
+    """writes a string which keeps getting sent, like filenames and type names,
+       as just an id once the debugger has it.  Messages which get kept
+       around to send later have no table and get the string in full."""
+    interned = conn.interned
+    if interned is None or string is None:
+        write_string(conn, string)
+        return
+    index = interned.get(string)
+    if index is not None:
+        conn.send(INTERNED_PREFIX + _UINT.pack(index))
+    elif len(interned) < INTERNED_STRINGS_MAX:
+        # the debugger numbers them in the order it sees them too
+        interned[string] = len(interned)
+        conn.send(INTERN_PREFIX)
+        write_string(conn, string)
+    else:
+        write_string(conn, string)
+
 def read_string(conn):
     str_len = read_uint(conn)
     if not str_len:
         return ''
-    res = cmd('')
-    while len(res) < str_len:
-        res = res + conn.recv(str_len - len(res))
-    return res.decode('utf8')
+    return codecs.utf_8_decode(conn.read(str_len))[0]
 
 def read_int(conn):
-    return struct.unpack('!i', conn.recv(4))[0]
+    return conn.unpack(_INT)
 
 def read_uint(conn):
-    return struct.unpack('!I', conn.recv(4))[0]
+    return conn.unpack(_UINT)
 
 def read_long(conn):
-    return struct.unpack('!Q', conn.recv(8))[0]
+    return conn.unpack(_LONG)
 
 def report_new_thread(new_thread):
     ident = new_thread.id
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(NEWT)
-        conn.send(struct.pack('!Q', ident))
+        conn.write_long(ident)
 
 def report_thread_exit(old_thread):
     ident = old_thread.id
+    BREAK_POINT_OUTPUT.flush(True)
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(EXTT)
-        conn.send(struct.pack('!Q', ident))
+        conn.write_long(ident)
 
 def report_exception(frame, exc_info, tid, break_type):
     exc_type = exc_info[0]
@@ -1557,52 +3670,70 @@ def report_exception(frame, exc_info, tid, break_type):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(EXCP)
         write_string(conn,exc_name)
-        conn.send(struct.pack('!Q', tid))
-        conn.send(struct.pack('!I', break_type))
+        conn.write_long(tid)
+        conn.write_uint(break_type)
         write_string(conn,excp_text)
 
 def new_module(frame):
-    mod = Module(get_code_filename(frame.f_code))
-    MODULES.append((frame.f_code.co_filename, mod))
-
-    return frame.f_code, mod
+    mod, is_new = MODULES.add(frame.f_code.co_filename, frame.f_globals)
+    return frame.f_code, mod, is_new
 
 def report_module_load(mod):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(MODL)
-        conn.send(struct.pack('!Q', mod.module_id))
-        write_string(conn,mod.filename)
+        conn.write_long(mod.module_id)
+        write_interned_string(conn,mod.filename)
 
 def report_step_finished(tid):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(STPD)
-        conn.send(struct.pack('!Q', tid))
+        conn.write_long(tid)
 
 def report_breakpoint_bound(id):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(BRKS)
-        conn.send(struct.pack('!I', id))
+        conn.write_uint(id)
 
 def report_breakpoint_failed(id):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(BRKF)
-        conn.send(struct.pack('!I', id))
+        conn.write_uint(id)
+
+def report_breakpoint_condition_disabled(id, reason):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(BRKD)
+        conn.write_uint(id)
+        write_string(conn, reason)
+
+def report_log_point_output(messages):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(LOGP)
+        conn.write_uint(len(messages))
+        for bp_id, tid, text in messages:
+            conn.write_uint(bp_id)
+            conn.write_long(tid)
+            write_string(conn, text)
+
+def report_snapshot(snapshot):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(SNAP)
+        conn.send(snapshot)
 
 def report_breakpoint_hit(id, tid):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(BRKH)
-        conn.send(struct.pack('!I', id))
-        conn.send(struct.pack('!Q', tid))
+        conn.write_uint(id)
+        conn.write_long(tid)
 
 def report_process_loaded(tid):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(LOAD)
-        conn.send(struct.pack('!Q', tid))
+        conn.write_long(tid)
 
 def report_execution_error(exc_text, execution_id):
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(EXCE)
-        conn.send(struct.pack('!I', execution_id))
+        conn.write_uint(execution_id)
         write_string(conn,exc_text)
 
 def report_execution_exception(execution_id, exc_info):
@@ -1619,6 +3750,272 @@ def safe_repr(obj):
     except:
         return '__repr__ raised an exception'
 
+class _ReprFull(Exception): pass
+
+# the __repr__ of the string types, subclasses which don't override it get
+# formatted like the strings they are
+STRING_REPRS = set([str.__repr__, unicode.__repr__, type(cmd('')).__repr__])
+
+if sys.version_info[0] == 2:
+    SET_REPR_BRACKETS = {set : ('set([', '])'), frozenset : ('frozenset([', '])')}
+else:
+    SET_REPR_BRACKETS = {set : ('{', '}'), frozenset : ('frozenset({', '})')}
+
+# summarizers for types which have a better way to be shown than their repr,
+# keyed by the type or by 'module.TypeName' for types we don't want to import
+REPR_SUMMARIZERS = {}
+# the summarizer each type we've formatted found, or None
+TYPE_SUMMARIZERS = {}
+# types get created at runtime too, so bound how many we remember
+MAX_TYPE_SUMMARIZERS = 10000
+
+def register_summarizer(obj_type, summarizer):
+    """summarizer(obj) returns the text to show for obj in place of its repr,
+       for instances of obj_type and its subclasses"""
+    REPR_SUMMARIZERS[obj_type] = summarizer
+    TYPE_SUMMARIZERS.clear()
+
+class BoundedRepr(object):
+    """makes reprs of a bounded size for showing values.  Strings and the built
+       in containers are formatted a piece at a time so a huge value costs no
+       more than the part of it we show, as are subclasses which kept their
+       base's repr and bytearrays.  Other objects get repr'd and cut down.
+       The reprs made between calls to reset share a time budget, once we've
+       spent that formatting them values just show their type."""
+
+    STRING_TYPES = set([str, unicode, type(cmd(''))])
+    CHEAP_TYPES = set([int, float, bool, type(None)])
+    try:
+        CHEAP_TYPES.add(long)
+    except NameError:
+        pass
+
+    def __init__(self, max_length = None, max_items = None, max_depth = None, time_budget = None):
+        self.max_length = max_length or REPR_MAX_LENGTH
+        self.max_items = max_items or REPR_MAX_ITEMS
+        self.max_depth = max_depth or REPR_MAX_DEPTH
+        self.time_budget = time_budget or REPR_TIME_BUDGET
+        # only time spent in here counts, not the time the user spends looking
+        self.time_spent = 0.0
+
+    def reset(self):
+        self.time_spent = 0.0
+
+    def __call__(self, obj):
+        """returns the repr of obj and whether or not it got cut short"""
+        if type(obj) in self.CHEAP_TYPES:
+            return self.format(obj)
+        if self.time_spent > self.time_budget:
+            return '<%s object at %s>' % (get_type_name(obj), hex(id(obj))), True
+
+        start = timer()
+        try:
+            return self.format(obj)
+        finally:
+            self.time_spent += timer() - start
+
+    def format(self, obj):
+        self.pieces = []
+        self.containers = set()
+        self.remaining = self.max_length
+        self.truncated = False
+        try:
+            self.write(obj, 0)
+        except _ReprFull:
+            self.pieces.append('...')
+            self.truncated = True
+        except:
+            # the container changed while we were going through it, or some such
+            self.pieces = None
+            text = safe_repr(obj)
+            return text[:self.max_length], len(text) > self.max_length
+        pieces = self.pieces
+        self.pieces = None
+        try:
+            return ''.join(pieces), self.truncated
+        except UnicodeError:
+            # mixing undecodable byte strings and unicode on 2.x
+            return safe_repr(obj)[:self.max_length], True
+
+    def emit(self, text):
+        if len(text) > self.remaining:
+            self.pieces.append(text[:self.remaining])
+            raise _ReprFull()
+        self.pieces.append(text)
+        self.remaining -= len(text)
+
+    def write(self, obj, depth):
+        obj_type = type(obj)
+        if REPR_SUMMARIZERS:
+            summarizer = self.find_summarizer(obj_type)
+            if summarizer is not None:
+                try:
+                    text = summarizer(obj)
+                except:
+                    text = None
+                if text is not None:
+                    self.emit(text)
+                    return
+
+        if obj_type in self.STRING_TYPES:
+            self.write_string(obj)
+        elif obj_type is list:
+            self.write_items(obj, depth, '[', ']')
+        elif obj_type is tuple:
+            self.write_items(obj, depth, '(', len(obj) == 1 and ',)' or ')')
+        elif obj_type in SET_REPR_BRACKETS and obj:
+            start, end = SET_REPR_BRACKETS[obj_type]
+            self.write_items(obj, depth, start, end)
+        elif obj_type is dict:
+            self.write_items(obj, depth, '{', '}', True)
+        else:
+            self.write_other(obj, obj_type, depth)
+
+    def write_other(self, obj, obj_type, depth):
+        obj_repr = getattr(obj_type, '__repr__', None)
+        if obj_repr in STRING_REPRS:
+            self.write_string(obj)
+        elif obj_repr is list.__repr__:
+            self.write_items(obj, depth, '[', ']')
+        elif obj_repr is tuple.__repr__:
+            self.write_items(obj, depth, '(', len(obj) == 1 and ',)' or ')')
+        elif obj_repr is dict.__repr__:
+            self.write_items(obj, depth, '{', '}', True)
+        elif obj_type is bytearray:
+            if len(obj) <= self.remaining:
+                self.emit(repr(obj))
+            else:
+                # leave off the closing quote and parenthesis
+                self.emit(repr(obj[:self.remaining])[:-2])
+                raise _ReprFull()
+        else:
+            # no telling what an arbitrary __repr__ does, we can only cut it down
+            self.emit(safe_repr(obj))
+
+    def find_summarizer(self, obj_type):
+        try:
+            return TYPE_SUMMARIZERS[obj_type]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable metaclass
+            return None
+
+        found = None
+        for base in getattr(obj_type, '__mro__', (obj_type, )):
+            summarizer = REPR_SUMMARIZERS.get(base)
+            if summarizer is None:
+                summarizer = REPR_SUMMARIZERS.get('%s.%s' % (getattr(base, '__module__', ''), getattr(base, '__name__', '')))
+            if summarizer is not None:
+                found = summarizer
+                break
+
+        if len(TYPE_SUMMARIZERS) >= MAX_TYPE_SUMMARIZERS:
+            TYPE_SUMMARIZERS.clear()
+        TYPE_SUMMARIZERS[obj_type] = found
+        return found
+
+    def write_string(self, obj):
+        if len(obj) <= self.remaining:
+            self.emit(repr(obj))
+        else:
+            # leave off the closing quote
+            self.emit(repr(obj[:self.remaining])[:-1])
+            raise _ReprFull()
+
+    def write_items(self, obj, depth, start, end, is_dict = False):
+        if depth >= self.max_depth:
+            self.truncated = True
+            self.emit(start + '...' + end)
+            return
+        if id(obj) in self.containers:
+            # recursive, repr shows these as ... too
+            self.emit(start + '...' + end)
+            return
+
+        self.emit(start)
+        self.containers.add(id(obj))
+        count = 0
+        for item in obj:
+            if count:
+                self.emit(', ')
+            if count >= self.max_items:
+                self.truncated = True
+                self.emit('...')
+                break
+            if is_dict:
+                self.write(item, depth + 1)
+                self.emit(': ')
+                self.write(obj[item], depth + 1)
+            else:
+                self.write(item, depth + 1)
+            count += 1
+        self.containers.discard(id(obj))
+        self.emit(end)
+
+def summarize_ndarray(obj):
+    """shows the layout of a NumPy array rather than its values, along with
+       the min, max, mean and NaN count of numeric arrays which aren't too big"""
+    if obj.ndim == 0 or obj.size <= REPR_MAX_ITEMS:
+        # small enough to show the values
+        return None
+
+    text = '%s shape=%s dtype=%s strides=%s nbytes=%d' % (get_type_name(obj), obj.shape, obj.dtype, obj.strides, obj.nbytes)
+    if obj.dtype.kind not in 'biuf' or obj.size > ARRAY_STATS_MAX_SIZE:
+        return text
+
+    numpy = sys.modules['numpy']
+    with numpy.errstate(all = 'ignore'):
+        nan_count = 0
+        if obj.dtype.kind == 'f':
+            nan_count = int(numpy.count_nonzero(numpy.isnan(obj)))
+        if nan_count == obj.size:
+            return text + ' nan=%d' % (nan_count, )
+        if nan_count:
+            stats = numpy.nanmin(obj), numpy.nanmax(obj), numpy.nanmean(obj)
+        else:
+            stats = obj.min(), obj.max(), obj.mean()
+    return text + ' min=%s max=%s mean=%s nan=%d' % (stats + (nan_count, ))
+
+def summarize_array(obj):
+    if len(obj) <= REPR_MAX_ITEMS:
+        return None
+    return 'array typecode=%r itemsize=%d len=%d nbytes=%d' % (obj.typecode, obj.itemsize, len(obj), obj.itemsize * len(obj))
+
+def summarize_memoryview(obj):
+    nbytes = obj.itemsize
+    for dim in obj.shape or ():
+        nbytes *= dim
+    return 'memoryview format=%r itemsize=%d shape=%s strides=%s nbytes=%d' % (obj.format, obj.itemsize, obj.shape, obj.strides, nbytes)
+
+# NumPy and array don't get imported by us, these only apply once the program has
+register_summarizer('numpy.ndarray', summarize_ndarray)
+register_summarizer('array.array', summarize_array)
+try:
+    register_summarizer(memoryview, summarize_memoryview)
+except NameError:
+    # IronPython
+    pass
+
+def can_send_array_slice(obj):
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(obj, numpy.ndarray) and not obj.dtype.hasobject
+
+def get_array_slice(obj, start, end, max_bytes = None):
+    """returns rows start to end of a NumPy array as a contiguous array, cut
+       down to the rows which fit in max_bytes"""
+    if not can_send_array_slice(obj):
+        raise TypeError('%s is not an array of values' % (get_type_name(obj), ))
+    if obj.ndim == 0:
+        obj = obj.reshape(1)
+
+    rows = obj[start:end]
+    row_bytes = rows.itemsize
+    for dim in rows.shape[1:]:
+        row_bytes *= dim
+    max_rows = max(1, (max_bytes or ARRAY_SLICE_MAX_BYTES) // max(row_bytes, 1))
+    return sys.modules['numpy'].ascontiguousarray(rows[:max_rows])
+
 def safe_hex_repr(obj):
     try:
         return hex(obj)
@@ -1631,8 +4028,11 @@ def get_object_len(obj):
     except:
         return None
 
-def report_execution_result(execution_id, result):
-    obj_repr = safe_repr(result)
+def report_execution_result(execution_id, result, bounded_repr = None, handles = None):
+    obj_repr, truncated = (bounded_repr or BoundedRepr())(result)
+    handle = 0
+    if handles is not None:
+        handle = handles.get_handle(result)
     hex_repr = safe_hex_repr(result)
     res_type = type(result)
     type_name = type(result).__name__
@@ -1640,43 +4040,259 @@ def report_execution_result(execution_id, result):
 
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(EXCR)
-        conn.send(struct.pack('!I', execution_id))
-        write_object(conn,res_type, obj_repr, hex_repr, type_name, obj_len)
+        conn.write_uint(execution_id)
+        write_object(conn,res_type, obj_repr, hex_repr, type_name, obj_len, truncated, handle)
+
+# thread states in THRL
+THREAD_RUNNING = 0
+THREAD_STOPPED = 1
+
+def report_thread_list():
+    THREADS_LOCK.acquire()
+    all_threads = list(THREADS.values())
+    THREADS_LOCK.release()
+    names = get_thread_names()
+
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(THRL)
+        conn.write_uint(len(all_threads))
+        for cur_thread in all_threads:
+            conn.write_long(cur_thread.id)
+            write_string(conn, names.get(cur_thread.id, 'Python Thread'))
+            if cur_thread._is_blocked:
+                conn.write_uint(THREAD_STOPPED)
+            else:
+                conn.write_uint(THREAD_RUNNING)
+
+def report_frame_page(tid, start, total, frames):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(FRMS)
+        conn.write_long(tid)
+        conn.write_uint(start)
+        conn.write_uint(total)
+        conn.write_uint(len(frames))
+        for frame_info in frames:
+            write_frame(conn, frame_info, frame_info[6], False)
+
+def report_frame_variables(tid, frame_id, variables):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(FRMV)
+        conn.write_long(tid)
+        conn.write_uint(frame_id)
+        conn.write_uint(len(variables))
+        for name, type_obj, obj_repr, hex_repr, type_name, obj_len, truncated, handle in variables:
+            write_string(conn,name)
+            write_object(conn,type_obj, obj_repr, hex_repr, type_name, obj_len, truncated, handle)
+
+def report_value_chunk(request_id, total_length, offset, text):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(VALC)
+        conn.write_uint(request_id)
+        conn.write_uint(total_length)
+        conn.write_uint(offset)
+        write_string(conn, text)
 
-def report_children(execution_id, attributes, indices, indices_are_index, indices_are_enumerate):
-    attributes = [(index, safe_repr(result), safe_hex_repr(result), type(result), type(result).__name__, get_object_len(result)) for index, result in attributes]
-    indices = [(index, safe_repr(result), safe_hex_repr(result), type(result), type(result).__name__, get_object_len(result)) for index, result in indices]
+def report_array_slice(request_id, start, block, error = None):
+    with _SendLockCtx, _NetstringConn as conn:
+        conn.send(ARRS)
+        conn.send(_UINT2.pack(request_id, start))
+        write_string(conn, error)
+        if block is not None:
+            write_string(conn, block.dtype.str)
+            conn.write_uint(block.ndim)
+            for dim in block.shape:
+                conn.write_long(dim)
+            to_bytes = getattr(block, 'tobytes', None) or block.tostring
+            data = to_bytes()
+            conn.write_uint(len(data))
+            conn.send(data)
+
+def report_children(execution_id, children, offset, page, bounded_repr = None, handles = None):
+    """sends a page of the children of an object, children is None if the
+       object's handle is no longer valid"""
+    if bounded_repr is None:
+        bounded_repr = BoundedRepr()
+    page = [get_variable_info(name, value, bounded_repr, handles) for name, value in page]
 
     with _SendLockCtx, _NetstringConn as conn:
         conn.send(CHLD)
-        conn.send(struct.pack('!I', execution_id))
-        conn.send(struct.pack('!I', len(attributes)))
-        conn.send(struct.pack('!I', len(indices)))
-        conn.send(struct.pack('!I', indices_are_index))
-        conn.send(struct.pack('!I', indices_are_enumerate))
-        for child_name, obj_repr, hex_repr, res_type, type_name, obj_len in attributes:
-            write_string(conn,child_name)
-            write_object(conn,res_type, obj_repr, hex_repr, type_name, obj_len)
-        for child_name, obj_repr, hex_repr, res_type, type_name, obj_len in indices:
+        conn.write_uint(execution_id)
+        if children is None:
+            for value in (0, 0, 0, 0, offset):
+                conn.write_uint(value)
+        else:
+            conn.write_uint(children.total)
+            conn.write_uint(len(children.attributes))
+            conn.write_uint(children.indices_are_index)
+            conn.write_uint(children.indices_are_enumerate)
+            conn.write_uint(offset)
+        conn.write_uint(len(page))
+        for child_name, res_type, obj_repr, hex_repr, type_name, obj_len, truncated, handle in page:
             write_string(conn,child_name)
-            write_object(conn,res_type, obj_repr, hex_repr, type_name, obj_len)
+            write_object(conn,res_type, obj_repr, hex_repr, type_name, obj_len, truncated, handle)
 
 def get_code_filename(code):
-    return path.abspath(code.co_filename)
+    return get_code_info(code).filename
 
 NONEXPANDABLE_TYPES = set([int, str, bool, float, object, type(None), unicode])
 try:
     NONEXPANDABLE_TYPES.add(long)
 except NameError: pass
 
-def write_object(conn,obj_type, obj_repr, hex_repr, type_name, obj_len):
+# object flags
+OBJECT_EXPANDABLE = 1
+OBJECT_TRUNCATED = 2    # the repr got cut short, valc reads the rest
+
+def is_expandable(obj_type, obj_len):
+    return obj_type not in NONEXPANDABLE_TYPES and obj_len != 0
+
+def write_object(conn,obj_type, obj_repr, hex_repr, type_name, obj_len, truncated = False, handle = 0):
+    """handle is 0 when the object can't be expanded, or for objects which
+       aren't around any more (snapshots)"""
     write_string(conn,obj_repr)
     write_string(conn,hex_repr)
-    write_string(conn,type_name)
-    if obj_type in NONEXPANDABLE_TYPES or obj_len == 0:
-        conn.send(struct.pack('!I', 0))
-    else:
-        conn.send(struct.pack('!I', 1))
+    write_interned_string(conn,type_name)
+    flags = 0
+    if is_expandable(obj_type, obj_len):
+        flags |= OBJECT_EXPANDABLE
+    if truncated:
+        flags |= OBJECT_TRUNCATED
+    conn.send(_UINT2.pack(flags, handle))
+
+# iterables w/o a length get listed up to this many items when expanded
+MAX_ITERATED_CHILDREN = 10000
+
+def get_attributes(obj):
+    items = []
+    for name in dir(obj):
+        if not (name.startswith('__') and name.endswith('__')):
+            try:
+                item = getattr(obj, name)
+                if not hasattr(item, '__call__'):
+                    items.append( (name, item) )
+            except:
+                # skip this item if we can't display it...
+                pass
+    return items
+
+class ChildList(object):
+    """the children of an object, its attributes and then its items.  Lists
+       and tuples are indexed a page at a time, the items of other iterables
+       get listed when the object is first expanded but only repr'd a page at
+       a time."""
+    def __init__(self, obj):
+        self.obj = obj
+        self.attributes = get_attributes(obj)
+        self.items = None
+        self.item_count = 0
+        self.indices_are_index = False
+        self.indices_are_enumerate = False
+        self.items_are_dict = False
+        try:
+            if isinstance(obj, types.GeneratorType) or can_send_array_slice(obj):
+                # listing a generator would use it up, and arrays get paged
+                # through a block of rows at a time (arrs)
+                pass
+            elif isinstance(obj, (list, tuple)):
+                self.item_count = len(obj)
+                self.indices_are_index = True
+            elif isinstance(obj, dict) or (hasattr(obj, 'items') and hasattr(obj, 'has_key')):
+                # dictionary-like object
+                self.items = list(obj.items())
+                self.items_are_dict = True
+                self.indices_are_index = True
+            else:
+                if get_object_len(obj) is None:
+                    self.items = []
+                    for item in obj:
+                        if len(self.items) >= MAX_ITERATED_CHILDREN:
+                            self.items.append('Evaluation halted because sequence included too many items...')
+                            break
+                        self.items.append(item)
+                else:
+                    self.items = list(obj)
+                self.indices_are_index = True
+                # check if we can index back into this object, or if we have
+                # to use enumerate to get values out of it.
+                try:
+                    self.indices_are_enumerate = not self.items or obj[0] is not self.items[0]
+                except:
+                    self.indices_are_enumerate = True
+        except:
+            # non-indexable object
+            self.items = None
+            self.indices_are_index = False
+            self.indices_are_enumerate = False
+        if self.items is not None:
+            self.item_count = len(self.items)
+
+    @property
+    def total(self):
+        return len(self.attributes) + self.item_count
+
+    def get_page(self, offset, count, bounded_repr = None):
+        """returns (name, value) for up to count children starting at offset,
+           dictionary keys are named by their bounded repr"""
+        if bounded_repr is None:
+            bounded_repr = BoundedRepr()
+        page = []
+        attribute_count = len(self.attributes)
+        for index in xrange(offset, min(offset + count, self.total)):
+            if index < attribute_count:
+                page.append(self.attributes[index])
+                continue
+
+            index -= attribute_count
+            if self.items_are_dict:
+                key, value = self.items[index]
+                page.append( ('[' + bounded_repr(key)[0] + ']', value) )
+            elif self.items is not None:
+                if index == MAX_ITERATED_CHILDREN:
+                    page.append( ('[...]', self.items[index]) )
+                else:
+                    page.append( ('[' + repr(index) + ']', self.items[index]) )
+            else:
+                try:
+                    page.append( ('[' + repr(index) + ']', self.obj[index]) )
+                except IndexError:
+                    # the list got shorter while we were stopped
+                    break
+        return page
+
+class ObjectHandles(object):
+    """numbers the expandable objects the debugger is shown while a thread is
+       stopped so expanding one is a lookup rather than an eval of its
+       expression.  The numbers keep counting up across stops and the table
+       is cleared when the thread resumes, so stale handles just aren't found."""
+    def __init__(self):
+        self.objects = {}
+        self.handles = {}
+        self.children = {}
+        self.next_handle = 1
+
+    def get_handle(self, obj):
+        if not is_expandable(type(obj), get_object_len(obj)):
+            return 0
+        # we hold onto the objects, so their ids stay unique until we clear
+        handle = self.handles.get(id(obj))
+        if handle is None:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.objects[handle] = obj
+            self.handles[id(obj)] = handle
+        return handle
+
+    def get_children(self, handle):
+        """returns the ChildList of the object, or None for a stale handle"""
+        children = self.children.get(handle)
+        if children is None and handle in self.objects:
+            children = self.children[handle] = ChildList(self.objects[handle])
+        return children
+
+    def clear(self):
+        self.objects.clear()
+        self.handles.clear()
+        self.children.clear()
 
 
 try:
@@ -1708,15 +4324,22 @@ def intercept_threads(for_attach = False):
 
 
 def attach_process(port_num, debug_id, report_and_block = False):
+    select_trace_engine()
+
     global conn
+    # a debugger attaching again asks for compression again if it wants it
+    _NetstringConn.compress_threshold = None
+    _NetstringWrapper.interned.clear()
+    # and sends its own just my code globs
+    if CODE_FILTER.matcher is not None:
+        set_code_filter((), ())
     for i in xrange(50):
         try:
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect(('127.0.0.1', port_num))
+            conn = visualstudio_py_repl.connect_socket(port_num)
             with _NetstringConn as con:
                 con.send(CONN)
                 write_string(con,debug_id)
-                con.send(struct.pack('!I', 0))  # success
+                con.write_uint(0)  # success
             break
         except:
             import time
@@ -1746,16 +4369,17 @@ def attach_process(port_num, debug_id, report_and_block = False):
 
         main_thread.block(lambda: report_process_loaded(thread.get_ident()))
 
-    for mod_name, mod_value in sys.modules.items():
+    for mod_name, mod_value in list(sys.modules.items()):
         try:
             filename = getattr(mod_value, '__file__', None)
             if filename is not None:
+                if filename.endswith('.pyc') or filename.endswith('.pyo'):
+                    # the code in it has the source's filename
+                    filename = filename[:-1]
                 try:
-                    fullpath = path.abspath(filename)
+                    MODULES.add(filename, mod_value.__dict__)
                 except:
                     pass
-                else:
-                    MODULES.append((filename, Module(fullpath)))
         except:
             traceback.print_exc()   
 
@@ -1766,6 +4390,7 @@ def attach_process(port_num, debug_id, report_and_block = False):
 def detach_process():
     global DETACHED
     DETACHED = True
+    reset_trace_engine()
     if not _INTERCEPTING_FOR_ATTACH:
         if isinstance(sys.stdout, _DebuggerOutput): 
             sys.stdout = sys.stdout.old_out
@@ -1783,6 +4408,10 @@ def detach_threads():
         if not _INTERCEPTING_FOR_ATTACH:
             pyThread.detach = True
             pyThread.stepping = STEPPING_BREAK
+            pyThread.update_trace_func()
+
+        # whoever attaches next needs the frames in full
+        pyThread.frames_sent = None
 
         if pyThread._is_blocked:
             pyThread.unblock()
@@ -1791,6 +4420,7 @@ def detach_threads():
         THREADS.clear()
 
     BREAKPOINTS.clear()
+    TRACE_ENGINE.breakpoints_cleared()
 
     THREADS_LOCK.release()
 
@@ -1819,7 +4449,7 @@ def new_external_thread():
         # user requested break all, make this thread break
         thread.stepping = STEPPING_BREAK
 
-    sys.settrace(thread.trace_func)
+    thread.start_tracing()
 
 def do_wait():
     sys.__stdout__.write('Press any key to continue . . . ')
@@ -1853,7 +4483,7 @@ class _DebuggerOutput(object):
             probe_stack(3)
             with _SendLockCtx, _NetstringConn as conn:
                 conn.send(OUTP)
-                conn.send(struct.pack('!Q', thread.get_ident()))
+                conn.write_long(thread.get_ident())
                 write_string(conn,value)
         if self.old_out:
             self.old_out.write(value)
@@ -1881,7 +4511,7 @@ class DebuggerBuffer(object):
             str_data = data.decode('utf8')
             with _SendLockCtx, _NetstringConn as conn:
                 conn.send(OUTP)
-                conn.send(struct.pack('!Q', thread.get_ident()))
+                conn.write_long(thread.get_ident())
                 write_string(conn,str_data)
         self.buffer.write(data)
 
@@ -1932,7 +4562,7 @@ def silent_excepthook(exc_type, exc_value, exc_tb):
     # Used to avoid displaying the exception twice on exit.
     pass
 
-def debug(file, port_num, debug_id, globals_obj, locals_obj, wait_on_exception, redirect_output, wait_on_exit, break_on_systemexit_zero = False, debug_stdlib = False, django_debugging = False):
+def debug(file, port_num, debug_id, globals_obj, locals_obj, wait_on_exception, redirect_output, wait_on_exit, break_on_systemexit_zero = False, debug_stdlib = False, django_debugging = False, code_patch_breakpoints = False, condition_time_budget = None, log_point_file = None):
     # remove us from modules so there's no trace of us
     sys.modules['$visualstudio_py_debugger'] = sys.modules['visualstudio_py_debugger']
     __name__ = '$visualstudio_py_debugger'
@@ -1948,11 +4578,24 @@ def debug(file, port_num, debug_id, globals_obj, locals_obj, wait_on_exception,
         del globals_obj['break_on_systemexit_zero']
     if 'debug_stdlib' in globals_obj: 
         del globals_obj['debug_stdlib']
-
-    global BREAK_ON_SYSTEMEXIT_ZERO, DEBUG_STDLIB, DJANGO_DEBUG
+    if 'code_patch_breakpoints' in globals_obj: 
+        del globals_obj['code_patch_breakpoints']
+    if 'condition_time_budget' in globals_obj: 
+        del globals_obj['condition_time_budget']
+    if 'log_point_file' in globals_obj: 
+        del globals_obj['log_point_file']
+
+    global BREAK_ON_SYSTEMEXIT_ZERO, DEBUG_STDLIB, DJANGO_DEBUG, CODE_PATCH_BREAKPOINTS, LOG_POINT_FILE
     BREAK_ON_SYSTEMEXIT_ZERO = break_on_systemexit_zero
     DEBUG_STDLIB = debug_stdlib
+    # should_debug_code's verdicts depend on it
+    CODE_INFO.clear()
     DJANGO_DEBUG = django_debugging
+    CODE_PATCH_BREAKPOINTS = code_patch_breakpoints
+    LOG_POINT_FILE = log_point_file
+    if condition_time_budget is not None:
+        global CONDITION_TIME_BUDGET
+        CONDITION_TIME_BUDGET = condition_time_budget
 
     attach_process(port_num, debug_id)
 
@@ -1964,15 +4607,19 @@ def debug(file, port_num, debug_id, globals_obj, locals_obj, wait_on_exception,
     cur_thread = new_thread()
     cur_thread.stepping = STEPPING_LAUNCH_BREAK
 
+    # the launcher's frame is already running, engines which report events for
+    # running frames shouldn't stop in it
+    DONT_DEBUG.append(sys._getframe(1).f_code.co_filename)
+
     # start tracing on this thread
-    sys.settrace(cur_thread.trace_func)
+    cur_thread.start_tracing()
 
     # now execute main file
     try:
         try:
             execfile(file, globals_obj, locals_obj)
         finally:
-            sys.settrace(None)
+            TRACE_ENGINE.stop_thread(cur_thread)
             THREADS_LOCK.acquire()
             if THREADS:
                 del THREADS[cur_thread.id]
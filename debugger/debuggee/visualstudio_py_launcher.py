@@ -21,12 +21,15 @@ import sys
 import visualstudio_py_debugger
 import os
 
-# arguments are working dir, port, normal arguments which should include a filename to execute
+# arguments are working dir, port (or the path of a Unix domain socket), normal arguments which
+# should include a filename to execute
 
 # change to directory we expected to start from
 os.chdir(sys.argv[1])
 
-port_num = int(sys.argv[2])
+port_num = sys.argv[2]
+if port_num.isdigit():
+    port_num = int(port_num)
 debug_id = sys.argv[3]
 del sys.argv[0:4]
 
@@ -36,6 +39,9 @@ wait_on_exit = False
 break_on_systemexit_zero = False
 debug_stdlib = False
 django_debugging = False
+code_patch_breakpoints = False
+condition_time_budget = None
+log_point_file = None
 if len(sys.argv) >= 1 and sys.argv[0] == '--wait-on-exception':
     wait_on_exception = True
     del sys.argv[0]
@@ -61,6 +67,20 @@ if len(sys.argv) >= 1 and sys.argv[0] == '--django-debugging':
     django_debugging = True
     del sys.argv[0]
 
+if len(sys.argv) >= 1 and sys.argv[0] == '--code-patch-breakpoints':
+    code_patch_breakpoints = True
+    del sys.argv[0]
+
+if len(sys.argv) >= 2 and sys.argv[0] == '--condition-time-budget':
+    # milliseconds a break point condition can take on average before it's disabled
+    condition_time_budget = float(sys.argv[1]) / 1000
+    del sys.argv[0:2]
+
+if len(sys.argv) >= 2 and sys.argv[0] == '--log-point-file':
+    # local copy of the log point output
+    log_point_file = sys.argv[1]
+    del sys.argv[0:2]
+
 __file__ = sys.argv[0]
 
 # fix sys.path to be the script file dir
@@ -80,4 +100,7 @@ visualstudio_py_debugger.debug(__file__,
                                 wait_on_exit,
                                 break_on_systemexit_zero,
                                 debug_stdlib,
-                                django_debugging)
+                                django_debugging,
+                                code_patch_breakpoints,
+                                condition_time_budget,
+                                log_point_file)
@@ -24,7 +24,6 @@ import socket
 import select
 import time
 import struct
-import imp
 import traceback
 import random
 import os
@@ -52,6 +51,18 @@ def _debug_write(out):
         sys.__stdout__.write(out)
         sys.__stdout__.flush()
 
+def connect_socket(address):
+    """connects to a port number on this machine, or to the path of a Unix
+    domain socket, which has less latency for local sessions and no ports
+    to run out of"""
+    if isinstance(address, int):
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn.connect(('127.0.0.1', address))
+    else:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(address)
+    return conn
+
 
 class SafeSendLock(object):
     """a lock which ensures we're released if we take a KeyboardInterrupt exception acquiring it"""
@@ -112,8 +123,7 @@ actual inspection and introspection."""
         self.exit_requested = False
     
     def connect(self, port):
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn.connect(('127.0.0.1', port))
+        self.conn = connect_socket(port)
 
         # start a new thread for communicating w/ the remote process
         start_new_thread(self._repl_loop, ())
@@ -347,7 +357,7 @@ actual inspection and introspection."""
         import visualstudio_py_debugger
         visualstudio_py_debugger.DONT_DEBUG.append(__file__)
         new_thread = visualstudio_py_debugger.new_thread()
-        sys.settrace(new_thread.trace_func)
+        new_thread.start_tracing()
         visualstudio_py_debugger.intercept_threads(True)
 
     def send_image(self, filename):
@@ -504,7 +514,7 @@ class BasicReplBackend(ReplBackend):
                 self.exec_mod = Scope()
                 self.exec_mod.__name__ = '__main__'
             else:
-                sys.modules[mod_name] = self.exec_mod = imp.new_module(mod_name)
+                sys.modules[mod_name] = self.exec_mod = types.ModuleType(mod_name)
         else:
             self.exec_mod = sys.modules['__main__']
 
@@ -1254,7 +1264,7 @@ def _run_repl():
 
     parser = OptionParser(prog='repl', description='Process REPL options')
     parser.add_option('--port', dest='port',
-                   help='the port to connect back to')
+                   help='the port or Unix domain socket path to connect back to')
     parser.add_option('--launch_file', dest='launch_file',
                    help='the script file to run on startup')
     parser.add_option('--execution_mode', dest='backend',
@@ -1291,7 +1301,10 @@ def _run_repl():
 
     global BACKEND
     BACKEND = backend_type(launch_file=options.launch_file)
-    BACKEND.connect(int(options.port))
+    port = options.port
+    if port.isdigit():
+        port = int(port)
+    BACKEND.connect(port)
 
     if options.enable_attach:
         BACKEND.init_debugger()
@@ -1,12 +1,26 @@
 import struct
 import collections
+import time
+import zlib
 
 from twisted.internet.interfaces import IProtocol
 from twisted.protocols.basic import IntNStringReceiver
 from zope.interface import implements
 
 # Enthought library imports
-from traits.api import HasTraits, Enum, Event
+from traits.api import HasTraits, Enum, Event, Int, Float, List, Unicode, on_trait_change
+
+# Local imports
+from message_decoder import MessageDecoder, UINT2, UINT3, UINT4
+
+# the fixed size fields at the start of some messages
+SETL_FORMAT = struct.Struct('!IQI')
+SNAP_FORMAT = struct.Struct('!IQI')
+CHLD_FORMAT = struct.Struct('!IIIIIII')
+
+# capability flags the debuggee sends in CAPS
+CAPABILITY_ZLIB = 1
+CAPABILITY_JUST_MY_CODE = 2
 
 class PyToolsProtocol(HasTraits, IntNStringReceiver):
 
@@ -25,9 +39,35 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
     breakpointHit = Event()
     breakpointBindSucceeded = Event()
     breakpointBindFailed = Event()
+    breakpointConditionDisabled = Event()
+    logPointOutput = Event()
+    snapshotTaken = Event()
     setLineNoComplete = Event()
     debuggerOutput = Event()
     threadFrameList = Event()
+    threadFrameDelta = Event()
+    framePage = Event()
+    threadList = Event()
+    frameVariables = Event()
+    valueChunk = Event()
+    arraySlice = Event()
+    childrenEnumerated = Event()
+
+    # Messages with bodies of at least compress_threshold bytes get sent
+    # compressed at compress_level (1-9) if the debuggee can, 0 turns it off
+    compress_threshold = Int(8 * 1024)
+    compress_level = Int(1)
+
+    # Just my code: the debuggee doesn't step through or break in files
+    # matching an exclude glob unless they also match an include glob
+    just_my_code_include = List(Unicode)
+    just_my_code_exclude = List(Unicode)
+
+    # What compression has saved and what decompressing cost
+    compressed_messages = Int()
+    compressed_bytes = Int()
+    decompressed_bytes = Int()
+    decompress_time = Float()
 
     structFormat = "!I"
     prefixLength = struct.calcsize(structFormat)
@@ -36,9 +76,18 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
 
     def __init__(self, factory):
         self.factory = factory
+        # receive_XXXX for each message code XXXX
+        self._receivers = dict((name[len('receive_'):], getattr(self, name))
+                               for name in dir(self) if name.startswith('receive_'))
+        # the strings the debuggee has interned, in the order it sent them
+        self._interned = []
+        # what the debuggee said it can do in CAPS
+        self._capabilities = 0
 
     def connectionMade(self):
         self.state = 'connected'
+        self._interned = []
+        self._capabilities = 0
 
     def connectionLost(self, reason):
         self.state = 'disconnected'
@@ -46,8 +95,8 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
     def stringReceived(self, msg):
         # Unpack the msg
         code = msg[:4]
-        # Dispatch code
-        getattr(self, 'receive_%s'%code)(msg[4:])
+        # Dispatch code, the receivers read the rest w/o copying it
+        self._receivers[code](memoryview(msg)[4:])
 
     def lengthLimitExceeded(self, length):
         PyToolsProtocol.lengthLimitExceeded(self, length)
@@ -84,7 +133,9 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         self.transport.write('stpv')
         self.transport.write(struct.pack('!Q', thread_id))
 
-    def send_BRKP(self, brkpt_id, line_no, filename, condition, break_when_changed):
+    def send_BRKP(self, brkpt_id, line_no, filename, condition, break_when_changed, hit_count_kind=0, hit_count=0,
+                  log_message='', log_rate_limit=0, snapshot_count=0,
+                  snapshot_max_bytes=0):
         """ Set breakpoint command
 
         Data format:
@@ -94,26 +145,50 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             filename: string
             condition: string
             break_when_changed: int
+            hit count kind: int (0 none, 1 equal, 2 at least, 3 multiple of)
+            hit count: int
+            log message: string (makes it a log point which never stops)
+            log rate limit: int (messages per second, 0 for the default)
+            snapshot count: int (makes it a snapshot point which captures
+                the stack of its first snapshot count hits w/o stopping)
+            snapshot max bytes: int (0 for the default)
         """
         self.transport.write('brkp')
         self.transport.write(struct.pack('!II', brkpt_id, line_no))
         self._write_string(filename)
         self._write_string(condition)
         self.transport.write(struct.pack('!I', 1 if break_when_changed else 0))
-
-    def send_BRKC(self, brkpt_id, condition, break_when_changed):
+        self.transport.write(struct.pack('!II', hit_count_kind, hit_count))
+        self._write_string(log_message)
+        self.transport.write(struct.pack('!I', log_rate_limit))
+        self.transport.write(struct.pack('!II', snapshot_count, snapshot_max_bytes))
+
+    def send_BRKC(self, brkpt_id, condition, break_when_changed, hit_count_kind=0, hit_count=0,
+                  log_message='', log_rate_limit=0, snapshot_count=0,
+                  snapshot_max_bytes=0):
         """ Set breakpoint with condition
 
         Data format:
             breakpoint id: int
             condition: string
             break_when_changed: int
+            hit count kind: int (0 none, 1 equal, 2 at least, 3 multiple of)
+            hit count: int
+            log message: string (makes it a log point which never stops)
+            log rate limit: int (messages per second, 0 for the default)
+            snapshot count: int (makes it a snapshot point which captures
+                the stack of its first snapshot count hits w/o stopping)
+            snapshot max bytes: int (0 for the default)
         ------------
         """
         self.transport.write('brkc')
         self.transport.write(struct.pack('!I', brkpt_id))
         self._write_string(condition)
         self.transport.write(struct.pack('!I', 1 if break_when_changed else 0))
+        self.transport.write(struct.pack('!II', hit_count_kind, hit_count))
+        self._write_string(log_message)
+        self.transport.write(struct.pack('!I', log_rate_limit))
+        self.transport.write(struct.pack('!II', snapshot_count, snapshot_max_bytes))
 
     def send_BRKR(self, brkpt_id, line_no):
         """ Remove breakpoint command
@@ -167,21 +242,105 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         self._write_string(code)
         self.transport.write(struct.pack('!QIII', thread_id, frame_id, execution_id, 1))
 
-    def send_CHLD(self, code, thread_id, frame_id, execution_id, child_is_enumerate):
-        """ Enumerate children in given frame
+    def send_CHLD(self, thread_id, handle, execution_id, offset, count):
+        """ Enumerate a page of the children of an object.  The handle comes
+        with the object in FRMV, EXCR or CHLD, and is only good until the
+        thread resumes.
 
         Data format:
         -----------
-            code: string
             thread_id: long
-            frame_id: int
+            handle: int
             execution_id: int
-            frame_kind: int # UNUSED
-            child_is_enumerate: int
+            offset: int
+            count: int
         """
         self.transport.write('chld')
-        self._write_string(code)
-        self.transport.write(struct.pack('!QIIII', thread_id, frame_id, execution_id, 1, 1 if child_is_enumerate else 0))
+        self.transport.write(struct.pack('!QIIII', thread_id, handle, execution_id, offset, count))
+
+    def send_THRF(self, thread_id):
+        """ Ask for a thread's frames in full (THRF), for when the frames
+        a THRD applies to aren't the ones we have
+
+        Data format:
+        -----------
+            thread_id: long
+        """
+        self.transport.write('thrf')
+        self.transport.write(struct.pack('!Q', thread_id))
+
+    def send_STCK(self, thread_id):
+        """ Get a thread's frames (THRF or THRD), stops only send the frames
+        of the thread which stopped
+
+        Data format:
+        -----------
+            thread_id: long
+        """
+        self.transport.write('stck')
+        self.transport.write(struct.pack('!Q', thread_id))
+
+    def send_FRMS(self, thread_id, start, count):
+        """ Get the next page of a stopped thread's frames, start is how
+        many frames we have
+
+        Data format:
+        -----------
+            thread_id: long
+            start: int
+            count: int
+        """
+        self.transport.write('frms')
+        self.transport.write(struct.pack('!QII', thread_id, start, count))
+
+    def send_THRL(self):
+        """ Get the names and states of all the threads (THRL)
+        """
+        self.transport.write('thrl')
+
+    def send_FRMV(self, thread_id, frame_id):
+        """ Get the values of a frame's variables, THRF only has their names
+        and types
+
+        Data format:
+        -----------
+            thread_id: long
+            frame_id: int
+        """
+        self.transport.write('frmv')
+        self.transport.write(struct.pack('!QI', thread_id, frame_id))
+
+    def send_VALC(self, expression, thread_id, frame_id, request_id, offset, length):
+        """ Get part of the full repr of a value whose repr was cut short
+
+        Data format:
+        -----------
+            expression: string
+            thread_id: long
+            frame_id: int
+            request_id: int
+            offset: int
+            length: int
+        """
+        self.transport.write('valc')
+        self._write_string(expression)
+        self.transport.write(struct.pack('!QIIII', thread_id, frame_id, request_id, offset, length))
+
+    def send_ARRS(self, expression, thread_id, frame_id, request_id, start, end):
+        """ Get rows start to end of a NumPy array as one block of raw data
+
+        Data format:
+        -----------
+            expression: string
+            thread_id: long
+            frame_id: int
+            request_id: int
+            start: int
+            end: int
+        """
+        self.transport.write('arrs')
+        self._write_string(expression)
+        self.transport.write(struct.pack('!QIIII', thread_id, frame_id, request_id, start, end))
 
     def send_SETL(self, thread_id, frame_id, line_number):
         """ Set line number command
@@ -280,6 +439,57 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         """
         self.transport.write('drep')
 
+    def send_CAPS(self):
+        """ Get capabilities command, the debuggee answers with CAPS
+
+        Data format:
+        ------------
+        """
+        self.transport.write('caps')
+
+    def send_CMPR(self, threshold, level):
+        """ Set compression command, from then on the debuggee sends messages
+        with bodies of at least threshold bytes as ZLIB messages
+
+        Data format:
+        ------------
+            threshold: int
+            level: int
+        """
+        self.transport.write('cmpr')
+        self.transport.write(struct.pack('!Ii', threshold, level))
+
+    def send_JMCF(self, include, exclude):
+        """ Set just my code filter command, replaces the globs the debuggee
+        filters code by
+
+        Data format:
+        ------------
+            include count: int
+            include globs: string
+            exclude count: int
+            exclude globs: string
+        """
+        self.transport.write('jmcf')
+        for globs in (include, exclude):
+            self.transport.write(struct.pack('!I', len(globs)))
+            for glob in globs:
+                self._write_string(glob)
+
+    @on_trait_change('just_my_code_include[], just_my_code_exclude[]')
+    def _just_my_code_changed(self):
+        """ Sends the debuggee the globs whenever they change while debugging
+        """
+        if self.state == 'debugging' and self._capabilities & CAPABILITY_JUST_MY_CODE:
+            self.send_JMCF(self.just_my_code_include, self.just_my_code_exclude)
+
+    def compression_ratio(self):
+        """ How many times smaller compression made the messages received
+        """
+        if not self.compressed_bytes:
+            return 1.0
+        return self.decompressed_bytes / float(self.compressed_bytes)
+
     # Debugger events received
     def receive_CONN(self, bytes):
         """ Connected message
@@ -289,17 +499,51 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             Debug ID: string
             Success flag: int
         """
-        guid, bytes = self._read_string(bytes)
-        flag, = struct.unpack('!I', bytes)
+        reader = MessageDecoder(bytes, self._interned)
+        guid = reader.read_string()
+        flag = reader.read_uint()
 
         self.state = 'debugging'
         self.factory.processConnected(guid, self)
 
+        self.send_CAPS()
+
         # Send default exception handling info
         # format: count, (mode, name) - name is something like 'Exception.KeyError'
         # Mode is either BREAK_MODE_NEVER (0), BREAK_MODE_ALWAYS(1), BREAK_MODE_UNHANDLED(32)
         # XXX Ignore for now
 
+    def receive_CAPS(self, bytes):
+        """ Capabilities message, the answer to caps
+
+        Data format:
+        -----------
+            Capabilities: int
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        capabilities = reader.read_uint()
+        self._capabilities = capabilities
+
+        if capabilities & CAPABILITY_ZLIB and self.compress_threshold > 0:
+            self.send_CMPR(self.compress_threshold, self.compress_level)
+        if capabilities & CAPABILITY_JUST_MY_CODE and self.just_my_code_exclude:
+            self.send_JMCF(self.just_my_code_include, self.just_my_code_exclude)
+
+    def receive_ZLIB(self, bytes):
+        """ Compressed message
+
+        Data format:
+        ------------
+            message: zlib compressed code and body of another message
+        """
+        start = time.clock()
+        msg = zlib.decompress(bytes.tobytes())
+        self.decompress_time += time.clock() - start
+        self.compressed_messages += 1
+        self.compressed_bytes += len(bytes)
+        self.decompressed_bytes += len(msg)
+        self.stringReceived(msg)
+
     def receive_ASBR(self, bytes):
         """ Asynchronous break message
 
@@ -307,7 +551,7 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         ------------
             break id: int
         """
-        brkpt_id, = struct.unpack('!I', bytes)
+        brkpt_id = MessageDecoder(bytes, self._interned).read_uint()
         self.asyncBreakComplete = brkpt_id
 
     def receive_SETL(self, bytes):
@@ -319,16 +563,18 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             thread id: long
             newline: int
         """
-        status, thread_id, newline = struct.unpack('!IQI', bytes)
+        status, thread_id, newline = MessageDecoder(bytes, self._interned).unpack(SETL_FORMAT)
         self.setLineNoComplete = (status, thread_id, newline)
 
     def receive_THRF(self, bytes):
-        """ Thread frame list message
+        """ Thread frame list message, the innermost page of the thread's
+        frames (FRMS gets the rest)
 
         Data format:
         ------------
             Thread ID: long
             Thread name: string
+            Total frame count: int
             Frame count: int
             Frame:
                 First line number: int
@@ -340,31 +586,198 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
                 num variables: int
                 Variables:
                     name: string
-                    Variable object:
-                        repr: string
-                        hex rep: string
-                        type name: string
-                        expandable: int
-        """
-        thread_id, = struct.unpack('!Q', bytes[:8])
-        tname, bytes = self._read_string(bytes[8:])
-        fcount, = struct.unpack('!I', bytes[:4])
-        bytes = bytes[4:]
-        frames = []
-        for f_i in range(fcount):
-            flineno,lineno,curlineno = struct.unpack('!III', bytes[:12])
-            framename, bytes = self._read_string(bytes[12:])
-            filename, bytes = self._read_string(bytes)
-            argcount, vcount = struct.unpack('!II', bytes[:8])
-            bytes = bytes[8:]
+                    type name: string
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        thread_id = reader.read_long()
+        tname = reader.read_string()
+        total = reader.read_uint()
+        frames = reader.read_frames(values=False)
+        assert(reader.at_end())
+        self.threadFrameList = (thread_id, tname, total, frames)
+
+    def receive_FRMS(self, bytes):
+        """ Frame page message, the reply to frms.  Frame ids start at start.
+
+        Data format:
+        ------------
+            Thread ID: long
+            start: int
+            Total frame count: int
+            Frame count: int
+            Frame: same as in THRF
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        thread_id = reader.read_long()
+        start, total = reader.unpack(UINT2)
+        frames = reader.read_frames(values=False)
+        assert(reader.at_end())
+        self.framePage = (thread_id, start, total, frames)
+
+    def receive_THRL(self, bytes):
+        """ Thread list message, the reply to thrl
+
+        Data format:
+        ------------
+            Thread count: int
+            Thread:
+                Thread ID: long
+                Thread name: string
+                state: int (0 running, 1 stopped)
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        threads = []
+        for t_i in range(reader.read_uint()):
+            thread_id = reader.read_long()
+            tname = reader.read_string()
+            state = reader.read_uint()
+            threads.append((thread_id, tname, state == 1))
+        assert(reader.at_end())
+        self.threadList = threads
+
+    def receive_THRD(self, bytes):
+        """ Thread frame delta message, the changes to the last frame list
+        (and the pages of frames after it) sent for the thread.  The kept
+        frames of the previous list stay, the ones after them are dropped, and
+        the pushed frames go on top of them.  Frames are numbered from the
+        innermost one in the new list.
+
+        Data format:
+        ------------
+            Thread ID: long
+            Thread name: string
+            Previous frame count: int
+            Total frame count: int
+            Kept frames start: int (index in the previous list)
+            Kept frame count: int
+            Pushed frame count: int
+            Frame: same as in THRF
+            Changed frame count: int
+            Changed frame:
+                frame id: int
+                Cur line no: int
+                num variables: int
+                num changed variables: int
+                Changed variables:
+                    position: int
+                    name: string
+                    type name: string
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        thread_id = reader.read_long()
+        tname = reader.read_string()
+        prev_count, total, kept_start, kept = reader.unpack(UINT4)
+        frames = reader.read_frames(values=False)
+        changes = []
+        for c_i in range(reader.read_uint()):
+            frame_id, curlineno, vcount, nvars = reader.unpack(UINT4)
             vars = []
-            for v_i in range(vcount):
-                varname, bytes = self._read_string(bytes)
-                obj, bytes = self._read_object(bytes)
-                vars.append((varname, obj))
-            frames.append((flineno,lineno,curlineno,framename,filename,argcount,vars))
-        assert(len(bytes) == 0)
-        self.threadFrameList = (thread_id, tname, frames)
+            for v_i in range(nvars):
+                position = reader.read_uint()
+                varname = reader.read_string()
+                vartype = reader.read_string()
+                vars.append((position, varname, vartype))
+            changes.append((frame_id, curlineno, vcount, vars))
+        assert(reader.at_end())
+        self.threadFrameDelta = (thread_id, tname, prev_count, total, kept_start, kept, frames, changes)
+
+    def receive_SNAP(self, bytes):
+        """ Snapshot message, the stack a snapshot point captured when it was
+        hit.  The thread kept running, so the variables can't be expanded.
+
+        Data format:
+        ------------
+            breakpoint id: int
+            Thread ID: long
+            capture number: int
+            Thread name: string
+            truncated: int (frames or variables were left out to fit the
+                snapshot's max bytes)
+            Frame count: int
+            Frame: same as in THRF, but with variable objects like FRMV's
+                in place of the type names
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        brkpt_id, thread_id, capture = reader.unpack(SNAP_FORMAT)
+        tname = reader.read_string()
+        truncated = reader.read_uint()
+        frames = reader.read_frames()
+        assert(reader.at_end())
+        self.snapshotTaken = (brkpt_id, thread_id, capture, tname, truncated == 1, frames)
+
+    def receive_FRMV(self, bytes):
+        """ Frame variables message, the reply to frmv
+
+        Data format:
+        ------------
+            Thread ID: long
+            frame id: int
+            num variables: int
+            Variables:
+                name: string
+                Variable object:
+                    repr: string
+                    hex rep: string
+                    type name: string
+                    flags: int (1 expandable, 2 repr was cut short)
+                    handle: int (for CHLD, 0 if it can't be expanded)
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        thread_id = reader.read_long()
+        frame_id, vcount = reader.unpack(UINT2)
+        vars = []
+        for v_i in range(vcount):
+            varname = reader.read_string()
+            vars.append((varname, reader.read_object()))
+        assert(reader.at_end())
+        self.frameVariables = (thread_id, frame_id, vars)
+
+    def receive_VALC(self, bytes):
+        """ Value chunk message, the reply to valc.  The total length is 0 if
+        the value couldn't be read because the thread is running.
+
+        Data format:
+        ------------
+            request id: int
+            total length: int
+            offset: int
+            text: string
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        request_id, total_length, offset = reader.unpack(UINT3)
+        text = reader.read_string()
+        assert(reader.at_end())
+        self.valueChunk = (request_id, total_length, offset, text)
+
+    def receive_ARRS(self, bytes):
+        """ Array slice message, the reply to arrs.  The rows are cut down to
+        the ones which fit in the debuggee's block size, so there may be fewer
+        than were asked for.
+
+        Data format:
+        ------------
+            request id: int
+            start: int
+            error: string (empty if the rows were read)
+            if there's no error:
+                dtype: string (numpy.dtype(dtype) gives back the type)
+                ndim: int
+                shape: long for each dimension
+                data: int length + the raw C ordered bytes of the rows
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        request_id, start = reader.unpack(UINT2)
+        error = reader.read_string()
+        if error:
+            assert(reader.at_end())
+            self.arraySlice = (request_id, start, error, '', (), '')
+            return
+        dtype = reader.read_string()
+        ndim = reader.read_uint()
+        shape = tuple(reader.read_long() for dim in range(ndim))
+        data = reader.read_bytes(reader.read_uint())
+        assert(reader.at_end())
+        self.arraySlice = (request_id, start, '', dtype, shape, data)
 
     def receive_DETC(self, bytes):
         """ Detach message (process exited)
@@ -382,7 +795,7 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         -----------
             Thread ID: long
         """
-        thread_id, = struct.unpack('!Q', bytes)
+        thread_id = MessageDecoder(bytes, self._interned).read_long()
         self.threadCreated = thread_id
 
     def receive_EXTT(self, bytes):
@@ -392,7 +805,7 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         ------------
             thread id: long
         """
-        thread_id, = struct.unpack('!Q', bytes)
+        thread_id = MessageDecoder(bytes, self._interned).read_long()
         self.threadExited = thread_id
 
     def receive_EXCP(self, bytes):
@@ -405,10 +818,12 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             break type: int
             exception text: string
         """
-        name, bytes = self._read_string(bytes)
-        thread_id, break_type = struct.unpack('!QI', bytes[:12])
-        excp_text, bytes = self._read_string(bytes[12:])
-        assert(len(bytes) == 0)
+        reader = MessageDecoder(bytes, self._interned)
+        name = reader.read_string()
+        thread_id = reader.read_long()
+        break_type = reader.read_uint()
+        excp_text = reader.read_string()
+        assert(reader.at_end())
         self.exceptionRaised = (thread_id, name, break_type, excp_text)
 
     def receive_MODL(self, bytes):
@@ -419,9 +834,10 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             Module id: long
             Module filename: string
         """
-        module_id, = struct.unpack('!Q', bytes[:8])
-        filename, bytes = self._read_string(bytes[8:])
-        assert(len(bytes) == 0)
+        reader = MessageDecoder(bytes, self._interned)
+        module_id = reader.read_long()
+        filename = reader.read_string()
+        assert(reader.at_end())
         self.moduleLoaded = (module_id, filename)
 
     def receive_STPD(self, bytes):
@@ -431,7 +847,7 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         ------------
             thread id: long
         """
-        thread_id, = struct.unpack('!Q', bytes)
+        thread_id = MessageDecoder(bytes, self._interned).read_long()
         self.stepComplete = thread_id
 
     def receive_BRKS(self, bytes):
@@ -441,7 +857,7 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         ------------
             breakpoint id: int
         """
-        brkpt_id, = struct.unpack('!I', bytes)
+        brkpt_id = MessageDecoder(bytes, self._interned).read_uint()
         self.breakpointBindSucceeded = brkpt_id
 
     def receive_BRKF(self, bytes):
@@ -451,9 +867,45 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         ------------
             breakpoint id: int
         """
-        brkpt_id, = struct.unpack('!I', bytes)
+        brkpt_id = MessageDecoder(bytes, self._interned).read_uint()
         self.breakpointBindFailed = brkpt_id
 
+    def receive_BRKD(self, bytes):
+        """ Breakpoint condition disabled message, sent when a condition keeps
+        raising or takes too long to evaluate.  The breakpoint no longer stops
+        until it's given a new condition.
+
+        Data format:
+        ------------
+            breakpoint id: int
+            reason: string
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        brkpt_id = reader.read_uint()
+        reason = reader.read_string()
+        self.breakpointConditionDisabled = (brkpt_id, reason)
+
+    def receive_LOGP(self, bytes):
+        """ Log point output message, a batch of the messages log points
+        have logged since the last one.
+
+        Data format:
+        ------------
+            message count: int
+            message count times:
+                breakpoint id: int
+                thread id: long
+                text: string
+        """
+        reader = MessageDecoder(bytes, self._interned)
+        messages = []
+        for i in range(reader.read_uint()):
+            brkpt_id = reader.read_uint()
+            thread_id = reader.read_long()
+            text = reader.read_string()
+            messages.append((brkpt_id, thread_id, text))
+        self.logPointOutput = messages
+
     def receive_BRKH(self, bytes):
         """ Breakpoint hit message
 
@@ -462,8 +914,9 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             breakpoint id: int
             thread id: long
         """
-        brkpt_id, = struct.unpack('!I', bytes[:4])
-        thread_id, = struct.unpack('!Q', bytes[4:])
+        reader = MessageDecoder(bytes, self._interned)
+        brkpt_id = reader.read_uint()
+        thread_id = reader.read_long()
         self.breakpointHit = (thread_id, brkpt_id)
 
     def receive_LOAD(self, bytes):
@@ -473,7 +926,7 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         ------------
             thread id: long
         """
-        thread_id, = struct.unpack('!Q', bytes)
+        thread_id = MessageDecoder(bytes, self._interned).read_long()
         self.processLoaded = (thread_id,)
 
     def receive_EXCE(self, bytes):
@@ -484,9 +937,10 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             execution id: int
             exception text: string
         """
-        eid, = struct.unpack('!I', bytes[:4])
-        string, bytes = self._read_string(bytes[4:])
-        assert(len(bytes) == 0)
+        reader = MessageDecoder(bytes, self._interned)
+        eid = reader.read_uint()
+        string = reader.read_string()
+        assert(reader.at_end())
 
     def receive_EXCR(self, bytes):
         """ Execution result message
@@ -496,37 +950,40 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             execution id: int
             result: object
         """
-        eid, = struct.unpack('!I', bytes[:4])
-        obj, bytes = self._read_object(bytes[4:])
-        assert(len(bytes) == 0)
+        reader = MessageDecoder(bytes, self._interned)
+        eid = reader.read_uint()
+        obj = reader.read_object()
+        assert(reader.at_end())
 
     def receive_CHLD(self, bytes):
-        """ Enumerate children
+        """ Enumerate children, a page of the children of an object.  The
+        attributes come first, then the indices.  Total is 0 if the handle
+        wasn't valid any more.
 
         Data format:
         ------------
             execution id: int
-            num attributes: int
-            num indices: int
+            total children: int
+            num attributes: int (of the total)
             indices are index: int
             indices are enumarate: int
-            Attribute Children:
-                name: string
-                object:
-            Index children:
+            offset: int
+            num children: int (in this page)
+            Children:
                 name: string
                 object:
         """
-        eid, nattr, nidx, idx_are_index, idx_are_enum = struct.unpack('!IIIII', bytes[:20])
-        bytes = bytes[20:]
-        for attr in range(nattr):
-            name, bytes = self._read_string(bytes)
-            obj, bytes = self._read_object(bytes)
-        for idx in range(nidx):
-            name, byptes = self._read_string(bytes)
-            obj, bytes = self._read_object(bytes)
-
-        assert(len(bytes) == 0)
+        reader = MessageDecoder(bytes, self._interned)
+        eid, total, nattr, idx_are_index, idx_are_enum, offset, count = reader.unpack(CHLD_FORMAT)
+        read_string = reader.read_string
+        read_object = reader.read_object
+        children = []
+        for child in range(count):
+            name = read_string()
+            children.append((name, read_object()))
+
+        assert(reader.at_end())
+        self.childrenEnumerated = (eid, total, nattr, idx_are_index == 1, idx_are_enum == 1, offset, children)
 
     def receive_OUTP(self, bytes):
         """ Process output message
@@ -536,23 +993,26 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
             thread id: long
             output: string
         """
-        thread_id, = struct.unpack('!Q', bytes[:8])
-        output, bytes = self._read_string(bytes[8:])
-        assert(len(bytes) == 0)
+        reader = MessageDecoder(bytes, self._interned)
+        thread_id = reader.read_long()
+        output = reader.read_string()
+        assert(reader.at_end())
         self.debuggerOutput = (thread_id, output)
 
     def receive_REQH(self, bytes):
-        """ Request handler message
+        """ Request handler message, from older debuggees which didn't find
+        the exception handlers in a file themselves
 
         Data format:
         ------------
             code_filename: string
         """
-        fname, bytes = self._read_string(bytes)
+        reader = MessageDecoder(bytes, self._interned)
+        fname = reader.read_string()
         # XXX for now, send back and empty list of handled exceptions
         statement = collections.namedtuple('statement', 'start, end, text')
         self.send_SEHI(fname, [statement(-1, 0, '-')])
-        assert(len(bytes) == 0)
+        assert(reader.at_end())
 
     def _write_string(self, string):
         """ Writes a string in the format expected by the debugger
@@ -560,32 +1020,6 @@ class PyToolsProtocol(HasTraits, IntNStringReceiver):
         # Use the protocol's sendString
         self.sendString(string.encode('utf8'))
 
-    def _read_string(self, bytes):
-        """ Reads a string out of bytes, returning the string
-            and any remaining bytes
-        """
-        # First character specifies a string code
-        code = bytes[0]
-        if code == 'N':
-            return '', bytes[1:]
-        else:
-            size, = struct.unpack('!I', bytes[1:5])
-            string = bytes[5:5+size]
-            if code == 'U':
-                string = string.decode('utf8')
-            return string, bytes[5+size:]
-
-    def _read_object(self, bytes):
-        """ Reads an object of out bytes, returning that object
-            and any remaining bytes
-        """
-        varrepr, bytes = self._read_string(bytes)
-        varhex, bytes = self._read_string(bytes)
-        vartype, bytes = self._read_string(bytes)
-        varexp, = struct.unpack('!I', bytes[:4])
-        bytes = bytes[4:]
-        return (varrepr, varhex, vartype, varexp), bytes
-
 
 def main():
     from twisted.internet import reactor
@@ -1,7 +1,7 @@
 import uuid
 
 # Enthought library imports
-from traits.api import HasTraits, Bool, Instance, Dict, Int
+from traits.api import HasTraits, Bool, Instance, Dict, Int, List, Unicode, on_trait_change
 
 # Local imports
 from python_process import PythonProcess
@@ -16,18 +16,35 @@ class DebuggerService(HasTraits, ServerFactory):
 
     port = Int()
 
+    # Set instead of port when we listen on a Unix domain socket
+    socket_path = Unicode()
+
+    # Just my code globs for every process we debug, see PyToolsProtocol
+    just_my_code_include = List(Unicode)
+    just_my_code_exclude = List(Unicode)
+
     def stop_service(self):
         for process in self.processes.values():
             process.Terminate()
 
     def debug(self):
-        process = PythonProcess(port=self.port)
+        process = PythonProcess(port=self.port, socket_path=self.socket_path)
         # Add to internal cache before starting
         self.processes[process.ProcessGuid] = process
         return process
 
     def buildProtocol(self, addr):
-        return PyToolsProtocol(self)
+        protocol = PyToolsProtocol(self)
+        protocol.just_my_code_include = self.just_my_code_include
+        protocol.just_my_code_exclude = self.just_my_code_exclude
+        return protocol
+
+    @on_trait_change('just_my_code_include[], just_my_code_exclude[]')
+    def _just_my_code_changed(self):
+        for process in self.processes.values():
+            if process.protocol is not None:
+                process.protocol.just_my_code_include = self.just_my_code_include
+                process.protocol.just_my_code_exclude = self.just_my_code_exclude
 
     def processConnected(self, guid, protocol):
         # Lookup the process and set up the protocol
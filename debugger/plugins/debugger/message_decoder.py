@@ -0,0 +1,108 @@
+""" Decoding of the messages the debuggee sends.  A MessageDecoder keeps an
+offset into a memoryview of the message instead of slicing off what it has
+read, so reading a message is linear in its size.
+"""
+import codecs
+import struct
+
+UINT = struct.Struct('!I')
+LONG = struct.Struct('!Q')
+UINT2 = struct.Struct('!II')
+UINT3 = struct.Struct('!III')
+UINT4 = struct.Struct('!IIII')
+
+unpack_uint = UINT.unpack_from
+utf_8_decode = codecs.utf_8_decode
+
+
+class MessageDecoder(object):
+    """ Reads the fields of one message in order.
+    """
+
+    def __init__(self, data, interned=None):
+        self.data = memoryview(data)
+        self.offset = 0
+        # the strings the debuggee has interned on this connection so far
+        self.interned = interned
+
+    def unpack(self, fmt):
+        """ Reads the fields of a precompiled struct.Struct
+        """
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def read_uint(self):
+        value, = UINT.unpack_from(self.data, self.offset)
+        self.offset += 4
+        return value
+
+    def read_long(self):
+        value, = LONG.unpack_from(self.data, self.offset)
+        self.offset += 8
+        return value
+
+    def read_bytes(self, size):
+        start = self.offset
+        self.offset += size
+        return self.data[start:self.offset].tobytes()
+
+    def read_string(self):
+        """ Reads a string, which starts with N (None, read as an empty
+        string), A (ASCII) or U (UTF-8) and its length.  Strings the debuggee
+        interns start with D the first time, and are just I and their
+        index in the interning table after that.
+        """
+        data = self.data
+        offset = self.offset
+        code = data[offset]
+        if code == 'N':
+            self.offset = offset + 1
+            return ''
+        if code == 'I':
+            index, = unpack_uint(data, offset + 1)
+            self.offset = offset + 5
+            return self.interned[index]
+        if code == 'D':
+            self.offset = offset + 1
+            string = self.read_string()
+            self.interned.append(string)
+            return string
+        size, = unpack_uint(data, offset + 1)
+        start = offset + 5
+        end = self.offset = start + size
+        if code == 'U':
+            return utf_8_decode(data[start:end])[0]
+        return data[start:end].tobytes()
+
+    def read_object(self):
+        """ Reads a variable object, (repr, hex repr, type name, flags,
+        handle)
+        """
+        varrepr = self.read_string()
+        varhex = self.read_string()
+        vartype = self.read_string()
+        varflags, varhandle = self.unpack(UINT2)
+        return (varrepr, varhex, vartype, varflags, varhandle)
+
+    def read_frames(self, values=True):
+        """ Reads a frame count and that many frames.  Without values the
+        variables are just names and type names.
+        """
+        read_string = self.read_string
+        read_value = self.read_object if values else read_string
+        frames = []
+        for f_i in range(self.read_uint()):
+            flineno, lineno, curlineno = self.unpack(UINT3)
+            framename = read_string()
+            filename = read_string()
+            argcount, vcount = self.unpack(UINT2)
+            vars = []
+            for v_i in range(vcount):
+                varname = read_string()
+                vars.append((varname, read_value()))
+            frames.append((flineno,lineno,curlineno,framename,filename,argcount,vars))
+        return frames
+
+    def at_end(self):
+        return self.offset == len(self.data)
@@ -1,10 +1,12 @@
 # Standard library imports.
 import os.path
+import shutil
+import tempfile
 
 # Enthought library imports.
 from envisage.api import Plugin, ServiceOffer
 from envisage.ui.tasks.api import TaskFactory
-from traits.api import Any, List, Int
+from traits.api import Any, Enum, List, Int
 
 
 class DebuggerPlugin(Plugin):
@@ -25,9 +27,16 @@ class DebuggerPlugin(Plugin):
     # The plugin's name (suitable for displaying to the user).
     name = 'Debugger'
 
+    # How the processes being debugged connect back to us.  A Unix domain
+    # socket has less latency than TCP and no ports to run out of, but there
+    # are none on Windows.
+    transport = Enum('tcp', 'unix')
+
     def stop(self):
         if self._debugger_service:
             self._debugger_service.stop_service()
+            if self._debugger_service.socket_path:
+                shutil.rmtree(os.path.dirname(self._debugger_service.socket_path), ignore_errors=True)
 
     #### Contributions to extension points made by this plugin ################
 
@@ -73,13 +82,20 @@ class DebuggerPlugin(Plugin):
 
     def _create_debugger_service(self):
         from .debugger_service import DebuggerService
-        from ..twisted.ireactor import IReactorTCP
+        from ..twisted.ireactor import IReactorTCP, IReactorUNIX
 
         # Get the twisted reactor from the reactor plugin
         self._debugger_service = service = DebuggerService()
 
-        reactor = self.application.get_service(IReactorTCP)
-        port = reactor.listenTCP(0, service)
-        service.port = port.getHost().port
+        if self.transport == 'unix':
+            reactor = self.application.get_service(IReactorUNIX)
+            # a directory only we can get at for the socket
+            socket_dir = tempfile.mkdtemp(prefix='debugger-')
+            service.socket_path = os.path.join(socket_dir, 'debugger.sock')
+            reactor.listenUNIX(service.socket_path, service)
+        else:
+            reactor = self.application.get_service(IReactorTCP)
+            port = reactor.listenTCP(0, service)
+            service.port = port.getHost().port
         return service
 
@@ -11,6 +11,11 @@ from traits.api import (
 # Local imports
 from debugger_protocol import PyToolsProtocol
 
+# how many children PythonEvaluationResult.GetChildren reads at a time
+CHILDREN_PAGE_SIZE = 100
+# how many more frames PythonThread.LoadMoreFrames reads at a time
+FRAME_PAGE_SIZE = 50
+
 
 class PythonProcess(HasStrictTraits):
 
@@ -20,11 +25,28 @@ class PythonProcess(HasStrictTraits):
 
     protocol = Instance(PyToolsProtocol)
     port = Int()
+    # the debuggee connects to this Unix domain socket instead if it's set
+    socket_path = Unicode()
 
     readyToDebug = Bool(False)
 
     moduleLoaded = Event()
     completedDebugging = Event()
+    # (breakpoint, thread id, text) for each message log points logged
+    logPointOutput = Event()
+    # PythonSnapshot for each snapshot snapshot points captured
+    snapshotTaken = Event()
+    # (evaluation result, total length, offset, text) for each part of a full
+    # value read with PythonEvaluationResult.GetFullValue
+    valueChunk = Event()
+    # (evaluation result, start, error, dtype, shape, data) for each block of
+    # rows read with PythonEvaluationResult.GetArraySlice
+    arraySlice = Event()
+    # (evaluation result, total children, offset, children) for each page of
+    # children read with PythonEvaluationResult.GetChildren
+    childrenEnumerated = Event()
+    # the PythonThreads whose names and states GetThreadList updated
+    threadListUpdated = Event()
 
     @on_trait_change('protocol:processLoaded')
     def process_loaded(self, thread_id):
@@ -48,33 +70,160 @@ class PythonProcess(HasStrictTraits):
             self.completedDebugging = True
 
     @on_trait_change('protocol:threadFrameList')
-    def new_frame_list(self, (thread_id, thread_name, frames)):
+    def new_frame_list(self, (thread_id, thread_name, total, frames)):
         thread = self._threads[thread_id]
         thread.Name = thread_name
-        _frames = []
+        thread._frameCount = total
+        thread._frames = self._make_unloaded_frames(frames, thread)
+
+    @on_trait_change('protocol:framePage')
+    def frame_page(self, (thread_id, start, total, frames)):
+        thread = self._threads.get(thread_id)
+        if thread is None or start != len(thread._frames):
+            # we didn't ask for these after the frames we have
+            return
+        thread._frameCount = total
+        thread._frames = thread._frames + self._make_unloaded_frames(frames, thread, start)
+
+    @on_trait_change('protocol:threadFrameDelta')
+    def frame_list_delta(self, (thread_id, thread_name, prev_count, total, kept_start, kept, frames, changes)):
+        thread = self._threads[thread_id]
+        if len(thread._frames) != prev_count:
+            # we missed a frame list somewhere, start over
+            self.protocol.send_THRF(thread_id)
+            return
+        thread.Name = thread_name
+        thread._frameCount = total
+
+        keptFrames = thread._frames[kept_start:kept_start + kept]
+        newFrames = self._make_unloaded_frames(frames, thread)
+        for frameid, frame in enumerate(keptFrames, len(newFrames)):
+            # the values may have changed since they were loaded
+            frame._frameId = frameid
+            frame._variablesLoaded = False
+        allFrames = newFrames + keptFrames
+
+        for frameid, curlineno, vcount, vars in changes:
+            frame = allFrames[frameid]
+            frame._lineNo = curlineno
+            variables = frame._variables[:vcount]
+            for position, varname, vartype in vars:
+                var = self._make_result(frame, (u'', u'', vartype, 0, 0), varname)
+                if position < len(variables):
+                    variables[position] = var
+                else:
+                    variables.append(var)
+            frame._variables = variables
+        thread._frames = allFrames
+
+    @on_trait_change('protocol:threadList')
+    def thread_list(self, threads):
+        updated = []
+        for thread_id, thread_name, stopped in threads:
+            thread = self._threads.get(thread_id)
+            if thread is not None:
+                thread.Name = thread_name
+                thread._isStopped = stopped
+                updated.append(thread)
+        self.threadListUpdated = updated
+
+    def GetThreadList(self):
+        self.protocol.send_THRL()
+
+    def LoadThreadFrames(self, thread):
+        self.protocol.send_STCK(thread.Id)
+
+    def LoadMoreFrames(self, thread, count):
+        self.protocol.send_FRMS(thread.Id, len(thread._frames), count)
+
+    def _make_unloaded_frames(self, frames, thread, firstFrameId=0):
+        # only the names and types of the variables, LoadVariables gets the rest
         for startline,endline,lineno,framename,filename,argcount,vars in frames:
+            vars[:] = [(varname, (u'', u'', vartype, 0, 0)) for varname, vartype in vars]
+        return self._make_frames(frames, thread, loaded=False, firstFrameId=firstFrameId)
+
+    def _make_frames(self, frames, thread, loaded=True, firstFrameId=0):
+        _frames = []
+        for frameid, (startline,endline,lineno,framename,filename,argcount,vars) in enumerate(frames, firstFrameId):
             frame = PythonStackFrame(
                 _startLine=startline, _endLine=endline, _lineNo=lineno,
                 _frameName=framename, _filename=filename,_argCount=argcount,
-                _thread=self
-                    )
-            _vars = []
-            for varname, (varrepr,varhex,vartype,varexp)  in vars:
-                var = PythonEvaluationResult(
-                    _expression=varname, _objRepr=varrepr, _typeName=vartype, _hexRepr=varhex,
-                    _isExpandable=(varexp == 1), _childText='', _childIsIndex=False,
-                    _childIsEnumerate=False, _frame=frame, _process=self,
+                _frameId=frameid, _thread=thread, _variablesLoaded=loaded,
                     )
-                _vars.append(var)
-            frame._variables = _vars
+            frame._variables = self._make_variables(frame, vars)
+            _frames.append(frame)
+        return _frames
 
+    def _make_snapshot_frames(self, frames):
+        # the thread has moved on and may be gone by the time anyone looks, so
+        # the frames keep what they need from it now
+        _frames = []
+        for startline,endline,lineno,framename,filename,argcount,vars in frames:
+            frame = PythonSnapshotFrame(
+                _startLine=startline, _endLine=endline, _lineNo=lineno,
+                _frameName=framename, _fileName=self.MapFile(filename, toDebuggee=False),
+                _argCount=argcount,
+                    )
+            # the objects are gone by now, so the variables can't be expanded
+            frame._variables = self._make_variables(frame, vars, expandable=False)
             _frames.append(frame)
-        thread._frames = _frames
+        return _frames
+
+    def _make_variables(self, frame, vars, expandable=True):
+        _vars = []
+        for varname, obj in vars:
+            _vars.append(self._make_result(frame, obj, varname, expandable=expandable))
+        return _vars
+
+    def _make_result(self, frame, (varrepr,varhex,vartype,varflags,varhandle), expression,
+                     childText=u'', childIsIndex=False, childIsEnumerate=False, expandable=True):
+        return PythonEvaluationResult(
+            _expression=expression, _objRepr=varrepr, _typeName=vartype, _hexRepr=varhex,
+            _isExpandable=(expandable and bool(varflags & 1)), _isTruncated=bool(varflags & 2),
+            _handle=(varhandle if expandable else 0),
+            _childText=childText, _childIsIndex=childIsIndex,
+            _childIsEnumerate=childIsEnumerate, _frame=frame, _process=self,
+            )
+
+    @on_trait_change('protocol:frameVariables')
+    def frame_variables(self, (thread_id, frame_id, vars)):
+        thread = self._threads.get(thread_id)
+        if thread is None or frame_id >= len(thread._frames):
+            return
+        frame = thread._frames[frame_id]
+        frame._variables = self._make_variables(frame, vars)
+        frame._variablesLoaded = True
+
+    @on_trait_change('protocol:snapshotTaken')
+    def snapshot_taken(self, (brkpt_id, thread_id, capture, thread_name, truncated, frames)):
+        bp = self._breakpoints.get(brkpt_id)
+        if bp is None:
+            return
+        snapshot = PythonSnapshot(
+            _breakpoint=bp, _threadId=thread_id, _threadName=thread_name,
+            _captureNumber=capture, _truncated=truncated,
+            _frames=self._make_snapshot_frames(frames),
+            )
+        bp._snapshots.append(snapshot)
+        self.snapshotTaken = snapshot
 
     @on_trait_change('protocol:moduleLoaded')
     def module_loaded(self, (module_id, filename)):
         self.moduleLoaded = filename
 
+    @on_trait_change('protocol:breakpointConditionDisabled')
+    def breakpoint_condition_disabled(self, (brkpt_id, reason)):
+        bp = self._breakpoints.get(brkpt_id)
+        if bp is not None:
+            bp._conditionDisabledReason = reason
+
+    @on_trait_change('protocol:logPointOutput')
+    def log_point_output(self, messages):
+        for brkpt_id, thread_id, text in messages:
+            bp = self._breakpoints.get(brkpt_id)
+            if bp is not None:
+                self.logPointOutput = (bp, thread_id, text)
+
     #_lineEvent
     #_ids = Instance(IdDispenser)
     #_pendingExecutes
@@ -90,6 +239,8 @@ class PythonProcess(HasStrictTraits):
     _sentExited = Bool()
     _breakpointCounter = Int()
     _setLineResult = Bool()
+    _valueRequestCounter = Int()
+    _valueRequests = Dict() #(int, PythonEvaluationResult)
     _createdFirstThread = Bool()
     _stoppedForException = Bool()
 
@@ -106,7 +257,7 @@ class PythonProcess(HasStrictTraits):
         args = [sys.executable,
                 os.path.join(os.path.dirname(__file__), '..', '..', 'debuggee', 'visualstudio_py_launcher.py'),
                 os.path.dirname(filename),
-                str(self.port),
+                self.socket_path or str(self.port),
                 str(self._processGuid),
                 #'--wait-on-exception',
                 #'--wait-on-exit',
@@ -149,10 +300,14 @@ class PythonProcess(HasStrictTraits):
     def Break(self):
         self.protocol.send_BRKA()
 
-    def AddBreakPoint(self, filename, lineNo, condition, breakWhenChanged = False):
+    def AddBreakPoint(self, filename, lineNo, condition, breakWhenChanged = False, hitCountKind = 0, hitCount = 0,
+                      logMessage = u'', logRateLimit = 0, snapshotCount = 0, snapshotMaxBytes = 0):
         bp = PythonBreakpoint(
             _process=self, _filename=filename, _lineNo=lineNo,
             _breakWhenChanged = breakWhenChanged, _condition=condition,
+            _hitCountKind=hitCountKind, _hitCount=hitCount,
+            _logMessage=logMessage, _logRateLimit=logRateLimit,
+            _snapshotCount=snapshotCount, _snapshotMaxBytes=snapshotMaxBytes,
             )
         self._breakpoints[bp.Id] = bp
         return bp
@@ -160,7 +315,10 @@ class PythonProcess(HasStrictTraits):
     def BindBreakPoint(self, breakpoint):
         self.protocol.send_BRKP(
             breakpoint.Id, breakpoint.LineNo, breakpoint.Filename,
-            breakpoint.Condition, breakpoint.BreakWhenChanged
+            breakpoint.Condition, breakpoint.BreakWhenChanged,
+            breakpoint.HitCountKind, breakpoint.HitCount,
+            breakpoint.LogMessage, breakpoint.LogRateLimit,
+            breakpoint.SnapshotCount, breakpoint.SnapshotMaxBytes
             )
 
     def RemoveBreakPoint(self, breakpoint):
@@ -175,9 +333,73 @@ class PythonProcess(HasStrictTraits):
     def SetBreakPointCondition(self, breakpoint):
         self.protocol.send_BRKC(
             breakpoint.Id, breakpoint.Condition,
-            breakpoint.BreakWhenChanged
+            breakpoint.BreakWhenChanged,
+            breakpoint.HitCountKind, breakpoint.HitCount,
+            breakpoint.LogMessage, breakpoint.LogRateLimit,
+            breakpoint.SnapshotCount, breakpoint.SnapshotMaxBytes
+            )
+
+    def MapFile(self, filename, toDebuggee=True):
+        """ Maps a filename between the debuggee's file system and ours, which
+        are the same for the local processes we debug.
+        """
+        return filename
+
+    def LoadFrameVariables(self, frame):
+        self.protocol.send_FRMV(frame.Thread.Id, frame.FrameId)
+
+    def GetValueChunk(self, result, offset, length):
+        requestId = self._valueRequestCounter
+        self._valueRequestCounter += 1
+        self._valueRequests[requestId] = result
+        self.protocol.send_VALC(
+            result.Expression, result.Frame.Thread.Id, result.Frame.FrameId,
+            requestId, offset, length
+            )
+
+    @on_trait_change('protocol:valueChunk')
+    def value_chunk(self, (request_id, total_length, offset, text)):
+        result = self._valueRequests.pop(request_id, None)
+        if result is not None:
+            self.valueChunk = (result, total_length, offset, text)
+
+    def GetArraySlice(self, result, start, end):
+        requestId = self._valueRequestCounter
+        self._valueRequestCounter += 1
+        self._valueRequests[requestId] = result
+        self.protocol.send_ARRS(
+            result.Expression, result.Frame.Thread.Id, result.Frame.FrameId,
+            requestId, start, end
             )
 
+    def EnumChildren(self, result, offset, count):
+        requestId = self._valueRequestCounter
+        self._valueRequestCounter += 1
+        self._valueRequests[requestId] = result
+        self.protocol.send_CHLD(
+            result.Frame.Thread.Id, result.Handle, requestId, offset, count
+            )
+
+    @on_trait_change('protocol:childrenEnumerated')
+    def children_enumerated(self, (request_id, total, nattr, idx_are_index, idx_are_enum, offset, children)):
+        result = self._valueRequests.pop(request_id, None)
+        if result is None:
+            return
+        _children = []
+        for index, (name, obj) in enumerate(children):
+            isIndex = idx_are_index and offset + index >= nattr
+            _children.append(self._make_result(
+                result.Frame, obj, result.Expression, childText=name,
+                childIsIndex=isIndex, childIsEnumerate=(isIndex and idx_are_enum),
+                ))
+        self.childrenEnumerated = (result, total, offset, _children)
+
+    @on_trait_change('protocol:arraySlice')
+    def array_slice(self, (request_id, start, error, dtype, shape, data)):
+        result = self._valueRequests.pop(request_id, None)
+        if result is not None:
+            self.arraySlice = (result, start, error, dtype, shape, data)
+
     def SetLineNumber(self, frame, lineNo):
         self.protocol.send_SETL(
             frame.Thread.Id, frame.FrameId, LineNo
@@ -200,14 +422,38 @@ class PythonEvaluationResult(HasStrictTraits):
     _hexRepr = Unicode()
 
     _isExpandable = Bool()
+    _isTruncated = Bool()
+    # for expanding the object while its thread is stopped, 0 if it can't be
+    _handle = Int()
     _childIsIndex = Bool()
     _childIsEnumerate = Bool()
 
     _frame = WeakRef()
     _process = WeakRef()
 
-    def GetChildren(self):
-        self._process.EnumChildren(self.Expression, self._frame, self._childIsEnumerate)
+    def GetChildren(self, offset=0, count=CHILDREN_PAGE_SIZE):
+        """ Reads a page of the children of the object, the process fires
+        childrenEnumerated with them and the total number of children.
+        """
+        self._process.EnumChildren(self, offset, count)
+
+    def GetFullValue(self, offset=0, length=64 * 1024):
+        """ Reads part of the full repr of a value whose repr was cut short,
+        the process fires valueChunk with it.
+        """
+        self._process.GetValueChunk(self, offset, length)
+
+    def GetArraySlice(self, start, end):
+        """ Reads rows start to end of a NumPy array as one block, the process
+        fires arraySlice with them.  numpy.frombuffer(data, dtype) reshaped to
+        shape gives back the rows.
+        """
+        self._process.GetArraySlice(self, start, end)
+
+    # the repr was cut short, GetFullValue reads the rest
+    IsTruncated = property(lambda self: self._isTruncated)
+    Handle = property(lambda self: self._handle)
+    Frame = property(lambda self: self._frame)
 
     Expression = Property(Unicode, depends_on='_childText, _expression')
     def _get_Expression(self):
@@ -232,6 +478,8 @@ class PythonStackFrame(HasStrictTraits):
     _endLine = Int()
 
     _variables = List(Instance(PythonEvaluationResult))
+    # False until LoadVariables gets the values of the variables
+    _variablesLoaded = Bool()
 
     _thread = WeakRef() # PythonThread
 
@@ -242,6 +490,14 @@ class PythonStackFrame(HasStrictTraits):
     FunctionName = property(lambda self: self._frameName)
     FileName = property(lambda self: self._thread.Process.MapFile(self._filename, toDebuggee=False))
     FrameId = property(lambda self: self._frameId)
+    VariablesLoaded = property(lambda self: self._variablesLoaded)
+
+    def LoadVariables(self):
+        """ Asks for the values of the variables, the frame only has their
+        names and types until the reply comes back.
+        """
+        if not self._variablesLoaded:
+            self._thread.Process.LoadFrameVariables(self)
 
     def SetVariables(self, variables):
         self._variables = variables
@@ -267,12 +523,31 @@ class PythonThread(HasStrictTraits):
     _isWorkerThread = Bool()
     _name = Unicode()
     _frames = List(Instance(PythonStackFrame))
+    # as of the last GetThreadList
+    _isStopped = Bool()
+    # how many frames the thread has, _frames may only be the innermost ones
+    _frameCount = Int()
 
     Process = property(lambda self: self._process)
     Name = property(lambda self: self._name, lambda self, val: self.trait_set(_name=val))
     Id = property(lambda self: self._identity)
     IsWorkerThread = property(lambda self: self._isWorkerThread)
     Frames = property(lambda self: self._frames, lambda self, val: self.trait_set(_frames, val))
+    IsStopped = property(lambda self: self._isStopped)
+    FrameCount = property(lambda self: self._frameCount)
+
+    def LoadMoreFrames(self, count=FRAME_PAGE_SIZE):
+        """ Asks for the next count frames of a stopped thread after the
+        ones in Frames, which only has the innermost frames of deep stacks.
+        """
+        self._process.LoadMoreFrames(self, count)
+
+    def LoadFrames(self):
+        """ Asks for the thread's frames.  When the process stops only the
+        thread which stopped sends its frames, the frames of the others are
+        as of whenever they were last loaded.
+        """
+        self._process.LoadThreadFrames(self)
 
     def StepInto(self):
         self._process.SendStepInto(self._identity)
@@ -286,6 +561,56 @@ class PythonThread(HasStrictTraits):
         self._process.SendClearStepping(self._identity)
 
 
+class PythonSnapshotFrame(HasStrictTraits):
+    """ A frame a snapshot captured, read only since the frame itself has moved
+    on, so there is nothing to execute text in or set the line of.
+    """
+    _lineNo = Int()
+    _frameName = Unicode()
+    # already mapped to our file system
+    _fileName = Unicode()
+    _argCount = Int()
+    _startLine = Int()
+    _endLine = Int()
+
+    _variables = List(Instance(PythonEvaluationResult))
+
+    StartLine = property(lambda self: self._startLine)
+    EndLine = property(lambda self: self._endLine)
+    LineNo = property(lambda self: self._lineNo)
+    FunctionName = property(lambda self: self._frameName)
+    FileName = property(lambda self: self._fileName)
+    VariablesLoaded = property(lambda self: True)
+
+    @property
+    def Locals(self):
+        return self._variables[self._argCount:]
+
+    @property
+    def Parameters(self):
+        return self._variables[:self._argCount]
+
+
+class PythonSnapshot(HasStrictTraits):
+    """ The stack a snapshot point captured when it was hit, the thread kept
+    running so it's frozen as of then.
+    """
+    _breakpoint = WeakRef() # PythonBreakpoint
+    _threadId = Int()
+    _threadName = Unicode()
+    _captureNumber = Int()
+    _truncated = Bool()
+    _frames = List(Instance(PythonSnapshotFrame))
+
+    Breakpoint = property(lambda self: self._breakpoint)
+    ThreadId = property(lambda self: self._threadId)
+    ThreadName = property(lambda self: self._threadName)
+    CaptureNumber = property(lambda self: self._captureNumber)
+    # frames or variables were left out to fit the snapshot point's max bytes
+    Truncated = property(lambda self: self._truncated)
+    Frames = property(lambda self: self._frames)
+
+
 class PythonBreakpoint(HasStrictTraits):
     _process = WeakRef() # PythonProcess
     _filename = Unicode()
@@ -293,6 +618,14 @@ class PythonBreakpoint(HasStrictTraits):
     _breakpointId = Int()
     _breakWhenChanged = Bool()
     _condition = Unicode()
+    _hitCountKind = Int()
+    _hitCount = Int()
+    _conditionDisabledReason = Unicode()
+    _logMessage = Unicode()
+    _logRateLimit = Int()
+    _snapshotCount = Int()
+    _snapshotMaxBytes = Int()
+    _snapshots = List(Instance(PythonSnapshot))
 
     _counter = itertools.count()
 
@@ -313,9 +646,48 @@ class PythonBreakpoint(HasStrictTraits):
     Condition = property(lambda self: self._condition)
     Id = property(lambda self: self._breakpointId)
     BreakWhenChanged = property(lambda self: self._breakWhenChanged)
+    HitCountKind = property(lambda self: self._hitCountKind)
+    HitCount = property(lambda self: self._hitCount)
+    # set when the debuggee stops evaluating the condition
+    ConditionDisabledReason = property(lambda self: self._conditionDisabledReason)
+    # log points log LogMessage, formatted from the frame, instead of stopping
+    LogMessage = property(lambda self: self._logMessage)
+    LogRateLimit = property(lambda self: self._logRateLimit)
+    IsLogPoint = property(lambda self: bool(self._logMessage))
+    # snapshot points capture the stack of their first SnapshotCount hits
+    # instead of stopping, and collect them in Snapshots
+    SnapshotCount = property(lambda self: self._snapshotCount)
+    SnapshotMaxBytes = property(lambda self: self._snapshotMaxBytes)
+    IsSnapshotPoint = property(lambda self: self._snapshotCount > 0)
+    Snapshots = property(lambda self: self._snapshots)
 
     def SetCondition(self, condition, breakWhenChanged):
         self._condition = condition
         self._breakWhenChanged = breakWhenChanged
+        self._conditionDisabledReason = u''
+        self._process.SetBreakPointCondition(self)
+
+    def SetHitCount(self, hitCountKind, hitCount):
+        self._hitCountKind = hitCountKind
+        self._hitCount = hitCount
+        self._process.SetBreakPointCondition(self)
+
+    def SetLogMessage(self, logMessage, logRateLimit = 0):
+        """ Turns the breakpoint into a log point, or back into a regular
+        breakpoint when logMessage is empty.  The message can include
+        {expression}s and $FUNCTION, $CALLER, $LINE, $TID and $CALLSTACK.
+        """
+        self._logMessage = logMessage
+        self._logRateLimit = logRateLimit
+        self._process.SetBreakPointCondition(self)
+
+    def SetSnapshot(self, snapshotCount, snapshotMaxBytes = 0):
+        """ Turns the breakpoint into a snapshot point which captures the
+        stack of its first snapshotCount hits, each cut down to fit in
+        snapshotMaxBytes, or back into a regular breakpoint when snapshotCount
+        is 0.
+        """
+        self._snapshotCount = snapshotCount
+        self._snapshotMaxBytes = snapshotMaxBytes
         self._process.SetBreakPointCondition(self)
 
@@ -2,7 +2,7 @@ import os
 
 # Enthought library imports.
 from pyface.tasks.api import TraitsDockPane
-from traits.api import Event, List, Instance
+from traits.api import Event, List, Instance, on_trait_change
 from traitsui.api import View, Item, ListStrEditor
 from traitsui.list_str_adapter import ListStrAdapter
 
@@ -39,12 +39,16 @@ class StackPane(TraitsDockPane):
 
     frame_adapter = Instance(StackAdapter, ())
 
+    # Fired to redraw the frames when their variables change
+    refresh_frames = Event()
+
     # The view used to construct the dock pane's widget.
     view = View(Item('stack_frames',
                      editor=ListStrEditor(selected='selected',
                                           horizontal_lines=True,
                                           operations=[],
                                           adapter_name='frame_adapter',
+                                          refresh='refresh_frames',
                                           ),
                      style='custom',
                      enabled_when='len(controller.stack_frames) > 0',
@@ -52,7 +56,14 @@ class StackPane(TraitsDockPane):
                 resizable=True)
 
     def _stack_frames_changed(self, frames):
+        # the frames come with only the names and types of their variables
+        for frame in frames:
+            frame.LoadVariables()
         if frames:
             self.selected = frames[0]
         else:
             self.selected = None
+
+    @on_trait_change('stack_frames:_variables')
+    def _frame_variables_changed(self):
+        self.refresh_frames = True
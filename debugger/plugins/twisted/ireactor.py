@@ -53,3 +53,42 @@ class IReactorTCP(Interface):
                  L{ClientFactory<twisted.internet.protocol.ClientFactory>}
                  docs for details.
         """
+
+
+class IReactorUNIX(Interface):
+
+    def listenUNIX(self, address, factory, backlog=50, mode=0666, wantPID=0):
+        """
+        Listen on a UNIX socket.
+
+        @param address: a path to a unix socket on the filesystem.
+
+        @param factory: a L{twisted.internet.protocol.Factory} instance.
+
+        @param backlog: number of connections to allow in backlog.
+
+        @param mode: The mode (B{not} umask) to set on the unix socket.  See
+            platform specific documentation for information about how this
+            might affect connection attempts.
+
+        @param wantPID: if True, create a pidfile for the socket.
+
+        @return: an object that provides L{IListeningPort}.
+        """
+
+    def connectUNIX(self, address, factory, timeout=30, checkPID=0):
+        """
+        Connect a client protocol to a UNIX socket.
+
+        @param address: a path to a unix socket on the filesystem.
+
+        @param factory: a L{twisted.internet.protocol.ClientFactory} instance
+
+        @param timeout: number of seconds to wait before assuming the
+                        connection has failed.
+
+        @param checkPID: if True, check for a pid file to verify that a server
+                         is listening.
+
+        @return: An object which provides L{IConnector}.
+        """
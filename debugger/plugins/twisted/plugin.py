@@ -11,7 +11,7 @@ from envisage.api import Plugin, ServiceOffer
 from traits.api import Any, HasTraits, List, Instance, implements
 from pyface.util.guisupport import get_app_qt4
 
-from ireactor import IReactorTCP
+from ireactor import IReactorTCP, IReactorUNIX
 
 ID = 'envisage.plugins.twisted'
 
@@ -57,4 +57,8 @@ class TwistedPlugin(Plugin):
             protocol = IReactorTCP,
             factory  = lambda: self.reactor,
         )
-        return [twisted_service_offer]
+        twisted_unix_service_offer = ServiceOffer(
+            protocol = IReactorUNIX,
+            factory  = lambda: self.reactor,
+        )
+        return [twisted_service_offer, twisted_unix_service_offer]